@@ -2,31 +2,154 @@
 Анализатор чатов 
 """
 import asyncio
+import heapq
+import itertools
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Set, Tuple
 from loguru import logger
 
+from cassette import open_cassette
+from clock import Clock, ShiftedClock, clock as default_clock
 from config import config
-from database_sqlite import db
-from vk_client import VKClient
+from database_sqlite import HLL_ALL_CHATS, db
+from vk_client import ChatFetchCache, RateLimiter, VKClient, create_session, latency_tracker, rate_limiter
+from message_columns import MessageColumns
+from dedup import DuplicationEngine
+from overlap import OverlapMatrix
+from hll import HyperLogLog
+from instrumentation import RunMetrics, process_metrics
+from status_resolver import UserStatusResolver
+from concurrency import AdaptiveConcurrencyLimiter
+from token_health import TokenHealthRegistry
+
+# Анализы, выполняющиеся в данный момент (для корректной остановки бота)
+running_analyzers: Set["ChatAnalyzer"] = set()
+
+def _collect_analysis_metrics():
+    """Состояние текущих анализов для /metrics: чаты в работе, лимит, очередь и отложенные чаты"""
+    analyzers = list(running_analyzers)
+    yield "analysis_running", "Number of analysis runs in progress", {}, len(analyzers)
+    yield ("analysis_chats_in_flight", "Chats being analyzed right now", {},
+           sum(analyzer.concurrency.in_flight for analyzer in analyzers))
+    yield ("analysis_concurrency_limit", "Current adaptive limit of parallel chats", {},
+           sum(analyzer.concurrency.limit for analyzer in analyzers))
+    yield ("analysis_queue_depth", "Chats waiting in the analysis queue", {},
+           sum(analyzer.queue_depth for analyzer in analyzers))
+    yield ("analysis_deferred_chats", "Chats deferred after flood control and waiting to be retried", {},
+           sum(analyzer.deferred_count for analyzer in analyzers))
+
+async def stop_running_analyzers():
+    """Останавливает все выполняющиеся анализы, оставляя журнал в согласованном состоянии"""
+    analyzers = list(running_analyzers)
+    for analyzer in analyzers:
+        analyzer.request_stop()
+    for analyzer in analyzers:
+        await analyzer.wait_finished()
+
+async def sync_chat_history(db_instance, vk_client: VKClient, group_id: str) -> int:
+    """Догружает в историю сообщения чата новее сохраненной отметки
+
+    Возвращает начало окна анализа (unix time).
+    """
+    window_start = int((vk_client.clock.now() - timedelta(days=config.ANALYSIS_WINDOW_DAYS)).timestamp())
+    sync_state = await db_instance.get_sync_state(group_id)
+    
+    if sync_state and sync_state['last_message_date'] >= window_start:
+        # Вся история до отметки уже есть в базе - запрашиваем только новые сообщения
+        new_messages, newest = await vk_client.get_new_messages(sync_state['last_message_id'])
+    else:
+        # Первый запуск или отметка вышла за окно анализа - загружаем окно целиком
+        new_messages, newest = await vk_client.fetch_window_messages(config.ANALYSIS_WINDOW_DAYS)
+    
+    # Загрузка прервана на середине - неполную историю и отметку не сохраняем
+    if vk_client.interrupted:
+        return window_start
+    
+    if new_messages:
+        await db_instance.save_history_messages(group_id, new_messages)
+    if newest:
+        await db_instance.save_sync_state(group_id, newest['id'], newest['date'])
+    
+    return window_start
 
 class ChatAnalyzer:
     """Анализатор чатов"""
     
-    def __init__(self, db_instance=None):
+    def __init__(self, db_instance=None, clock: Clock = None, client_class=None):
         self.db = db_instance or db
+        self.clock = clock or default_clock  # Время и паузы анализа (виртуальные в симуляции)
+        self.client_class = client_class or VKClient  # Класс клиента VK (в симуляции - без HTTP)
         self.total_members = 0
         self.total_messages = 0
         self.duplicated_users = 0
         self.filtered_messages = 0
-        self.all_results = []
-        self.user_chats = {}  # user_id -> [chat_names]
+        self.duplication = DuplicationEngine()  # Счетчик вхождений пользователей, пополняется по мере обработки чатов
+        self.failed_results: Dict[str, Dict[str, Any]] = {}  # group_id -> результат чата с ошибкой (без данных)
         self.duplicated_users_set = set()
+        self.session = None  # Общая HTTP сессия для всех VK клиентов текущего анализа
+        self.fetch_caches: Dict[str, ChatFetchCache] = {}  # group_id -> данные чата, загруженные в этом анализе
+        self.status_resolver = None  # Общая для всех чатов проверка статусов пользователей
+        self.token_health = None  # Реестр состояния токенов (проверка перед анализом и карантин)
+        self.cassette = None  # Запись или воспроизведение ответов VK текущего анализа (VK_CASSETTE_MODE)
+        self.metrics = None  # RunMetrics текущего анализа: время этапов, запросы VK, детализация по чатам
+        self.run_id = None  # id строки analysis_runs завершенного анализа
+        self._queue: asyncio.Queue = None  # Очередь чатов пула воркеров (для метрик процесса)
+        self._deferred: List[Tuple[float, int, int, Dict[str, Any], float]] = []  # Отложенные после flood control
+        self.quarantined_tokens: Dict[str, str] = {}  # токен -> причина карантина
+        self.deferrals: Dict[str, Dict[str, Any]] = {}  # group_id -> сколько раз и на сколько секунд чат откладывался
+        self.concurrency = AdaptiveConcurrencyLimiter(clock=self.clock)  # Лимит параллельных чатов, подстраивается под ответы VK
+        # Лимит запросов общий для процесса (токены те же, что у Long Poll); со своими часами - отдельный
+        self.rate_limiter = rate_limiter if clock is None else RateLimiter(clock=self.clock)
+        self.run_date = None  # Дата анализа, под которой чаты записываются в журнал
+        self._stop_event = asyncio.Event()
+        self._finished_event = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+    
+    @property
+    def queue_depth(self) -> int:
+        """Чатов, ожидающих обработки: в очереди пула воркеров и у воркеров в ожидании слота"""
+        return (self._queue.qsize() if self._queue else 0) + self.concurrency.waiting
+    
+    @property
+    def deferred_count(self) -> int:
+        """Чатов, отложенных после flood control и ожидающих повтора"""
+        return len(self._deferred)
+    
+    def request_stop(self):
+        """Просит анализ остановиться: чаты в работе прерываются, обработанные остаются в журнале"""
+        if self._stop_event.is_set():
+            return
+        logger.warning("Stop requested, interrupting chat analysis")
+        self._stop_event.set()
+        for worker in self._workers:
+            worker.cancel()
+    
+    async def wait_finished(self):
+        """Ожидает завершения анализа"""
+        await self._finished_event.wait()
+    
+    async def analyze_all_chats(self, batch_size: int = 100, vk_chats: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Анализ всех чатов с логикой старого бота
+        
+        batch_size задает, через сколько обработанных чатов выводить прогресс.
+        vk_chats - чаты для анализа (по умолчанию из CSV).
+        Чаты, уже обработанные сегодня прерванным анализом, берутся из журнала.
+        """
+        # Состояние анализов попадает в /metrics с первого запущенного анализа
+        process_metrics.add_collector(_collect_analysis_metrics)
+        running_analyzers.add(self)
+        self._finished_event.clear()
+        try:
+            return await self._analyze_all_chats(batch_size, vk_chats)
+        finally:
+            running_analyzers.discard(self)
+            self._finished_event.set()
     
-    async def analyze_all_chats(self, batch_size: int = 100) -> List[Dict[str, Any]]:
-        """Анализ всех чатов с логикой старого бота"""
+    async def _analyze_all_chats(self, batch_size: int, vk_chats: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Основные шаги анализа всех чатов"""
         # Получаем чаты из CSV или fallback на статический список
-        vk_chats = config.get_vk_chats()
+        if vk_chats is None:
+            vk_chats = config.get_vk_chats()
         
         if not vk_chats:
             logger.error("No VK chats available for analysis. Please upload CSV file first.")
@@ -34,78 +157,134 @@ class ChatAnalyzer:
         
         logger.info(f"Starting parallel analysis of {len(vk_chats)} chats with old logic")
         
-        # Если чатов много, обрабатываем пакетами
-        if len(vk_chats) > batch_size:
-            # Обрабатываем пакетами, но НЕ возвращаем результат сразу
-            await self._analyze_chats_in_batches(batch_size)
-            # self.all_results уже заполнен в _analyze_chats_in_batches
-        else:
-            # Обычная обработка для небольшого количества чатов
-            # Шаг 1: Анализируем чаты параллельно (по 5 одновременно для стабильности)
-            semaphore = asyncio.Semaphore(5)  # Максимум 5 параллельных чатов для стабильности
-            
-            async def analyze_chat_with_semaphore(chat_config, index):
-                async with semaphore:
-                    group_id = chat_config["group_id"]
-                    token = chat_config["token"]
-                    chat_name = f"Chat {index+1}"
-                    
-                    try:
-                        logger.info(f"Analyzing chat {index+1}/{len(config.VK_CHATS)}: {chat_name} (Group ID: {group_id})")
-                        return await self._analyze_single_chat(group_id, token, chat_name)
-                    except Exception as e:
-                        logger.error(f"Failed to analyze chat {group_id}: {e}")
-                        return None
-            
-            # Создаем задачи для всех чатов
-            tasks = [
-                analyze_chat_with_semaphore(chat_config, i) 
-                for i, chat_config in enumerate(vk_chats)
-            ]
-            
-            # Обрабатываем все чаты параллельно
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Фильтруем успешные результаты
-            self.all_results = [r for r in results if r is not None and not isinstance(r, Exception)]
+        # База данных нужна уже на этапе загрузки (история сообщений и отметки синхронизации)
+        if not hasattr(self.db, 'connection') or self.db.connection is None:
+            await self.db.initialize()
+        
+        # Запись ответов VK или их воспроизведение (VK_CASSETTE_MODE). При воспроизведении окно
+        # анализа и дата считаются от момента записи, иначе ответы кассеты устаревают
+        self.cassette = open_cassette(self.clock.now())
+        if self.cassette and self.cassette.replaying and self.cassette.recorded_at:
+            self.clock = ShiftedClock(self.cassette.recorded_at, self.clock)
+        self.metrics = RunMetrics(self.clock)
+        
+        # Продолжаем прерванный сегодня анализ: уже обработанные чаты берем из журнала.
+        # Журнал хранит данные каждого завершенного чата на диске и служит вторым проходом
+        self.run_date = self.clock.now().date()
+        await self.db.clear_journal(before_date=self.run_date)
+        self.duplication = DuplicationEngine()
+        self.failed_results = {}
+        self.deferrals = {}
+        journaled = await self._count_journaled_members()
+        pending_chats = [chat for chat in vk_chats if chat["group_id"] not in journaled]
+        if journaled:
+            logger.info(f"Resuming analysis: {len(vk_chats) - len(pending_chats)} chats restored from journal, {len(pending_chats)} remaining")
+        
+        # Один пул соединений на весь анализ вместо новой сессии для каждого чата
+        self.session = create_session()
+        self.status_resolver = UserStatusResolver(self.db, clock=self.clock)
+        try:
+            # Шаг 0: проверяем токены, чаты с токенами в карантине пропускаем
+            self.token_health = TokenHealthRegistry(self.db, self.session, client_class=self.client_class,
+                                                    cassette=self.cassette, clock=self.clock, limiter=self.rate_limiter,
+                                                    concurrency=self.concurrency)
+            with self.metrics.phase("preflight"):
+                self.quarantined_tokens = await self.token_health.preflight(pending_chats)
+            for chat in pending_chats:
+                if chat["token"] in self.quarantined_tokens:
+                    self.failed_results[chat["group_id"]] = self._quarantined_result(
+                        chat["group_id"], chat.get("chat_name", chat["group_id"]), self.quarantined_tokens[chat["token"]]
+                    )
+                    self._record_chat_outcome(self.failed_results[chat["group_id"]])
+            pending_chats = [chat for chat in pending_chats if chat["token"] not in self.quarantined_tokens]
+            
+            # Шаг 1 (первый проход): анализируем чаты пулом воркеров, каждый завершенный чат
+            # записывается в журнал и учитывается в счетчике вхождений пользователей
+            with self.metrics.phase("fetch"):
+                await self._analyze_chats_streaming(pending_chats, batch_size)
+        finally:
+            await self.status_resolver.close()
+            self.status_resolver = None
+            await self.session.close()
+            self.session = None
+            self.fetch_caches.clear()
+            if self.cassette:
+                self.cassette.close()
+        
+        # Удаляем из истории сообщения, вышедшие за окно анализа
+        window_start = int((self.clock.now() - timedelta(days=config.ANALYSIS_WINDOW_DAYS)).timestamp())
+        overlaps_start = (self.clock.now() - timedelta(days=config.OVERLAP_RETENTION_DAYS)).date()
+        with self.metrics.phase("database"):
+            pruned_messages = await self.db.prune_message_history(window_start)
+            pruned_overlaps = await self.db.prune_chat_overlaps(overlaps_start)
+            pruned_sketches = await self.db.prune_hll_sketches(datetime.fromtimestamp(window_start).date())
+            await self.db.prune_live_member_events(window_start)
+        logger.info(f"Pruned {pruned_messages} messages older than {config.ANALYSIS_WINDOW_DAYS} days from history")
+        logger.info(f"Pruned {pruned_sketches} HyperLogLog sketches older than {config.ANALYSIS_WINDOW_DAYS} days")
+        logger.info(f"Pruned {pruned_overlaps} chat overlaps older than {config.OVERLAP_RETENTION_DAYS} days")
+        
+        if self._stop_event.is_set():
+            journal_size = len(await self.db.get_journal_group_ids(self.run_date))
+            logger.warning(f"Analysis stopped: {journal_size} chats checkpointed, the next run will resume from the journal")
+            return []
         
-        logger.info(f"Successfully analyzed {len(self.all_results)} out of {len(vk_chats)} chats")
+        analyzed_count = len(await self.db.get_journal_group_ids(self.run_date)) + len(self.failed_results)
+        logger.info(f"Successfully analyzed {analyzed_count} out of {len(vk_chats)} chats")
+        logger.info(f"VK rate limiter: {self.rate_limiter.get_totals()}")
+        logger.info(f"VK latency: {latency_tracker.get_stats()}")
+        logger.info(f"Chat concurrency: {self.concurrency.get_stats()}")
+        for token_name, token_stats in self.rate_limiter.get_stats().items():
+            logger.debug(f"VK rate limiter {token_name}: {token_stats}")
         
-        # Шаг 2: Анализируем дублирование пользователей
-        duplication_info = self._analyze_user_duplication()
-        logger.info(f"Duplication analysis: {duplication_info['duplication_stats']}")
+        # Шаг 2: Дублирование пользователей уже подсчитано в первом проходе
+        logger.info(f"Duplication analysis: {self.duplication.get_stats()}")
         
-        # Шаг 3: Фильтруем данные (исключаем дублированных пользователей)
-        filtered_results = self._filter_duplicated_data(duplication_info['duplicated_users'])
+        # Шаги 3-4 (второй проход): фильтруем и сохраняем чаты по одному в порядке CSV
+        filtered_results, saved = await self._save_filtered_results(vk_chats)
         
-        # Шаг 4: Сохраняем в базу данных 
-        await self._save_to_database_optimized(filtered_results)
+        # Анализ завершен полностью - журнал для продолжения больше не нужен. Если сохранение
+        # не удалось, журнал остается: следующий запуск повторит второй проход без запросов к VK
+        if saved:
+            await self.db.clear_journal()
+        else:
+            logger.warning("Results were not saved, keeping the analysis journal for the next run")
         
         # Шаг 5: Возвращаем итоговую статистику
-        return self._calculate_final_stats(filtered_results)
+        final_results = self._calculate_final_stats(filtered_results)
+        await self._save_run_metrics()
+        return final_results
     
     async def _analyze_single_chat(self, group_id: str, token: str, chat_name: str) -> Dict[str, Any]:
         """Анализ одного чата"""
+        # Токен мог попасть в карантин при анализе другого чата с тем же токеном
+        if token in self.quarantined_tokens:
+            return self._quarantined_result(group_id, chat_name, self.quarantined_tokens[token])
+        
+        fetch_cache = self.fetch_caches.setdefault(group_id, ChatFetchCache())
+        vk_client = self.client_class(token, limiter=self.rate_limiter, session=self.session, cache=fetch_cache,
+                                      status_resolver=self.status_resolver, concurrency=self.concurrency,
+                                      defer_flood_control=True, clock=self.clock, cassette=self.cassette, metrics=self.metrics)
         try:
-            vk_client = VKClient(token)
             await vk_client.initialize()
             
-            # Получаем участников с fallback на сообщения
+            # Получаем сообщения за окно анализа (догружаем только новые).
+            # История загружается первой и попадает в кэш чата, чтобы fallback
+            # получения участников не обходил ее повторно
+            messages, last_message_id = await self._sync_chat_messages(vk_client, group_id)
+            fetch_cache.chat_messages[config.ANALYSIS_WINDOW_DAYS] = messages
+            
+            # Получаем участников с fallback на сообщения. Изменения состава, полученные Long Poll
+            # после этого момента, применяются поверх снимка при сохранении
+            fetched_at = int(self.clock.time())
             members = await vk_client.get_chat_members_with_fallback()
             members_count = len(members)
             
             # Получаем общее количество сообщений
             total_messages = await vk_client.get_total_messages_count()
+            month_ago = int((self.clock.now() - timedelta(days=config.ANALYSIS_WINDOW_DAYS)).timestamp())
+            current_time = int(self.clock.now().timestamp())
             
-            # Получаем сообщения за последний месяц
-            messages = await vk_client.get_chat_messages()
-            month_ago = int((datetime.now() - timedelta(days=30)).timestamp())
-            current_time = int(datetime.now().timestamp())
-            
-            month_messages = [
-                msg for msg in messages 
-                if month_ago <= msg.get('date', 0) <= current_time
-            ]
+            month_messages = messages.between(month_ago, current_time)
             # Сообщения уже отфильтрованы в VK Client (удалены от неактивных пользователей)
             real_month_messages = month_messages
             
@@ -113,7 +292,7 @@ class ChatAnalyzer:
             validation_warning = None
             if not members and real_month_messages:
                 # Если участников нет, но есть сообщения - используем авторов сообщений
-                message_authors = list(set(msg.get("from_id", 0) for msg in real_month_messages if msg.get("from_id", 0) > 0))
+                message_authors = list(real_month_messages.authors())
                 if message_authors:
                     # Проверяем статус авторов
                     author_statuses = await vk_client.check_users_status(message_authors)
@@ -126,13 +305,24 @@ class ChatAnalyzer:
                     else:
                         # Если нет активных авторов сообщений, очищаем сообщения
                         logger.warning(f"Chat {group_id}: No active message authors found, clearing messages")
-                        real_month_messages = []
+                        real_month_messages = MessageColumns()
                         validation_warning = "Messages cleared - no active authors"
                 else:
                     # Если нет авторов сообщений, очищаем сообщения
-                    real_month_messages = []
+                    real_month_messages = MessageColumns()
                     validation_warning = "Messages cleared - no message authors"
             
+            # После ошибки авторизации клиент больше не обращался к VK - данные чата неполные
+            if vk_client.token_invalid:
+                if token not in self.quarantined_tokens:
+                    self.quarantined_tokens[token] = await self.token_health.quarantine(token, vk_client.last_error)
+                return self._quarantined_result(group_id, chat_name, self.quarantined_tokens[token])
+            
+            # Flood control: чат будет отложен, загруженные данные неполные
+            if vk_client.flood_control:
+                return self._failed_result(group_id, chat_name, f"Flood control: {vk_client.flood_control['error_msg']}",
+                                           flood_control=True)
+            
             result = {
                 "chat_name": chat_name,
                 "group_id": group_id,
@@ -142,13 +332,14 @@ class ChatAnalyzer:
                 "members_count": members_count,
                 "messages_last_month": len(real_month_messages),
                 "total_messages": len(real_month_messages),  # Используем отфильтрованные сообщения
-                "analysis_date": datetime.now().strftime('%d.%m.%Y %H:%M'),
-                "validation_warning": validation_warning
+                "analysis_date": self.clock.now().strftime('%d.%m.%Y %H:%M'),
+                "validation_warning": validation_warning,
+                "last_message_id": last_message_id,
+                "fetched_at": fetched_at
             }
             
-            logger.info(f"Chat {group_id} analyzed: {members_count} members, {len(real_month_messages)} messages")
+            logger.info(f"Chat {group_id} analyzed: {members_count} members, {len(real_month_messages)} messages (concurrency limit {self.concurrency.limit})")
             
-            await vk_client.close()
             return result
             
         except Exception as e:
@@ -159,113 +350,117 @@ class ChatAnalyzer:
                 "group_id": group_id,
                 "peer_id": 2000000001,
                 "all_members": [],
-                "all_messages": [],
+                "all_messages": MessageColumns(),
                 "members_count": 0,
                 "messages_last_month": 0,
                 "total_messages": 0,
-                "analysis_date": datetime.now().strftime('%d.%m.%Y %H:%M'),
+                "analysis_date": self.clock.now().strftime('%d.%m.%Y %H:%M'),
                 "error": str(e)
             }
+        finally:
+            # Закрывает только собственную сессию клиента, общая сессия закрывается после анализа
+            await vk_client.close()
+            self.metrics.chat(group_id)["vk_requests"] += vk_client.requests_sent
     
-    def _analyze_user_duplication(self) -> Dict[str, Any]:
-        """Анализирует дублирование пользователей между чатами"""
-        user_chats = {}
-        
-        for result in self.all_results:
-            chat_name = result['chat_name']
-            for user_id in result['all_members']:
-                if user_id not in user_chats:
-                    user_chats[user_id] = []
-                user_chats[user_id].append(chat_name)
-        
-        duplicated_users = []
-        unique_users = []
-        
-        for user_id, chats in user_chats.items():
-            if len(chats) > 1:  # Дублированный если в более чем 1 чате
-                duplicated_users.append(user_id)
-            else:
-                unique_users.append(user_id)
+    def _failed_result(self, group_id: str, chat_name: str, error: str, **extra) -> Dict[str, Any]:
+        """Пустой результат чата, который не удалось проанализировать"""
+        return {
+            "chat_name": chat_name,
+            "group_id": group_id,
+            "peer_id": 2000000001,
+            "all_members": [],
+            "all_messages": MessageColumns(),
+            "members_count": 0,
+            "messages_last_month": 0,
+            "total_messages": 0,
+            "analysis_date": self.clock.now().strftime('%d.%m.%Y %H:%M'),
+            "error": error,
+            **extra
+        }
+    
+    def _quarantined_result(self, group_id: str, chat_name: str, reason: str) -> Dict[str, Any]:
+        """Результат чата, пропущенного из-за токена в карантине"""
+        return self._failed_result(group_id, chat_name, f"Token quarantined: {reason}", quarantine_reason=reason)
+    
+    async def _sync_chat_messages(self, vk_client: VKClient, group_id: str) -> Tuple[MessageColumns, int]:
+        """Догружает новые сообщения чата в историю
+        
+        Возвращает сообщения активных авторов за окно анализа и самый новый id в прочитанной истории:
+        более новые сообщения анализ не видел, их сохраняет Long Poll.
+        """
+        window_start = await sync_chat_history(self.db, vk_client, group_id)
+        window_messages = await self.db.get_history_columns(group_id, window_start)
+        last_message_id = max(window_messages.ids, default=0)
+        return await vk_client.filter_active_messages(window_messages), last_message_id
+    
+    async def _count_journaled_members(self) -> Set[str]:
+        """Учитывает в счетчике вхождений участников чатов, уже записанных в журнал
+
+        Чаты загружаются из журнала по одному. Возвращает их group_id.
+        """
+        journaled = set()
+        for group_id in await self.db.get_journal_group_ids(self.run_date):
+            result = await self.db.get_journal_result(self.run_date, group_id)
+            if result is not None:
+                self.duplication.add_members(result['all_members'])
+                journaled.add(group_id)
+        return journaled
+    
+    def _filter_duplicated_data(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Фильтрует данные чата, оставляя только пользователей из одного чата"""
+        # Фильтруем участников (исключаем только дублированных, удаленные уже отфильтрованы)
+        filtered_members = self.duplication.filter_members(result['all_members'])
+        
+        # Фильтруем сообщения (исключаем только от дублированных пользователей, удаленные уже отфильтрованы)
+        filtered_messages = self.duplication.filter_messages(result['all_messages'])
         
-        self.user_chats = user_chats
-        self.duplicated_users_set = set(duplicated_users)
+        # Дополнительная проверка: если нет участников, очищаем все сообщения
+        if len(filtered_members) == 0:
+            filtered_messages = MessageColumns()
         
         return {
-            'user_chats': user_chats,
-            'duplicated_users': duplicated_users,
-            'unique_users': unique_users,
-            'duplication_stats': {
-                'total_users': len(user_chats),
-                'duplicated_count': len(duplicated_users),
-                'unique_count': len(unique_users)
-            }
+            "chat_name": result['chat_name'],
+            "group_id": result['group_id'],
+            "peer_id": result['peer_id'],
+            "members_count": len(filtered_members),
+            "messages_last_month": len(filtered_messages),
+            "total_messages": len(filtered_messages),  # Используем отфильтрованные сообщения
+            "analysis_date": result['analysis_date'],
+            "excluded_members": len(result['all_members']) - len(filtered_members),
+            "excluded_messages": len(result['all_messages']) - len(filtered_messages),
+            "quarantine_reason": result.get('quarantine_reason'),
+            "last_message_id": result.get('last_message_id'),
+            "fetched_at": result.get('fetched_at'),
+            "filtered_members": filtered_members,
+            "filtered_messages": filtered_messages
         }
     
-    def _filter_duplicated_data(self, duplicated_users: List[int]) -> List[Dict[str, Any]]:
-        """Фильтрует данные, оставляя только пользователей из одного чата"""
-        filtered_results = []
-        
-        for result in self.all_results:
-            # Фильтруем участников (исключаем только дублированных, удаленные уже отфильтрованы)
-            filtered_members = [
-                user_id for user_id in result['all_members'] 
-                if user_id not in duplicated_users
-            ]
-            
-            # Фильтруем сообщения (исключаем только от дублированных пользователей, удаленные уже отфильтрованы)
-            filtered_messages = [
-                msg for msg in result['all_messages']
-                if msg.get('from_id', 0) not in duplicated_users
-            ]
-            
-            # Дополнительная проверка: если нет участников, очищаем все сообщения
-            if len(filtered_members) == 0:
-                filtered_messages = []
-            
-            # Создаем отфильтрованный результат
-            filtered_result = {
-                "chat_name": result['chat_name'],
-                "group_id": result['group_id'],
-                "peer_id": result['peer_id'],
-                "members_count": len(filtered_members),
-                "messages_last_month": len(filtered_messages),
-                "total_messages": len(filtered_messages),  # Используем отфильтрованные сообщения
-                "analysis_date": result['analysis_date'],
-                "excluded_members": len(result['all_members']) - len(filtered_members),
-                "excluded_messages": len(result['all_messages']) - len(filtered_messages),
-                "filtered_members": filtered_members,
-                "filtered_messages": filtered_messages
-            }
-            
-            filtered_results.append(filtered_result)
+    async def _cleanup_old_data(self, vk_chats: List[Dict[str, Any]]):
+        """Очищает старые данные перед сохранением новых результатов анализа
         
-        return filtered_results
-    
-    async def _cleanup_old_data(self):
-        """Очищает старые данные перед сохранением новых результатов анализа"""
+        Чаты не пересоздаются (на их ID ссылаются строки Long Poll): удаляются только чаты,
+        которых больше нет в списке, а участники и сообщения остальных заменяются при сохранении.
+        """
         try:
             logger.info("Cleaning up old data before saving new analysis results...")
             
-            # Удаляем все старые сообщения
-            async with self.db.connection.execute("DELETE FROM messages") as cursor:
-                deleted_messages = cursor.rowcount
-                logger.info(f"Deleted {deleted_messages} old messages")
-            
-            # Удаляем всех старых участников чатов
-            async with self.db.connection.execute("DELETE FROM chat_members") as cursor:
-                deleted_members = cursor.rowcount
-                logger.info(f"Deleted {deleted_members} old chat members")
+            deleted_chats = await self.db.delete_chats_except(chat["group_id"] for chat in vk_chats)
+            logger.info(f"Deleted {deleted_chats} chats that are no longer configured")
             
             # Удаляем старую статистику (оставляем только исторические данные старше сегодня)
-            today = datetime.now().date()
+            today = self.clock.now().date()
             async with self.db.connection.execute("DELETE FROM daily_stats WHERE stat_date = ?", (today,)) as cursor:
                 deleted_stats = cursor.rowcount
                 logger.info(f"Deleted {deleted_stats} old daily stats for today")
             
-            # Удаляем все старые чаты (они будут пересозданы с актуальными данными)
-            async with self.db.connection.execute("DELETE FROM chats") as cursor:
-                deleted_chats = cursor.rowcount
-                logger.info(f"Deleted {deleted_chats} old chats")
+            # Удаляем скетчи сегодняшнего анализа и скетчи по дням в окне анализа (они будут пересчитаны)
+            window_start = (self.clock.now() - timedelta(days=config.ANALYSIS_WINDOW_DAYS)).date()
+            async with self.db.connection.execute("""
+                DELETE FROM hll_sketches
+                WHERE (kind IN ('members', 'messages', 'authors') AND stat_date = ?)
+                   OR (kind IN ('day_messages', 'day_authors') AND stat_date >= ?)
+            """, (today, window_start)):
+                pass
             
             # Коммитим изменения
             await self.db.connection.commit()
@@ -277,101 +472,169 @@ class ChatAnalyzer:
             await self.db.connection.rollback()
             raise
     
-    async def _save_to_database_optimized(self, filtered_results: List[Dict[str, Any]]):
-        """Сохранение отфильтрованных данных в базу данных"""
+    async def _save_filtered_results(self, vk_chats: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Второй проход: фильтрует и сохраняет чаты по одному
+        
+        В памяти одновременно находятся данные только одного чата, в результат попадают только счетчики.
+        Возвращает сводки чатов и признак того, что сохранение завершилось коммитом.
+        """
+        summaries = []
+        saved = False
         try:
             # Убеждаемся, что база данных инициализирована
             if not hasattr(self.db, 'connection') or self.db.connection is None:
                 await self.db.initialize()
             
             # Очищаем старые данные перед сохранением новых
-            await self._cleanup_old_data()
-            
-            # Собираем все данные для batch операций
-            all_users = set()
-            all_messages = []
-            all_stats = []
-            
-            # Предварительно собираем всех пользователей
-            for result in filtered_results:
-                all_users.update(str(user_id) for user_id in result['filtered_members'])
-                all_users.update(str(msg.get("from_id", "")) for msg in result['filtered_messages'])
-            
-            # Batch сохранение пользователей
-            user_id_map = {}
-            logger.info(f"Saving {len(all_users)} users to database")
-            for user_id in all_users:
-                if user_id:
-                    db_user_id = await self.db.save_user(user_id)
-                    user_id_map[user_id] = db_user_id
-            
-            # Обрабатываем каждый чат
-            logger.info(f"Processing {len(filtered_results)} chats for database saving")
-            for result in filtered_results:
-                # Сохраняем чат
-                logger.info(f"Saving chat {result['chat_name']} with {len(result['filtered_members'])} members")
-                chat_id = await self.db.save_chat(
-                    result['group_id'], 
-                    result['chat_name'], 
-                    len(result['filtered_members'])
-                )
+            with self.metrics.phase("database"):
+                await self._cleanup_old_data(vk_chats)
+            
+            saved_messages = 0
+            overlap = OverlapMatrix(self.duplication.duplicated_users)
+            all_chats_sketches = {kind: HyperLogLog() for kind in ('members', 'messages', 'authors')}
+            day_sketches: Dict[Any, Dict[str, HyperLogLog]] = {}
+            snapshots = []
+            for chat in vk_chats:
+                group_id = chat["group_id"]
+                started_at = self.clock.monotonic()
+                with self.metrics.phase("database"):
+                    result = self.failed_results.get(group_id) or await self.db.get_journal_result(self.run_date, group_id)
+                if result is None:
+                    continue
                 
-                # Сохраняем участников чата
-                for user_id in result['filtered_members']:
-                    if str(user_id) in user_id_map:
-                        await self.db.save_chat_member(
-                            chat_id, user_id_map[str(user_id)], str(user_id), "", "", ""
-                        )
+                with self.metrics.phase("overlaps"):
+                    overlap.add_chat(group_id, result['all_members'])
+                with self.metrics.phase("dedup"):
+                    filtered_result = self._filter_duplicated_data(result)
+                deferral = self.deferrals.get(group_id, {"count": 0, "seconds": 0.0})
+                filtered_result['deferrals'] = deferral['count']
+                filtered_result['deferred_seconds'] = round(deferral['seconds'])
+                with self.metrics.phase("database"):
+                    chat_id = await self._save_chat_result(filtered_result)
+                    if filtered_result['fetched_at'] is not None:
+                        snapshots.append((chat_id, group_id, filtered_result['fetched_at']))
+                    await self._save_chat_sketches(filtered_result, all_chats_sketches, day_sketches)
+                saved_messages += filtered_result['messages_last_month']
                 
-                # Собираем сообщения для batch сохранения
-                for message in result['filtered_messages']:
-                    user_vk_id = str(message.get("from_id", ""))
-                    if user_vk_id in user_id_map:
-                        all_messages.append((
-                            str(message.get("id", "")),
-                            chat_id,
-                            user_id_map[user_vk_id],
-                            message.get("text", ""),
-                            datetime.fromtimestamp(message.get("date", 0))
-                        ))
+                chat_metrics = self.metrics.chat(group_id)
+                if not chat_metrics["attempts"] and 'error' not in result:
+                    chat_metrics["status"] = "restored"
+                chat_metrics["members"] = filtered_result['members_count']
+                chat_metrics["messages"] = filtered_result['messages_last_month']
+                chat_metrics["save_seconds"] = self.clock.monotonic() - started_at
                 
-                # Собираем статистику
-                unique_members = len(set(result['filtered_members']))
-                unique_messages = len(result['filtered_messages'])
+                del filtered_result['filtered_members'], filtered_result['filtered_messages']
+                summaries.append(filtered_result)
+            
+            with self.metrics.phase("overlaps"):
+                await self._save_overlaps(overlap, summaries)
+            with self.metrics.phase("database"):
+                await self._apply_live_member_changes(snapshots)
+                await self.db.save_hll_sketches(
+                    [(self.run_date, HLL_ALL_CHATS, kind, sketch) for kind, sketch in all_chats_sketches.items()] +
+                    [(day, HLL_ALL_CHATS, kind, sketch) for day, sketches in day_sketches.items() for kind, sketch in sketches.items()]
+                )
                 
-                all_stats.append((
-                    chat_id,
-                    datetime.now(),
-                    len(result['filtered_members']),
-                    len(result['filtered_messages']),
-                    unique_members,
-                    unique_messages
-                ))
-            
-            # Batch сохранение сообщений
-            for message_data in all_messages:
-                await self.db.save_message(*message_data)
-            
-            # Batch сохранение статистики
-            for stats_data in all_stats:
-                await self.db.save_daily_stats(*stats_data)
-            
-            # Коммитим все изменения
-            await self.db.connection.commit()
-            logger.info(f"Saved {len(all_messages)} messages and {len(all_stats)} stats records")
+                # Коммитим все изменения
+                await self.db.connection.commit()
+            saved = True
+            logger.info(f"Saved {saved_messages} messages and {len(summaries)} stats records")
                 
         except Exception as e:
             logger.error(f"Failed to save to database: {e}")
+        
+        return summaries, saved
+    
+    async def _save_chat_sketches(self, result: Dict[str, Any], all_chats_sketches: Dict[str, HyperLogLog],
+                                  day_sketches: Dict[Any, Dict[str, HyperLogLog]]):
+        """Сохраняет скетчи HyperLogLog чата и пополняет общие скетчи по всем чатам и по дням"""
+        messages: MessageColumns = result['filtered_messages']
+        chat_sketches = {kind: HyperLogLog() for kind in ('members', 'messages', 'authors')}
+        chat_sketches['members'].update(result['filtered_members'])
+        # Скетчи чата за день анализа - для активности за сегодня по выбранным чатам
+        today_sketches = {kind: HyperLogLog() for kind in ('day_messages', 'day_authors')}
+        
+        # Сохраняются только сообщения пользователей (положительные from_id)
+        days = {}  # Час -> день, чтобы не вычислять дату для каждого сообщения
+        day_authors = set()
+        for message_id, from_id, message_date in messages:
+            if from_id <= 0:
+                continue
+            hour = message_date // 3600
+            day = days.get(hour)
+            if day is None:
+                day = days[hour] = datetime.fromtimestamp(message_date).date()
+            if day not in day_sketches:
+                day_sketches[day] = {'day_messages': HyperLogLog(), 'day_authors': HyperLogLog()}
+            day_sketches[day]['day_messages'].add(message_id)
+            chat_sketches['messages'].add(message_id)
+            if day == self.run_date:
+                today_sketches['day_messages'].add(message_id)
+            day_authors.add((day, from_id))
+        
+        # Каждого автора хешируем один раз на чат и один раз на день
+        chat_sketches['authors'].update(messages.authors())
+        for day, from_id in day_authors:
+            day_sketches[day]['day_authors'].add(from_id)
+            if day == self.run_date:
+                today_sketches['day_authors'].add(from_id)
+        
+        for kind, sketch in chat_sketches.items():
+            all_chats_sketches[kind].merge(sketch)
+        await self.db.save_hll_sketches([(self.run_date, result['group_id'], kind, sketch)
+                                         for kind, sketch in {**chat_sketches, **today_sketches}.items()])
+    
+    async def _save_overlaps(self, overlap: OverlapMatrix, summaries: List[Dict[str, Any]]):
+        """Сохраняет матрицу пересечений чатов и выводит самые пересекающиеся пары"""
+        pairs = overlap.pairs()
+        await self.db.save_chat_overlaps(self.run_date, pairs)
+        logger.info(f"Chat overlaps: {len(pairs)} pairs with shared members, {len(overlap.dense_ids)} shared users, {overlap.nbytes} bytes of rows")
+        
+        chat_names = {summary['group_id']: summary['chat_name'] for summary in summaries}
+        for group_id_a, group_id_b, shared in heapq.nlargest(config.OVERLAP_TOP_PAIRS, pairs, key=lambda pair: pair[2]):
+            logger.info(f"Overlap: {chat_names.get(group_id_a, group_id_a)} & {chat_names.get(group_id_b, group_id_b)}: {shared} shared members")
+    
+    async def _save_chat_result(self, result: Dict[str, Any]) -> int:
+        """Сохраняет отфильтрованные данные одного чата и возвращает его ID в базе"""
+        members = result['filtered_members']
+        messages: MessageColumns = result['filtered_messages']
+        
+        # Сохраняем пользователей чата (участников и авторов сообщений)
+        vk_ids = {str(user_id) for user_id in members} | {str(from_id) for from_id in messages.authors()}
+        user_id_map = await self.db.save_users(vk_ids)
+        
+        logger.info(f"Saving chat {result['chat_name']} with {len(members)} members")
+        chat_id = await self.db.save_chat(result['group_id'], result['chat_name'], len(members))
+        
+        await self.db.replace_chat_data(chat_id, [
+            (user_id_map[str(user_id)], str(user_id)) for user_id in members if str(user_id) in user_id_map
+        ], messages, user_id_map, result.get('last_message_id'))
+        await self.db.save_daily_stats(
+            chat_id,
+            self.clock.now(),
+            len(members),
+            len(messages),
+            len(set(members)),
+            len(messages)
+        )
+        return chat_id
+    
+    async def _apply_live_member_changes(self, snapshots: List[Tuple[int, str, int]]):
+        """Применяет поверх снимков участников входы и выходы, полученные Long Poll после загрузки чатов
+        
+        snapshots - тройки (chat_id, group_id, время загрузки участников). Применяются после сохранения
+        всех чатов, чтобы вошедший в другой чат участник исключался из обоих, как при фильтрации дубликатов.
+        """
+        for chat_id, group_id, fetched_at in snapshots:
+            live_changes = await self.db.get_live_member_events(group_id, fetched_at)
+            if live_changes:
+                await self.db.apply_member_changes(chat_id, live_changes)
     
     def _calculate_final_stats(self, filtered_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Вычисляет итоговую статистику"""
-        # Считаем уникальных участников (без дублирования между чатами)
-        all_unique_members = set()
-        for result in filtered_results:
-            all_unique_members.update(result['filtered_members'])
-        
-        total_unique_members = len(all_unique_members)
-        total_messages = sum(len(result['filtered_messages']) for result in filtered_results)
+        # Дублированные пользователи исключены, поэтому каждый оставшийся участник состоит ровно в одном чате
+        total_unique_members = sum(result['members_count'] for result in filtered_results)
+        total_messages = sum(result['messages_last_month'] for result in filtered_results)
         total_excluded_members = sum(result['excluded_members'] for result in filtered_results)
         total_excluded_messages = sum(result['excluded_messages'] for result in filtered_results)
         
@@ -380,114 +643,200 @@ class ChatAnalyzer:
         
         return filtered_results
     
-    async def _analyze_chats_in_batches(self, batch_size: int) -> List[Dict[str, Any]]:
-        """Анализ чатов пакетами для больших объемов"""
-        vk_chats = config.get_vk_chats()
-        logger.info(f"Processing {len(vk_chats)} chats in batches of {batch_size}")
-        
-        all_results = []
-        total_batches = (len(vk_chats) + batch_size - 1) // batch_size
-        successful_chats = 0
-        failed_chats = 0
-        
-        # Обрабатываем все батчи и накапливаем результаты
-        for batch_num in range(total_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min(start_idx + batch_size, len(vk_chats))
-            batch_chats = vk_chats[start_idx:end_idx]
-            
-            logger.info(f"Processing batch {batch_num + 1}/{total_batches} ({len(batch_chats)} chats)")
+    async def _analyze_chats_streaming(self, vk_chats: List[Dict[str, Any]], progress_every: int):
+        """Анализ чатов пулом постоянных воркеров, которые берут чаты из общей очереди
+        
+        В отличие от пакетной обработки, новый чат начинается сразу, как только
+        освобождается любой слот, и долгий чат не задерживает остальные.
+        """
+        logger.info(f"Processing {len(vk_chats)} chats with a streaming worker pool")
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, chat_config in enumerate(vk_chats):
+            queue.put_nowait((index, chat_config))
+        self._queue = queue
+        
+        progress = {"done": 0, "successful": 0, "failed": 0}
+        
+        # Чаты, получившие flood control: (время пробуждения, порядковый номер, index, chat_config, когда отложен)
+        deferred: List[Tuple[float, int, int, Dict[str, Any], float]] = []
+        self._deferred = deferred
+        
+        async def next_chat():
+            now = self.clock.monotonic()
+            if deferred and deferred[0][0] <= now:
+                item = heapq.heappop(deferred)
+            elif not queue.empty():
+                return queue.get_nowait()
+            elif deferred:
+                # Новых чатов нет - ждем ближайший отложенный, не занимая слот
+                item = heapq.heappop(deferred)
+                await self.clock.sleep(item[0] - now)
+            else:
+                return None
             
-            try:
-                # Анализируем текущий пакет
-                batch_results = await self._analyze_single_batch(batch_chats)
+            _, _, index, chat_config, deferred_at = item
+            self.deferrals[chat_config["group_id"]]["seconds"] += self.clock.monotonic() - deferred_at
+            return index, chat_config
+        
+        deferral_order = itertools.count()
+        
+        def defer(index: int, chat_config: Dict[str, Any]) -> bool:
+            """Откладывает чат с flood control; False, если лимит откладываний исчерпан"""
+            stats = self.deferrals.setdefault(chat_config["group_id"], {"count": 0, "seconds": 0.0})
+            if stats["count"] >= config.FLOOD_CONTROL_MAX_DEFERRALS:
+                return False
+            delay = config.FLOOD_CONTROL_DELAY * (2 ** stats["count"])
+            stats["count"] += 1
+            now = self.clock.monotonic()
+            heapq.heappush(deferred, (now + delay, next(deferral_order), index, chat_config, now))
+            logger.warning(f"Chat {chat_config['group_id']} deferred for {delay:.0f}s after flood control ({stats['count']}/{config.FLOOD_CONTROL_MAX_DEFERRALS})")
+            return True
+        
+        async def worker():
+            while not self._stop_event.is_set():
+                item = await next_chat()
+                if item is None:
+                    return
+                index, chat_config = item
                 
-                # Подсчитываем успешные и неудачные чаты
-                batch_successful = len([r for r in batch_results if 'error' not in r])
-                batch_failed = len([r for r in batch_results if 'error' in r])
+                # Фактическое число параллельных чатов задает адаптивный лимит
+                async with self.concurrency.slot():
+                    started_at = self.clock.monotonic()
+                    result = await self._analyze_chat_task(chat_config, index, len(vk_chats))
+                    fetch_seconds = self.clock.monotonic() - started_at
+                chat_metrics = self.metrics.chat(chat_config["group_id"])
+                chat_metrics["attempts"] += 1
+                chat_metrics["fetch_seconds"] += fetch_seconds
+                self.metrics.observe("chat_fetch", fetch_seconds)
                 
-                successful_chats += batch_successful
-                failed_chats += batch_failed
+                # Flood control: слот сразу переходит к следующему чату, этот чат повторим позже
+                if result.get('flood_control'):
+                    self.fetch_caches.pop(chat_config["group_id"], None)
+                    if defer(index, chat_config):
+                        continue
                 
-                # Накапливаем результаты (НЕ сохраняем в БД пока)
-                all_results.extend(batch_results)
+                # Контрольная точка: успешно обработанный чат не придется загружать повторно.
+                # Дальше данные чата читаются только из журнала, в памяти остается счетчик вхождений
+                if 'error' not in result:
+                    with self.metrics.phase("database"):
+                        await self.db.save_journal_result(self.run_date, result)
+                    with self.metrics.phase("dedup"):
+                        self.duplication.add_members(result['all_members'])
+                else:
+                    self.failed_results[chat_config["group_id"]] = result
+                self._record_chat_outcome(result)
+                self.fetch_caches.pop(chat_config["group_id"], None)
                 
-                logger.info(f"Batch {batch_num + 1} completed: {batch_successful} successful, {batch_failed} failed")
+                progress["done"] += 1
+                if 'error' in result:
+                    progress["failed"] += 1
+                else:
+                    progress["successful"] += 1
                 
-            except Exception as e:
-                logger.error(f"Error processing batch {batch_num + 1}: {e}")
-                failed_chats += len(batch_chats)
-            
-            # Увеличенная пауза между пакетами для стабильности
-            if batch_num < total_batches - 1:
-                await asyncio.sleep(10)  # Увеличена пауза до 10 секунд
+                if progress["done"] % progress_every == 0:
+                    logger.info(f"Progress: {progress['done']}/{len(vk_chats)} chats ({progress['successful']} successful, {progress['failed']} failed), queue: {queue.qsize()}, concurrency: {self.concurrency.get_stats()}")
+        
+        workers_count = min(self.concurrency.max_limit, len(vk_chats))
+        self._workers = [asyncio.create_task(worker()) for _ in range(workers_count)]
+        try:
+            # При остановке воркеры отменяются, незавершенные чаты в журнал не попадают
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        finally:
+            for task in self._workers:
+                task.cancel()
+            self._workers = []
+            self._queue = None
+            self._deferred = []
         
         # Финальная статистика
+        successful_chats = progress["successful"]
+        failed_chats = progress["failed"]
         success_rate = (successful_chats / len(vk_chats)) * 100 if vk_chats else 0
         logger.info(f"Completed processing all {len(vk_chats)} chats: {successful_chats} successful, {failed_chats} failed ({success_rate:.1f}% success rate)")
         
+        if self.deferrals:
+            deferral_stats = self.get_deferral_stats()
+            logger.info(f"Flood control: {deferral_stats['chats']} chats deferred {deferral_stats['deferrals']} times, "
+                        f"{deferral_stats['total_seconds']:.0f}s in total (max {deferral_stats['max_seconds']:.0f}s per chat)")
+        
         if success_rate < 50:
             logger.warning(f"Low success rate: {success_rate:.1f}%. Consider checking VK API tokens and rate limits.")
-        
-        # Сохраняем накопленные результаты в self.all_results для финального анализа
-        self.all_results = all_results
-        
-        # ВАЖНО: Анализ дублирования и сохранение происходят в основном методе analyze_all_chats
-        # после возврата из этого метода
-        return all_results
     
-    async def _analyze_single_batch(self, batch_chats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Анализ одного пакета чатов"""
-        semaphore = asyncio.Semaphore(5)  # Максимум 5 параллельных чатов для стабильности
-        
-        async def analyze_chat_with_semaphore(chat_config, index):
-            async with semaphore:
-                group_id = chat_config["group_id"]
-                token = chat_config["token"]
-                chat_name = chat_config.get("chat_name", f"Chat {index+1}")
-                
-                try:
-                    logger.info(f"Analyzing chat {index+1}/{len(batch_chats)}: {chat_name} (Group ID: {group_id})")
-                    result = await self._analyze_single_chat(group_id, token, chat_name)
-                    
-                    # Проверяем успешность обработки
-                    if result and 'error' not in result:
-                        logger.debug(f"Successfully analyzed chat {group_id}: {result.get('members_count', 0)} members, {result.get('messages_count', 0)} messages")
-                    else:
-                        logger.warning(f"Chat {group_id} processed with error: {result.get('error', 'Unknown error') if result else 'No result'}")
-                    
-                    return result
-                except Exception as e:
-                    error_msg = str(e)
-                    # Проверяем, является ли ошибка VK API error 27
-                    if "VK API error 27" in error_msg:
-                        logger.error(f"VK API error 27 (Invalid access key) for chat {group_id} ({chat_name}): {error_msg}")
-                    else:
-                        logger.error(f"Failed to analyze chat {group_id} ({chat_name}): {e}")
-                    
-                    # Возвращаем пустой результат вместо None для сохранения в статистике
-                    return {
-                        "chat_name": chat_name,
-                        "group_id": group_id,
-                        "peer_id": 2000000001,
-                        "all_members": [],
-                        "all_messages": [],
-                        "members_count": 0,
-                        "messages_last_month": 0,
-                        "total_messages": 0,
-                        "analysis_date": datetime.now().strftime('%d.%m.%Y %H:%M'),
-                        "error": str(e)
-                    }
-        
-        # Создаем задачи для всех чатов в пакете
-        tasks = [
-            analyze_chat_with_semaphore(chat_config, i) 
-            for i, chat_config in enumerate(batch_chats)
-        ]
-        
-        # Обрабатываем все чаты параллельно
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Возвращаем все результаты (включая пустые для статистики)
-        return [r for r in results if r is not None and not isinstance(r, Exception)]
+    def _record_chat_outcome(self, result: Dict[str, Any]):
+        """Итог чата в детализации замеров"""
+        chat_metrics = self.metrics.chat(result["group_id"])
+        if result.get("quarantine_reason"):
+            chat_metrics["status"] = "quarantined"
+        elif "error" in result:
+            chat_metrics["status"] = "failed"
+        chat_metrics["error"] = result.get("error")
+        process_metrics.inc("analysis_chats_total", status=chat_metrics["status"])
+    
+    async def _save_run_metrics(self):
+        """Записывает замеры завершенного анализа в analysis_runs и analysis_run_chats"""
+        self.metrics.finish()
+        stats = self.metrics.get_stats()
+        try:
+            self.run_id = await self.db.save_analysis_run(self.run_date, stats, self.metrics.chats)
+        except Exception as e:
+            logger.error(f"Failed to save analysis run metrics: {e}")
+        logger.info(f"Analysis run {self.run_id}: {stats['duration']:.1f}s, phases {stats['phases']}")
+        logger.debug(f"Analysis run {self.run_id} histograms: {stats['histograms']}")
     
+    async def save_report_phase(self, seconds: float):
+        """Добавляет к замерам анализа время построения отчета (отчет строится после анализа)"""
+        if self.metrics is None:
+            return
+        self.metrics.add_phase("report", seconds)
+        if self.run_id is not None:
+            await self.db.update_analysis_run_phases(self.run_id, self.metrics.get_stats()["phases"])
+    
+    def get_deferral_stats(self) -> Dict[str, Any]:
+        """Сколько чатов откладывалось из-за flood control и на сколько"""
+        seconds = [stats["seconds"] for stats in self.deferrals.values()]
+        return {
+            "chats": len(self.deferrals),
+            "deferrals": sum(stats["count"] for stats in self.deferrals.values()),
+            "total_seconds": round(sum(seconds), 1),
+            "max_seconds": round(max(seconds, default=0.0), 1)
+        }
+    
+    async def _analyze_chat_task(self, chat_config: Dict[str, Any], index: int, total: int) -> Dict[str, Any]:
+        """Анализ одного чата из очереди с защитой от непредвиденных ошибок"""
+        group_id = chat_config["group_id"]
+        token = chat_config["token"]
+        chat_name = chat_config.get("chat_name", f"Chat {index+1}")
+        
+        try:
+            logger.info(f"Analyzing chat {index+1}/{total}: {chat_name} (Group ID: {group_id})")
+            result = await self._analyze_single_chat(group_id, token, chat_name)
+            
+            # Проверяем успешность обработки
+            if result and 'error' not in result:
+                logger.debug(f"Successfully analyzed chat {group_id}: {result.get('members_count', 0)} members, {result.get('messages_last_month', 0)} messages")
+            else:
+                logger.warning(f"Chat {group_id} processed with error: {result.get('error', 'Unknown error') if result else 'No result'}")
+            
+            return result
+        except Exception as e:
+            error_msg = str(e)
+            # Проверяем, является ли ошибка VK API error 27
+            if "VK API error 27" in error_msg:
+                logger.error(f"VK API error 27 (Invalid access key) for chat {group_id} ({chat_name}): {error_msg}")
+            else:
+                logger.error(f"Failed to analyze chat {group_id} ({chat_name}): {e}")
+            
+            # Возвращаем пустой результат вместо None для сохранения в статистике
+            return {
+                "chat_name": chat_name,
+                "group_id": group_id,
+                "peer_id": 2000000001,
+                "all_members": [],
+                "all_messages": MessageColumns(),
+                "members_count": 0,
+                "messages_last_month": 0,
+                "total_messages": 0,
+                "analysis_date": self.clock.now().strftime('%d.%m.%Y %H:%M'),
+                "error": str(e)
+            }
@@ -0,0 +1,125 @@
+"""
+Сквозной бенчмарк анализа на локальной замене VK API (vk_standin.py)
+
+Запуск: python benchmark_analyzer.py [--chats 200] [--members 200] [--messages 1000]
+        [--errors 6=0.01 9=0.005 27=0.001] [--latency 0.05] [--slow-rate 0.01 --slow-latency 2]
+
+Сервер с синтетическими чатами работает в отдельном процессе, поэтому пиковая память
+относится только к анализу. База данных создается во временном каталоге.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+import aiohttp
+from loguru import logger
+
+try:
+    import resource
+except ImportError:  # Windows: пиковая память не измеряется
+    resource = None
+
+from analyzer import ChatAnalyzer
+from config import config
+from database_sqlite import Database
+from vk_standin import parse_error_rates, serve_synthetic, synthetic_chats
+
+async def wait_ready(url: str, timeout: float) -> Dict[str, Any]:
+    """Ждет, пока сервер заполнит чаты и начнет отвечать; возвращает его счетчики"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url) as response:
+                    return await response.json()
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+async def run_analysis(args: argparse.Namespace) -> Dict[str, Any]:
+    """Один полный анализ synthetic_chats(args.chats) на свежей базе"""
+    stats_url = f"http://127.0.0.1:{args.port}/stats"
+    before = await wait_ready(stats_url, timeout=600)
+    config.VK_API_BASE_URL = f"http://127.0.0.1:{args.port}/method"
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = Database()
+        database.db_path = os.path.join(directory, "benchmark.db")
+        await database.initialize()
+        try:
+            started = time.perf_counter()
+            analyzer = ChatAnalyzer(database)
+            results = await analyzer.analyze_all_chats(vk_chats=synthetic_chats(args.chats))
+            elapsed = time.perf_counter() - started
+        finally:
+            await database.close()
+
+    after = await wait_ready(stats_url, timeout=10)
+    return {
+        "elapsed": elapsed,
+        "results": results,
+        # Сводки чатов не содержат ошибок - статус чата есть только в замерах анализа
+        "failed": analyzer.metrics.count_failed(),
+        "server": {key: value - before.get(key, 0) for key, value in after.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк анализа на локальной замене VK API")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--members", type=int, default=200, help="Участников в чате")
+    parser.add_argument("--messages", type=int, default=1000, help="Сообщений в чате (за 45 дней)")
+    parser.add_argument("--errors", nargs="*", default=[], help="Доли ошибок VK, например 6=0.01 9=0.005 27=0.001")
+    parser.add_argument("--latency", type=float, default=0.02, help="Средняя задержка ответа, секунд")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Доля медленных ответов")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Задержка медленного ответа, секунд")
+    parser.add_argument("--rps", type=float, default=None, help="Лимит запросов на токен (по умолчанию из конфигурации)")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    if args.rps:
+        config.VK_REQUESTS_PER_SECOND = args.rps
+
+    server = multiprocessing.Process(target=serve_synthetic, daemon=True, args=(
+        args.port, args.chats,
+        {"error_rates": parse_error_rates(args.errors), "latency": args.latency,
+         "slow_rate": args.slow_rate, "slow_latency": args.slow_latency, "seed": args.seed},
+        {"members": args.members, "messages": args.messages, "seed": args.seed},
+    ))
+    server.start()
+    try:
+        report = asyncio.run(run_analysis(args))
+    finally:
+        server.terminate()
+        server.join()
+
+    results = report["results"]
+    server_stats = report["server"]
+    failed = report["failed"]
+    calls = {key: value for key, value in server_stats.items() if "." in key}
+    errors = {key: value for key, value in server_stats.items() if key.startswith("error_")}
+
+    print(f"Chats:        {args.chats} ({len(results) - failed} ok, {failed} failed)")
+    print(f"Elapsed:      {report['elapsed']:.1f} s, {args.chats / report['elapsed'] * 60:.0f} chats/min")
+    print(f"HTTP requests: {server_stats.get('requests', 0)} ({server_stats.get('execute', 0)} execute), "
+          f"API calls: {sum(calls.values())} {calls}")
+    print(f"Injected errors: {errors or 'none'}")
+    print(f"Bytes:        {server_stats.get('bytes_in', 0) / 2 ** 20:.1f} MiB sent, "
+          f"{server_stats.get('bytes_out', 0) / 2 ** 20:.1f} MiB received")
+    if resource is not None:
+        # ru_maxrss в килобайтах на Linux и в байтах на macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mib = peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+        print(f"Peak RSS:     {peak_mib:.0f} MiB")
+
+if __name__ == "__main__":
+    main()
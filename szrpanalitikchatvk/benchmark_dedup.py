@@ -0,0 +1,100 @@
+"""
+Бенчмарк исключения дублированных пользователей (от 10^3 до 10^6 пользователей)
+
+Запуск: python benchmark_dedup.py [--sizes 1000 10000 100000 1000000] [--legacy-limit 10000]
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from dedup import DuplicationEngine
+from message_columns import MessageColumns
+
+def generate_results(users: int, shared_ratio: float, messages_per_member: int, seed: int) -> List[Dict[str, Any]]:
+    """Синтетические результаты анализа: около 200 пользователей на чат, часть состоит в двух чатах"""
+    rng = random.Random(seed)
+    chats_count = max(users // 200, 2)
+    members: List[List[int]] = [[] for _ in range(chats_count)]
+
+    for user_id in range(1, users + 1):
+        home = rng.randrange(chats_count)
+        members[home].append(user_id)
+        if rng.random() < shared_ratio:
+            members[(home + rng.randrange(1, chats_count)) % chats_count].append(user_id)
+
+    results = []
+    now = int(time.time())
+    for index, chat_members in enumerate(members):
+        messages = MessageColumns()
+        message_id = 0
+        for user_id in chat_members:
+            for _ in range(messages_per_member):
+                message_id += 1
+                messages.append(message_id, user_id, now - message_id)
+        results.append({'chat_name': f'chat {index}', 'all_members': chat_members, 'all_messages': messages})
+    return results
+
+def legacy_dedup(results: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    """Прежний алгоритм: словарь списков чатов и проверки по списку дублированных"""
+    user_chats = {}
+    for result in results:
+        for user_id in result['all_members']:
+            if user_id not in user_chats:
+                user_chats[user_id] = []
+            user_chats[user_id].append(result['chat_name'])
+    duplicated_users = [user_id for user_id, chats in user_chats.items() if len(chats) > 1]
+
+    counts = []
+    for result in results:
+        filtered_members = [user_id for user_id in result['all_members'] if user_id not in duplicated_users]
+        filtered_messages = [from_id for from_id in result['all_messages'].from_ids if from_id not in duplicated_users]
+        counts.append((len(filtered_members), len(filtered_messages) if filtered_members else 0))
+    return counts
+
+def engine_dedup(results: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    """Алгоритм анализатора (DuplicationEngine)"""
+    duplication = DuplicationEngine()
+    for result in results:
+        duplication.add_members(result['all_members'])
+
+    counts = []
+    for result in results:
+        filtered_members = duplication.filter_members(result['all_members'])
+        filtered_messages = duplication.filter_messages(result['all_messages'])
+        counts.append((len(filtered_members), len(filtered_messages) if filtered_members else 0))
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк исключения дублированных пользователей")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6])
+    parser.add_argument("--shared", type=float, default=0.2, help="Доля пользователей, состоящих в двух чатах")
+    parser.add_argument("--messages", type=int, default=2, help="Сообщений на участника")
+    parser.add_argument("--legacy-limit", type=int, default=10 ** 4,
+                        help="До какого числа пользователей запускать прежний алгоритм (он квадратичный)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'users':>9} {'chats':>6} {'messages':>9} {'legacy, s':>10} {'engine, s':>10} {'speedup':>8}  counts")
+    for users in args.sizes:
+        results = generate_results(users, args.shared, args.messages, args.seed)
+        messages_count = sum(len(result['all_messages']) for result in results)
+
+        started = time.perf_counter()
+        engine_counts = engine_dedup(results)
+        engine_time = time.perf_counter() - started
+
+        legacy_time = None
+        verdict = "not compared"
+        if users <= args.legacy_limit:
+            started = time.perf_counter()
+            legacy_counts = legacy_dedup(results)
+            legacy_time = time.perf_counter() - started
+            verdict = "identical" if legacy_counts == engine_counts else "MISMATCH"
+
+        legacy_column = f"{legacy_time:10.3f}" if legacy_time is not None else f"{'-':>10}"
+        speedup_column = f"{legacy_time / engine_time:7.0f}x" if legacy_time is not None else f"{'-':>8}"
+        print(f"{users:>9} {len(results):>6} {messages_count:>9} {legacy_column} {engine_time:10.3f} {speedup_column}  {verdict}")
+
+if __name__ == "__main__":
+    main()
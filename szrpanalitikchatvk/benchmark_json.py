@@ -0,0 +1,105 @@
+"""
+Бенчмарк разбора страниц messages.getHistory: полный ответ и проекция execute, json и orjson
+
+Запуск: python benchmark_json.py [--payloads page1.json page2.json ...] [--pages 50] [--repeat 20]
+
+Файлы --payloads - записанные ответы VK: {"response": {"count": ..., "items": [...]}}
+или ответ execute со списком таких страниц. Без них используются синтетические страницы.
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from vk_client import HISTORY_FIELDS, VKClient
+from vk_json import DECODERS
+
+def generate_pages(pages: int, seed: int) -> List[Dict[str, Any]]:
+    """Синтетические страницы по 200 сообщений с текстом, вложениями, ответами и пересылками"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    message_id = pages * 200
+    result = []
+    for _ in range(pages):
+        items = []
+        for _ in range(200):
+            from_id = rng.randint(1, 5000)
+            message = {
+                "date": now - message_id * 60,
+                "from_id": from_id,
+                "id": message_id,
+                "out": 0,
+                "attachments": [],
+                "conversation_message_id": message_id,
+                "fwd_messages": [],
+                "important": False,
+                "is_hidden": False,
+                "peer_id": 2000000001,
+                "random_id": 0,
+                "text": " ".join(rng.choice(("привет", "как дела", "спасибо", "завтра", "встреча", "в 18:00"))
+                                 for _ in range(rng.randint(1, 30))),
+            }
+            if rng.random() < 0.15:
+                message["attachments"].append({"type": "photo", "photo": {
+                    "album_id": -3, "date": message["date"], "id": rng.randint(1, 10 ** 9), "owner_id": from_id,
+                    "access_key": "%016x" % rng.getrandbits(64),
+                    "sizes": [{"height": size, "width": size, "type": kind, "url": f"https://sun9-1.userapi.com/{kind}.jpg"}
+                              for kind, size in (("s", 75), ("m", 130), ("x", 604), ("y", 807), ("z", 1080))],
+                }})
+            if rng.random() < 0.2:
+                message["reply_message"] = {"date": message["date"] - 600, "from_id": rng.randint(1, 5000),
+                                            "text": "ответ", "attachments": [], "conversation_message_id": message_id - 5,
+                                            "peer_id": 2000000001, "id": 0}
+            items.append(message)
+            message_id -= 1
+        result.append({"count": pages * 200, "items": items})
+    return result
+
+def load_pages(paths: List[str]) -> List[Dict[str, Any]]:
+    """Страницы истории из записанных ответов VK"""
+    pages = []
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            response = json.load(file).get("response")
+        pages.extend(response if isinstance(response, list) else [response])
+    return [page for page in pages if page and page.get("items")]
+
+def project(page: Dict[str, Any]) -> Dict[str, Any]:
+    """Ответ, который возвращает проекция execute (count и списки id, from_id, date)"""
+    return {"count": page["count"], "items": {field: [item[field] for item in page["items"]] for field in HISTORY_FIELDS}}
+
+def measure(payloads: List[bytes], decode: Callable[[bytes], Any], repeat: int) -> float:
+    """Среднее время разбора одной страницы в колонки сообщений, микросекунд"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            VKClient._history_page(decode(payload))
+    return (time.perf_counter() - started) / (repeat * len(payloads)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора страниц messages.getHistory")
+    parser.add_argument("--payloads", nargs="+", default=[], help="Записанные ответы VK (JSON)")
+    parser.add_argument("--pages", type=int, default=50, help="Синтетических страниц, если ответы не заданы")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    pages = load_pages(args.payloads) if args.payloads else generate_pages(args.pages, args.seed)
+    variants = {
+        "full": [json.dumps(page, ensure_ascii=False).encode() for page in pages],
+        "projected": [json.dumps(project(page)).encode() for page in pages],
+    }
+
+    baseline = None
+    print(f"{len(pages)} pages, {sum(len(page['items']) for page in pages)} messages")
+    print(f"{'payload':>10} {'decoder':>8} {'bytes/page':>11} {'us/page':>9} {'speedup':>8}")
+    for variant, payloads in variants.items():
+        page_bytes = sum(map(len, payloads)) // len(payloads)
+        for name, decode in DECODERS.items():
+            per_page = measure(payloads, decode, args.repeat)
+            baseline = baseline or per_page
+            print(f"{variant:>10} {name:>8} {page_bytes:>11} {per_page:9.1f} {baseline / per_page:7.1f}x")
+
+if __name__ == "__main__":
+    main()
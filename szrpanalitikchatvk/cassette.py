@@ -0,0 +1,161 @@
+"""
+Кассета ответов VK API: запись запросов реального анализа и воспроизведение без сети
+
+Каждый анализ в режиме записи создает отдельный файл vk_ГГГГММДД_ЧЧММСС.jsonl.gz: первая строка -
+заголовок, далее по строке на запрос {"key": ..., "response": ...}. Ключ - метод и параметры
+запроса, где access_token заменен его хешем: сами токены в кассету не попадают, но запросы
+разных чатов (VK различает беседы по токену, peer_id у них может совпадать) не смешиваются.
+"""
+import glob
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from config import config
+from token_health import token_hash
+
+CASSETTE_VERSION = 1
+
+# Параметры запроса, значения которых заменяются в ключе кассеты хешем
+SCRUBBED_PARAMS = {"access_token"}
+
+# Ответ на запрос, которого нет в кассете: анализатор обрабатывает его как ошибку VK без повторов
+MISSING_RESPONSE = {"error": {"error_code": 0, "error_msg": "Request not found in cassette"}}
+
+def cassette_key(method: str, params: Dict[str, Any]) -> str:
+    """Ключ запроса: метод и параметры в фиксированном порядке, токен - первые 16 символов хеша"""
+    scrubbed = {
+        name: token_hash(str(value))[:16] if name in SCRUBBED_PARAMS else str(value)
+        for name, value in params.items()
+    }
+    return method + "?" + json.dumps(scrubbed, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+class Cassette:
+    """Запись (mode="record") или воспроизведение (mode="replay") ответов VK API"""
+
+    def __init__(self, path: str, mode: str):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.header: Dict[str, Any] = {}
+        self.recorded = 0
+        self.hits = 0
+        self.misses = 0
+        self._file = None
+        # Один запрос мог выполняться несколько раз (повторы после ошибок): ответы отдаются по очереди
+        self._responses: Dict[str, List[Any]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+        # users.get объединяются в пакеты по времени, поэтому пакет при воспроизведении может
+        # отличаться от записанного: такие запросы собираются из ответов по отдельным пользователям
+        self._users: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def open(self, recorded_at: datetime = None):
+        """Создает файл записи или загружает кассету для воспроизведения"""
+        if self.replaying:
+            self._load()
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.header = {
+            "cassette": CASSETTE_VERSION,
+            "recorded_at": (recorded_at or datetime.now()).isoformat(),
+            "api_version": config.VK_API_VERSION,
+        }
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._file.write(json.dumps(self.header) + "\n")
+        logger.info(f"Recording VK responses to {self.path}")
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            self.header = json.loads(file.readline())
+            if self.header.get("cassette") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version in {self.path}: {self.header.get('cassette')}")
+            for line in file:
+                entry = json.loads(line)
+                self._responses[entry["key"]].append(entry["response"])
+                if entry["key"].startswith("users.get?"):
+                    self._index_users(entry["response"])
+        logger.info(f"Replaying {sum(map(len, self._responses.values()))} VK responses from {self.path} "
+                    f"(recorded {self.header.get('recorded_at')})")
+
+    @property
+    def recorded_at(self) -> Optional[datetime]:
+        """Время начала записанного анализа"""
+        recorded_at = self.header.get("recorded_at")
+        return datetime.fromisoformat(recorded_at) if recorded_at else None
+
+    def _index_users(self, response: Dict[str, Any]):
+        users = response.get("response") if isinstance(response, dict) else None
+        if isinstance(users, list):
+            for user in users:
+                if isinstance(user, dict) and "id" in user:
+                    self._users[str(user["id"])] = user
+
+    def record(self, method: str, params: Dict[str, Any], response: Any, token: str = None):
+        """Записывает ответ на запрос; token дополнительно вырезается из ключа, если попал в другие параметры"""
+        key = cassette_key(method, params)
+        if token:
+            key = key.replace(token, "***")
+        self._file.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    def play(self, method: str, params: Dict[str, Any]) -> Any:
+        """Ответ из кассеты на запрос (MISSING_RESPONSE, если такого запроса не было)"""
+        key = cassette_key(method, params)
+        responses = self._responses.get(key)
+        if responses:
+            position = self._positions[key]
+            # Запросов больше, чем было записано (например, hedged дубликат) - повторяем последний ответ
+            self._positions[key] = min(position + 1, len(responses) - 1)
+            self.hits += 1
+            return responses[position]
+
+        if method == "users.get":
+            user_ids = str(params.get("user_ids", "")).split(",")
+            if all(user_id in self._users for user_id in user_ids):
+                self.hits += 1
+                return {"response": [self._users[user_id] for user_id in user_ids]}
+
+        self.misses += 1
+        logger.debug(f"Cassette miss: {key[:200]}")
+        return MISSING_RESPONSE
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self.recorded} VK responses to {self.path}")
+        elif self.replaying:
+            logger.info(f"Cassette replay: {self.hits} hits, {self.misses} misses")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "path": self.path, "recorded": self.recorded, "hits": self.hits, "misses": self.misses}
+
+def latest_cassette(directory: str) -> Optional[str]:
+    """Последняя записанная кассета в каталоге"""
+    paths = sorted(glob.glob(os.path.join(directory, "vk_*.jsonl.gz")))
+    return paths[-1] if paths else None
+
+def open_cassette(started_at: datetime) -> Optional[Cassette]:
+    """Кассета анализа по настройкам VK_CASSETTE_* (None, если запись и воспроизведение выключены)"""
+    mode = config.VK_CASSETTE_MODE
+    if not mode:
+        return None
+    if mode == "record":
+        path = os.path.join(config.VK_CASSETTE_DIR, f"vk_{started_at:%Y%m%d_%H%M%S}.jsonl.gz")
+    else:
+        path = config.VK_CASSETTE_FILE or latest_cassette(config.VK_CASSETTE_DIR)
+        if path is None:
+            raise FileNotFoundError(f"No VK cassettes found in {config.VK_CASSETTE_DIR}")
+    cassette = Cassette(path, mode)
+    cassette.open(started_at)
+    return cassette
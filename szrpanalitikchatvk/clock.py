@@ -0,0 +1,96 @@
+"""
+Часы анализа: системное время или виртуальное время симуляции
+"""
+import asyncio
+import selectors
+import time
+from datetime import datetime
+from typing import Optional
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Цикл событий с виртуальным временем
+
+    Когда готовых к выполнению задач нет, цикл не ждет ближайший таймер, а сразу переводит
+    время вперед: asyncio.sleep, паузы ограничителя и откладывание чатов не занимают
+    реального времени. Реальный ввод-вывод в симуляции не предполагается.
+    """
+
+    def __init__(self, start: float = None):
+        super().__init__(_VirtualTimeSelector(self))
+        self.start = time.time() if start is None else start  # Календарное время в момент 0
+        self._virtual_time = 0.0
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        """Переводит виртуальное время вперед"""
+        self._virtual_time += seconds
+
+    def wall_time(self) -> float:
+        """Календарное время (unix time) в виртуальном времени цикла"""
+        return self.start + self._virtual_time
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    """Селектор, который вместо ожидания таймера переводит время цикла"""
+
+    def __init__(self, loop: VirtualTimeLoop):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: Optional[float] = None):
+        events = super().select(0)
+        if events or timeout is not None and timeout <= 0:
+            return events
+        if timeout is None:
+            # Таймеров нет - ждем реальное событие (например, пробуждение из другого потока)
+            return super().select(None)
+        self._loop.advance(timeout)
+        return []
+
+def _virtual_loop() -> Optional[VirtualTimeLoop]:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return loop if isinstance(loop, VirtualTimeLoop) else None
+
+class Clock:
+    """Источник времени и ожидания для клиента VK, анализатора и планировщика
+
+    В обычном цикле событий это системные часы. В VirtualTimeLoop время берется из цикла,
+    поэтому тот же код анализа выполняется в симуляции без изменений.
+    """
+
+    def monotonic(self) -> float:
+        loop = _virtual_loop()
+        return loop.time() if loop else time.monotonic()
+
+    def time(self) -> float:
+        loop = _virtual_loop()
+        return loop.wall_time() if loop else time.time()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.time())
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay)
+
+class ShiftedClock(Clock):
+    """Часы, которые начинают идти с заданного момента (воспроизведение анализа в день записи)"""
+
+    def __init__(self, start: datetime, base: Clock = None):
+        self.base = base or Clock()
+        self.offset = start.timestamp() - self.base.time()
+
+    def monotonic(self) -> float:
+        return self.base.monotonic()
+
+    def time(self) -> float:
+        return self.base.time() + self.offset
+
+    async def sleep(self, delay: float):
+        await self.base.sleep(delay)
+
+# Часы по умолчанию для всех компонентов
+clock = Clock()
@@ -0,0 +1,108 @@
+"""
+Адаптивное ограничение количества параллельно анализируемых чатов
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from loguru import logger
+
+from clock import Clock, clock as default_clock
+from config import config
+
+class AdaptiveConcurrencyLimiter:
+    """Лимит параллельных чатов по схеме AIMD
+
+    Пока VK отвечает без ошибок, лимит растет на 1 после каждых limit успешных ответов.
+    При ошибке 6 (слишком много запросов) или 9 (flood control) лимит уменьшается вдвое.
+    """
+
+    def __init__(self, initial: int = None, minimum: int = None, maximum: int = None, clock: Clock = None):
+        self.clock = clock or default_clock
+        self.min_limit = minimum or config.CHAT_CONCURRENCY_MIN
+        self.max_limit = maximum or config.CHAT_CONCURRENCY_MAX
+        self.limit = min(max(initial or config.CHAT_CONCURRENCY_INITIAL, self.min_limit), self.max_limit)
+        self.in_flight = 0
+        self.waiting = 0  # Сколько задач ждут свободный слот
+        self.peak_limit = self.limit
+        self.throttle_events = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._notify_tasks = set()
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        """Ожидает свободный слот"""
+        condition = self._get_condition()
+        self.waiting += 1
+        try:
+            async with condition:
+                await condition.wait_for(lambda: self.in_flight < self.limit)
+                self.in_flight += 1
+        finally:
+            self.waiting -= 1
+
+    async def release(self):
+        """Освобождает слот"""
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает слот на время анализа одного чата"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def record_success(self):
+        """Учитывает успешный ответ VK API"""
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self._successes = 0
+            self._set_limit(self.limit + 1, "responses are clean")
+
+    def record_throttle(self, error_code: int):
+        """Учитывает ошибку 6/9 от VK API"""
+        self.throttle_events += 1
+        self._successes = 0
+
+        # Одна волна ошибок от нескольких чатов уменьшает лимит только один раз
+        now = self.clock.monotonic()
+        if now - self._last_decrease < config.CHAT_CONCURRENCY_COOLDOWN:
+            return
+        self._last_decrease = now
+        self._set_limit(max(self.min_limit, self.limit // 2), f"VK error {error_code}")
+
+    def _set_limit(self, limit: int, reason: str):
+        if limit == self.limit:
+            return
+        logger.info(f"Chat concurrency limit {self.limit} -> {limit} ({reason}), {self.in_flight} chats in flight")
+        self.limit = limit
+        self.peak_limit = max(self.peak_limit, limit)
+        if self._condition is not None:
+            # Будим ожидающих: при увеличении лимита освободились слоты
+            task = asyncio.get_running_loop().create_task(self._notify())
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Текущее состояние лимита"""
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak_limit": self.peak_limit,
+            "throttle_events": self.throttle_events
+        }
@@ -10,6 +10,15 @@ from csv_parser import CSVParser
 # Загружаем переменные окружения
 load_dotenv('.env')
 
+def _method_timeouts(name: str, default: str = '') -> Dict[str, float]:
+    """Разбирает таймауты по методам VK из переменной вида execute=45,users.get=15"""
+    timeouts = {}
+    for item in os.getenv(name, default).split(','):
+        if '=' in item:
+            method, seconds = item.split('=', 1)
+            timeouts[method.strip()] = float(seconds)
+    return timeouts
+
 class Config:
     """Конфигурация"""
     
@@ -38,10 +47,74 @@ class Config:
     ]
     
     VK_API_VERSION = "5.131"
+    VK_API_BASE_URL = os.getenv('VK_API_BASE_URL', 'https://api.vk.com/method')  # Можно указать локальную замену VK API
     PEER_ID = 2000000001
     MAX_MESSAGES = 10000
-    RATE_LIMIT_DELAY = 3.0  # Увеличено для максимальной стабильности работы с VK API
+    ANALYSIS_WINDOW_DAYS = int(os.getenv('ANALYSIS_WINDOW_DAYS', '30'))  # Окно анализа сообщений (7/30/90 дней)
+    OVERLAP_RETENTION_DAYS = int(os.getenv('OVERLAP_RETENTION_DAYS', '30'))  # Сколько дней хранить пересечения чатов
+    OVERLAP_TOP_PAIRS = 10  # Сколько пар чатов с наибольшим пересечением выводить в лог
+    # Лимит частоты запросов на один токен (VK: 3/сек для ключей пользователя, 20/сек для ключей сообщества)
+    VK_REQUESTS_PER_SECOND = float(os.getenv('VK_REQUESTS_PER_SECOND', '3'))
+    VK_RATE_LIMIT_BURST = int(os.getenv('VK_RATE_LIMIT_BURST', '3'))  # Сколько запросов можно отправить разом
+    HISTORY_PAGE_SIZE = 200  # Максимум сообщений за один вызов messages.getHistory
+    VK_EXECUTE_BATCH_SIZE = 25  # Максимум вызовов API внутри одного execute
+    VK_EXECUTE_MAX_CODE_LENGTH = 60000  # Ограничение размера кода execute (символов)
+    VK_JSON_DECODER = os.getenv('VK_JSON_DECODER', 'auto')  # auto, orjson или json (стандартный)
+    # Количество параллельно анализируемых чатов подстраивается под ответы VK
+    CHAT_CONCURRENCY_INITIAL = int(os.getenv('CHAT_CONCURRENCY_INITIAL', '5'))
+    CHAT_CONCURRENCY_MIN = int(os.getenv('CHAT_CONCURRENCY_MIN', '1'))
+    CHAT_CONCURRENCY_MAX = int(os.getenv('CHAT_CONCURRENCY_MAX', '50'))
+    CHAT_CONCURRENCY_COOLDOWN = 5.0  # Минимум секунд между уменьшениями лимита
+    FLOOD_CONTROL_DELAY = 30.0  # Чат с flood control (ошибка 9) откладывается на 30, 60, 120, 240 секунд
+    FLOOD_CONTROL_MAX_DEFERRALS = 4  # После стольких откладываний чат считается необработанным
+    USER_STATUS_TTL_HOURS = float(os.getenv('USER_STATUS_TTL_HOURS', '48'))  # Сколько доверять сохраненному статусу пользователя
+    USER_STATUS_BATCH_WINDOW = 0.2  # Сколько секунд копить пользователей из разных чатов перед users.get
+    # Токены с ошибкой авторизации попадают в карантин и перепроверяются с растущим интервалом
+    TOKEN_REPROBE_DELAY_HOURS = float(os.getenv('TOKEN_REPROBE_DELAY_HOURS', '6'))  # Первая перепроверка
+    TOKEN_REPROBE_MAX_DELAY_HOURS = float(os.getenv('TOKEN_REPROBE_MAX_DELAY_HOURS', '168'))  # Максимальный интервал
     
+    # HTTP соединения с VK API (общий пул на весь анализ)
+    VK_CONNECTION_LIMIT = int(os.getenv('VK_CONNECTION_LIMIT', '100'))  # Всего соединений в пуле
+    VK_CONNECTION_LIMIT_PER_HOST = int(os.getenv('VK_CONNECTION_LIMIT_PER_HOST', '30'))  # Соединений к api.vk.com
+    VK_KEEPALIVE_TIMEOUT = float(os.getenv('VK_KEEPALIVE_TIMEOUT', '30'))  # Сколько держать простаивающее соединение
+    VK_DNS_CACHE_TTL = int(os.getenv('VK_DNS_CACHE_TTL', '600'))  # Кэш DNS в секундах
+    VK_CONNECT_TIMEOUT = float(os.getenv('VK_CONNECT_TIMEOUT', '10'))  # Таймаут установки соединения
+    VK_REQUEST_TIMEOUT = float(os.getenv('VK_REQUEST_TIMEOUT', '60'))  # Общий таймаут одного запроса
+    VK_READ_TIMEOUT = float(os.getenv('VK_READ_TIMEOUT', '20'))  # Максимальная пауза в получении ответа
+    # Таймауты отдельных методов VK (перекрывают общие), например "execute=45,users.get=10"
+    VK_METHOD_CONNECT_TIMEOUTS = _method_timeouts('VK_METHOD_CONNECT_TIMEOUTS')
+    VK_METHOD_READ_TIMEOUTS = _method_timeouts('VK_METHOD_READ_TIMEOUTS', 'execute=45')
+
+    # Hedged запросы: если чтение не ответило за VK_HEDGE_PERCENTILE перцентиль задержки метода,
+    # отправляется дубликат (с учетом лимита токена) и используется первый ответ
+    VK_HEDGE_ENABLED = os.getenv('VK_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    VK_HEDGE_PERCENTILE = float(os.getenv('VK_HEDGE_PERCENTILE', '95'))
+    VK_HEDGE_MIN_DELAY = 0.5  # Дубликат не отправляется раньше, чем через столько секунд
+    VK_HEDGE_MIN_SAMPLES = 20  # Сколько ответов метода нужно для оценки перцентиля
+    VK_HEDGE_WINDOW = 500  # Сколько последних задержек метода учитывать
+
+    # Кассета ответов VK: record - записывать ответы каждого анализа в отдельный файл,
+    # replay - отвечать из кассеты без обращения к VK (пусто - выключено)
+    VK_CASSETTE_MODE = os.getenv('VK_CASSETTE_MODE', '').lower()
+    VK_CASSETTE_DIR = os.getenv('VK_CASSETTE_DIR', 'data/cassettes')
+    VK_CASSETTE_FILE = os.getenv('VK_CASSETTE_FILE', '')  # Кассета для replay (по умолчанию последняя в каталоге)
+
+    # Получение новых сообщений в реальном времени через Bots Long Poll
+    LONGPOLL_ENABLED = os.getenv('LONGPOLL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    LONGPOLL_WAIT = int(os.getenv('LONGPOLL_WAIT', '25'))  # Сколько секунд сервер держит запрос (максимум 90)
+    LONGPOLL_FLUSH_INTERVAL = 5.0  # Как часто записывать накопленные события в базу (секунд)
+    LONGPOLL_FLUSH_SIZE = 500  # Записывать сразу, если накопилось столько событий
+    LONGPOLL_RETRY_DELAY = 60.0  # Максимальная пауза перед повторным подключением к Long Poll
+    LONGPOLL_POOL_RESERVE = 10  # Соединений пула Long Poll сверх числа чатов (переподключения)
+    # Long Poll пишет в базу через свое соединение: сколько секунд ждать, пока анализ держит запись
+    SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '30'))
+
+    # Метрики процесса в формате Prometheus (GET /metrics), по умолчанию только для localhost
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+    EVENT_LOOP_LAG_INTERVAL = 1.0  # Как часто замерять задержку цикла событий (секунд)
+
     # Database
     POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
     POSTGRES_PORT = int(os.getenv('POSTGRES_PORT', '5432'))
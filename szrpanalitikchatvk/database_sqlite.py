@@ -2,23 +2,93 @@
 База данных SQLite 
 """
 import asyncio
+import json
+import struct
+import time
+import zlib
 import aiosqlite
+from array import array
 from datetime import datetime, date
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from loguru import logger
 
+from clock import Clock, clock as default_clock
 from config import config
+from hll import HyperLogLog
+from instrumentation import FAILED_CHAT_STATUSES, process_metrics
+from message_columns import MessageColumns
+
+HLL_ALL_CHATS = "*"  # group_id скетчей, объединяющих все чаты
+
+def _statement_type(sql: str) -> str:
+    """Тип SQL запроса для метрик: select, insert, update, delete, create..."""
+    words = sql.split(None, 1)
+    return words[0].lower() if words else "empty"
+
+class _TimedQuery:
+    """Запрос соединения, время выполнения которого попадает в sqlite_query_duration_seconds
+
+    Поддерживает и await, и async with (с закрытием курсора), как результат execute в aiosqlite.
+    """
+
+    def __init__(self, query, statement: str):
+        self._query = query
+        self._statement = statement
+        self._cursor = None
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def _run(self):
+        started_at = time.perf_counter()
+        try:
+            return await self._query
+        finally:
+            process_metrics.observe("sqlite_query_duration_seconds", time.perf_counter() - started_at,
+                                    statement=self._statement)
+
+    async def __aenter__(self):
+        self._cursor = await self._run()
+        return self._cursor
+
+    async def __aexit__(self, *exc_info):
+        if self._cursor is not None and hasattr(self._cursor, "close"):
+            await self._cursor.close()
+
+class TimedConnection:
+    """Соединение с базой, которое замеряет время запросов; остальные атрибуты - от исходного соединения"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def execute(self, sql: str, parameters=None) -> _TimedQuery:
+        query = self._connection.execute(sql, parameters) if parameters is not None else self._connection.execute(sql)
+        return _TimedQuery(query, _statement_type(sql))
+
+    def executemany(self, sql: str, parameters) -> _TimedQuery:
+        return _TimedQuery(self._connection.executemany(sql, parameters), _statement_type(sql))
+
+    async def commit(self):
+        await _TimedQuery(self._connection.commit(), "commit")
+
+    def __getattr__(self, name: str):
+        return getattr(self._connection, name)
 
 class Database:
     """Класс для работы с базой данных SQLite"""
-    def __init__(self):
+    def __init__(self, clock: Clock = None):
         self.db_path = "vk_simple_bot.db"
-        self.connection: Optional[aiosqlite.Connection] = None
+        self.connection: Optional[TimedConnection] = None
+        self.clock = clock or default_clock  # Часы для окна "сегодня" в статистике
+
+    def _today(self, today: Optional[date] = None) -> date:
+        """День статистики: переданный вызывающим или текущий по часам базы"""
+        return today or self.clock.now().date()
 
     async def initialize(self):
         """Инициализация базы данных"""
         try:
-            self.connection = await aiosqlite.connect(self.db_path)
+            self.connection = TimedConnection(await self._connect())
             await self._create_tables()
             await self._create_indexes()
             logger.info("SQLite database initialized successfully")
@@ -26,6 +96,17 @@ class Database:
             logger.error(f"Failed to initialize SQLite database: {e}")
             raise
 
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открывает соединение с файлом базы
+
+        В базу пишут два соединения (анализ и Long Poll), поэтому включен WAL, а занятая
+        другим соединением запись ожидается до SQLITE_BUSY_TIMEOUT секунд.
+        """
+        connection = await aiosqlite.connect(self.db_path, timeout=config.SQLITE_BUSY_TIMEOUT)
+        async with connection.execute("PRAGMA journal_mode=WAL"):
+            pass
+        return connection
+
     async def close(self):
         """Закрытие соединения с базой данных"""
         if self.connection:
@@ -108,6 +189,137 @@ class Database:
         """):
             pass
 
+        # Сырая история сообщений чатов за окно анализа (для инкрементальной синхронизации)
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS message_history (
+                group_id TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                from_id INTEGER NOT NULL,
+                date INTEGER NOT NULL,
+                text TEXT,
+                PRIMARY KEY (group_id, message_id)
+            )
+        """):
+            pass
+
+        # Последнее изменение состава чата по данным Long Poll (по group_id: переживает пересохранение чатов анализом)
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS live_member_events (
+                group_id TEXT NOT NULL,
+                vk_id INTEGER NOT NULL,
+                is_member BOOLEAN NOT NULL,
+                event_date INTEGER NOT NULL,
+                PRIMARY KEY (group_id, vk_id)
+            )
+        """):
+            pass
+
+        # Самое новое полученное сообщение по каждому чату
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sync_state (
+                group_id TEXT PRIMARY KEY,
+                last_message_id INTEGER NOT NULL,
+                last_message_date INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """):
+            pass
+
+        # Статусы пользователей VK (active/deleted/banned) с временем проверки
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS user_status_cache (
+                vk_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                checked_at REAL NOT NULL
+            )
+        """):
+            pass
+
+        # Результаты проверки токенов сообществ (хранится только SHA-256 токена)
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS token_health (
+                token_hash TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                reason TEXT,
+                failures INTEGER DEFAULT 0,
+                checked_at REAL NOT NULL,
+                next_probe_at REAL
+            )
+        """):
+            pass
+
+        # Журнал текущего анализа: сырые результаты уже обработанных чатов для продолжения после сбоя
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_journal (
+                run_date DATE NOT NULL,
+                group_id TEXT NOT NULL,
+                result BLOB NOT NULL,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (run_date, group_id)
+            )
+        """):
+            pass
+
+        # Пересечения участников между чатами по дням (только пары с общими участниками)
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS chat_overlaps (
+                stat_date DATE NOT NULL,
+                group_id_a TEXT NOT NULL,
+                group_id_b TEXT NOT NULL,
+                shared_members INTEGER NOT NULL,
+                PRIMARY KEY (stat_date, group_id_a, group_id_b)
+            )
+        """):
+            pass
+
+        # Скетчи HyperLogLog уникальных участников, авторов и сообщений для быстрой статистики
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS hll_sketches (
+                stat_date DATE NOT NULL,
+                group_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                registers BLOB NOT NULL,
+                PRIMARY KEY (stat_date, group_id, kind)
+            )
+        """):
+            pass
+
+        # Замеры анализов: строка на запуск (этапы, счетчики и гистограммы в JSON) и строки по чатам
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_date DATE NOT NULL,
+                started_at TIMESTAMP NOT NULL,
+                finished_at TIMESTAMP,
+                duration REAL NOT NULL,
+                chats INTEGER NOT NULL,
+                failed_chats INTEGER NOT NULL,
+                vk_requests INTEGER NOT NULL,
+                phases TEXT NOT NULL,
+                counters TEXT NOT NULL,
+                histograms TEXT NOT NULL
+            )
+        """):
+            pass
+
+        async with self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_run_chats (
+                run_id INTEGER NOT NULL,
+                group_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                fetch_seconds REAL NOT NULL,
+                vk_requests INTEGER NOT NULL,
+                members INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                save_seconds REAL NOT NULL,
+                error TEXT,
+                PRIMARY KEY (run_id, group_id),
+                FOREIGN KEY (run_id) REFERENCES analysis_runs (id)
+            )
+        """):
+            pass
+
         async with self.connection.execute("""
             CREATE TABLE IF NOT EXISTS telegram_users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -134,7 +346,9 @@ class Database:
             "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id)",
             "CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date)",
             "CREATE INDEX IF NOT EXISTS idx_daily_stats_chat_id ON daily_stats(chat_id)",
-            "CREATE INDEX IF NOT EXISTS idx_daily_stats_date ON daily_stats(stat_date)"
+            "CREATE INDEX IF NOT EXISTS idx_daily_stats_date ON daily_stats(stat_date)",
+            "CREATE INDEX IF NOT EXISTS idx_message_history_date ON message_history(date)",
+            "CREATE INDEX IF NOT EXISTS idx_analysis_runs_date ON analysis_runs(run_date)"
         ]
 
         for index_sql in indexes:
@@ -145,9 +359,12 @@ class Database:
 
     async def save_chat(self, group_id: str, title: str, members_count: int) -> int:
         """Сохраняет или обновляет информацию о чате"""
+        # ID чата не меняется между анализами: на него ссылаются строки, записанные Long Poll
         async with self.connection.execute("""
-            INSERT OR REPLACE INTO chats (group_id, title, members_count, updated_at)
+            INSERT INTO chats (group_id, title, members_count, updated_at)
             VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(group_id) DO UPDATE SET
+                title = excluded.title, members_count = excluded.members_count, updated_at = CURRENT_TIMESTAMP
         """, (group_id, title, members_count)):
             pass
 
@@ -195,6 +412,502 @@ class Database:
         """, (chat_id, stat_date.date(), total_members, total_messages, unique_members, unique_messages)):
             pass
 
+    async def get_sync_state(self, group_id: str) -> Optional[Dict[str, int]]:
+        """Получает отметку последнего синхронизированного сообщения чата"""
+        async with self.connection.execute("""
+            SELECT last_message_id, last_message_date FROM chat_sync_state WHERE group_id = ?
+        """, (group_id,)) as cursor:
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            return {'last_message_id': row[0], 'last_message_date': row[1]}
+
+    async def save_sync_state(self, group_id: str, last_message_id: int, last_message_date: int):
+        """Сохраняет отметку последнего синхронизированного сообщения чата"""
+        async with self.connection.execute("""
+            INSERT OR REPLACE INTO chat_sync_state (group_id, last_message_id, last_message_date, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """, (group_id, last_message_id, last_message_date)):
+            pass
+        await self.connection.commit()
+
+    async def save_history_messages(self, group_id: str, messages: MessageColumns):
+        """Сохраняет сообщения чата в историю"""
+        async with self.connection.executemany("""
+            INSERT OR IGNORE INTO message_history (group_id, message_id, from_id, date, text)
+            VALUES (?, ?, ?, ?, '')
+        """, ((group_id, message_id, from_id, message_date) for message_id, from_id, message_date in messages)):
+            pass
+        await self.connection.commit()
+
+    async def get_history_columns(self, group_id: str, since_date: int) -> MessageColumns:
+        """Получает сообщения чата из истории, начиная с даты (unix time)"""
+        async with self.connection.execute("""
+            SELECT message_id, from_id, date FROM message_history
+            WHERE group_id = ? AND date >= ?
+            ORDER BY message_id DESC
+        """, (group_id, since_date)) as cursor:
+            return MessageColumns.from_rows(await cursor.fetchall())
+
+    async def prune_message_history(self, before_date: int) -> int:
+        """Удаляет из истории сообщения старше окна анализа"""
+        async with self.connection.execute("""
+            DELETE FROM message_history WHERE date < ?
+        """, (before_date,)) as cursor:
+            deleted = cursor.rowcount
+        await self.connection.commit()
+        return deleted
+
+    async def save_users(self, vk_ids: List[str]) -> Dict[str, int]:
+        """Добавляет недостающих пользователей и возвращает их ID в базе (vk_id -> id)"""
+        vk_ids = list(vk_ids)
+        async with self.connection.executemany("""
+            INSERT OR IGNORE INTO users (vk_id) VALUES (?)
+        """, [(vk_id,) for vk_id in vk_ids]):
+            pass
+
+        user_id_map = {}
+        chunk_size = 500  # Ограничение количества параметров SQLite
+        for start in range(0, len(vk_ids), chunk_size):
+            chunk = vk_ids[start:start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            async with self.connection.execute(f"""
+                SELECT vk_id, id FROM users WHERE vk_id IN ({placeholders})
+            """, chunk) as cursor:
+                user_id_map.update(await cursor.fetchall())
+        return user_id_map
+
+    async def save_chat_members(self, chat_id: int, members: List[Tuple[int, str]]):
+        """Сохраняет участников чата пакетом (пары user_id, vk_id)"""
+        async with self.connection.executemany("""
+            INSERT OR REPLACE INTO chat_members (chat_id, user_id, vk_id, first_name, last_name, username, is_active)
+            VALUES (?, ?, ?, '', '', '', 1)
+        """, [(chat_id, user_id, vk_id) for user_id, vk_id in members]):
+            pass
+
+    async def save_messages(self, chat_id: int, messages: MessageColumns, user_id_map: Dict[str, int]):
+        """Сохраняет сообщения чата пакетом (без текста)"""
+        async with self.connection.executemany("""
+            INSERT OR IGNORE INTO messages (message_id, chat_id, user_id, text, date)
+            VALUES (?, ?, ?, '', ?)
+        """, (
+            (str(message_id), chat_id, user_id_map[str(from_id)], datetime.fromtimestamp(message_date))
+            for message_id, from_id, message_date in messages
+            if str(from_id) in user_id_map
+        )):
+            pass
+
+    async def replace_chat_data(self, chat_id: int, members: List[Tuple[int, str]], messages: MessageColumns,
+                                user_id_map: Dict[str, int], up_to_message_id: Optional[int] = None):
+        """Заменяет участников и сообщения чата результатом анализа
+
+        Сообщения новее up_to_message_id анализ не видел (их записал Long Poll) - они остаются.
+        """
+        async with self.connection.execute("DELETE FROM chat_members WHERE chat_id = ?", (chat_id,)):
+            pass
+        if up_to_message_id is None:
+            sql, params = "DELETE FROM messages WHERE chat_id = ?", (chat_id,)
+        else:
+            sql, params = "DELETE FROM messages WHERE chat_id = ? AND CAST(message_id AS INTEGER) <= ?", (chat_id, up_to_message_id)
+        async with self.connection.execute(sql, params):
+            pass
+        await self.save_chat_members(chat_id, members)
+        await self.save_messages(chat_id, messages, user_id_map)
+
+    async def delete_chats_except(self, group_ids: Iterable[str]) -> int:
+        """Удаляет чаты, которых больше нет в списке, вместе с их участниками и сообщениями"""
+        group_ids = list(group_ids)
+        placeholders = ",".join("?" * len(group_ids))
+        stale = f"SELECT id FROM chats WHERE group_id NOT IN ({placeholders})"
+        for table in ("messages", "chat_members", "daily_stats"):
+            async with self.connection.execute(f"DELETE FROM {table} WHERE chat_id IN ({stale})", group_ids):
+                pass
+        async with self.connection.execute(f"DELETE FROM chats WHERE group_id NOT IN ({placeholders})", group_ids) as cursor:
+            return cursor.rowcount
+
+    async def save_live_events(self, group_id: str, messages: MessageColumns, member_events: Dict[int, Tuple[bool, int]]):
+        """Записывает события Long Poll одного чата одной транзакцией
+
+        member_events: vk_id -> (участник ли после события, дата события). Изменения состава
+        сохраняются по group_id, чтобы анализ мог применить их поверх своего снимка участников.
+        """
+        async with self.connection.executemany("""
+            INSERT OR REPLACE INTO live_member_events (group_id, vk_id, is_member, event_date)
+            VALUES (?, ?, ?, ?)
+        """, [(group_id, vk_id, is_member, event_date) for vk_id, (is_member, event_date) in member_events.items()]):
+            pass
+
+        # Таблицы messages и chat_members ссылаются на чат, сохраненный анализом
+        chat_id = await self.get_chat_id_by_group_id(group_id)
+        if chat_id:
+            # Сначала входы, затем сообщения, затем выходы: в пакете есть и сообщения вошедших, и сообщения вышедших
+            await self.apply_member_changes(chat_id, {vk_id: True for vk_id, (is_member, _) in member_events.items() if is_member})
+            # Как и в анализе, сохраняются только сообщения участников, состоящих ровно в одном чате
+            async with self.connection.executemany("""
+                INSERT OR IGNORE INTO messages (message_id, chat_id, user_id, text, date)
+                SELECT ?, chat_id, user_id, '', ? FROM chat_members
+                WHERE chat_id = ? AND vk_id = ? AND is_active = 1
+            """, (
+                (str(message_id), datetime.fromtimestamp(message_date), chat_id, str(from_id))
+                for message_id, from_id, message_date in messages
+            )):
+                pass
+            await self.apply_member_changes(chat_id, {vk_id: False for vk_id, (is_member, _) in member_events.items() if not is_member})
+
+        await self.connection.commit()
+
+    async def apply_member_changes(self, chat_id: int, changes: Dict[int, bool]):
+        """Применяет входы (True) и выходы (False) участников чата
+
+        Участник, который уже активен в другом чате, становится дублированным: он исключается
+        из обоих чатов, как при фильтрации дубликатов в анализе.
+        """
+        joined = [str(vk_id) for vk_id, is_member in changes.items() if is_member]
+        left = [str(vk_id) for vk_id, is_member in changes.items() if not is_member]
+        user_id_map = await self.save_users(joined)
+
+        # Участник может числиться только в одном чате (см. UNIQUE(vk_id)) - неактивная запись переносится
+        async with self.connection.executemany("""
+            INSERT INTO chat_members (chat_id, user_id, vk_id, first_name, last_name, username, is_active)
+            VALUES (?, ?, ?, '', '', '', 1)
+            ON CONFLICT(vk_id) DO UPDATE SET
+                chat_id = excluded.chat_id, user_id = excluded.user_id,
+                joined_at = CURRENT_TIMESTAMP, left_at = NULL, is_active = 1
+            WHERE chat_members.chat_id = excluded.chat_id OR chat_members.is_active = 0
+        """, [(chat_id, user_id_map[vk_id], vk_id) for vk_id in joined]):
+            pass
+
+        # Вошедший остался активным в другом чате - теперь он дублированный
+        async with self.connection.executemany("""
+            UPDATE chat_members SET is_active = 0, left_at = CURRENT_TIMESTAMP
+            WHERE vk_id = ? AND chat_id != ? AND is_active = 1
+        """, [(vk_id, chat_id) for vk_id in joined]):
+            pass
+
+        async with self.connection.executemany("""
+            UPDATE chat_members SET is_active = 0, left_at = CURRENT_TIMESTAMP
+            WHERE vk_id = ? AND chat_id = ?
+        """, [(vk_id, chat_id) for vk_id in left]):
+            pass
+
+    async def get_live_member_events(self, group_id: str, since_date: int) -> Dict[int, bool]:
+        """Изменения состава чата из Long Poll не старше since_date (vk_id -> участник ли)"""
+        async with self.connection.execute("""
+            SELECT vk_id, is_member FROM live_member_events WHERE group_id = ? AND event_date >= ?
+        """, (group_id, since_date)) as cursor:
+            return {vk_id: bool(is_member) for vk_id, is_member in await cursor.fetchall()}
+
+    async def prune_live_member_events(self, before_date: int) -> int:
+        """Удаляет изменения состава старше окна анализа"""
+        async with self.connection.execute("""
+            DELETE FROM live_member_events WHERE event_date < ?
+        """, (before_date,)) as cursor:
+            deleted = cursor.rowcount
+        await self.connection.commit()
+        return deleted
+
+    async def get_user_statuses(self, vk_ids: List[int], min_checked_at: float) -> Dict[int, Tuple[str, float]]:
+        """Получает сохраненные статусы пользователей, проверенные не раньше min_checked_at"""
+        statuses = {}
+        chunk_size = 500  # Ограничение количества параметров SQLite
+        for i in range(0, len(vk_ids), chunk_size):
+            chunk = vk_ids[i:i + chunk_size]
+            placeholders = ','.join(['?' for _ in chunk])
+            async with self.connection.execute(f"""
+                SELECT vk_id, status, checked_at FROM user_status_cache
+                WHERE checked_at >= ? AND vk_id IN ({placeholders})
+            """, [min_checked_at] + list(chunk)) as cursor:
+                for row in await cursor.fetchall():
+                    statuses[row[0]] = (row[1], row[2])
+        return statuses
+
+    async def save_user_statuses(self, statuses: Dict[int, str], checked_at: float):
+        """Сохраняет статусы пользователей"""
+        async with self.connection.executemany("""
+            INSERT OR REPLACE INTO user_status_cache (vk_id, status, checked_at)
+            VALUES (?, ?, ?)
+        """, [(vk_id, status, checked_at) for vk_id, status in statuses.items()]):
+            pass
+        await self.connection.commit()
+
+    async def prune_user_statuses(self, before: float) -> int:
+        """Удаляет устаревшие статусы пользователей"""
+        async with self.connection.execute("""
+            DELETE FROM user_status_cache WHERE checked_at < ?
+        """, (before,)) as cursor:
+            deleted = cursor.rowcount
+        await self.connection.commit()
+        return deleted
+
+    async def get_token_health(self, token_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Сохраненные результаты проверки токенов (token_hash -> состояние)"""
+        health = {}
+        chunk_size = 500  # Ограничение количества параметров SQLite
+        for i in range(0, len(token_hashes), chunk_size):
+            chunk = token_hashes[i:i + chunk_size]
+            placeholders = ','.join(['?' for _ in chunk])
+            async with self.connection.execute(f"""
+                SELECT token_hash, status, reason, failures, checked_at, next_probe_at FROM token_health
+                WHERE token_hash IN ({placeholders})
+            """, chunk) as cursor:
+                for row in await cursor.fetchall():
+                    health[row[0]] = {
+                        'status': row[1],
+                        'reason': row[2],
+                        'failures': row[3],
+                        'checked_at': row[4],
+                        'next_probe_at': row[5]
+                    }
+        return health
+
+    async def save_token_health(self, token_hash: str, status: str, reason: Optional[str], failures: int,
+                                checked_at: float, next_probe_at: Optional[float]):
+        """Сохраняет результат проверки токена"""
+        async with self.connection.execute("""
+            INSERT OR REPLACE INTO token_health (token_hash, status, reason, failures, checked_at, next_probe_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (token_hash, status, reason, failures, checked_at, next_probe_at)):
+            pass
+
+    async def save_journal_result(self, run_date: date, result: Dict[str, Any]):
+        """Сохраняет сырой результат чата в журнал анализа
+
+        Участники и колонки сообщений хранятся как int64 подряд, описание чата - в JSON заголовке.
+        """
+        messages: MessageColumns = result['all_messages']
+        header = json.dumps({
+            'chat_name': result['chat_name'],
+            'group_id': result['group_id'],
+            'peer_id': result['peer_id'],
+            'members': len(result['all_members']),
+            'analysis_date': result['analysis_date'],
+            'validation_warning': result.get('validation_warning'),
+            'last_message_id': result.get('last_message_id'),
+            'fetched_at': result.get('fetched_at')
+        }).encode('utf-8')
+        members = array('q', result['all_members'])
+        blob = zlib.compress(struct.pack('<I', len(header)) + header + members.tobytes() + messages.tobytes())
+        async with self.connection.execute("""
+            INSERT OR REPLACE INTO analysis_journal (run_date, group_id, result, completed_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """, (run_date, result['group_id'], blob)):
+            pass
+        await self.connection.commit()
+
+    async def get_journal_group_ids(self, run_date: date) -> List[str]:
+        """Получает group_id чатов, уже обработанных в анализе за run_date"""
+        async with self.connection.execute("""
+            SELECT group_id FROM analysis_journal WHERE run_date = ?
+        """, (run_date,)) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def get_journal_result(self, run_date: date, group_id: str) -> Optional[Dict[str, Any]]:
+        """Получает результат одного чата из журнала анализа за run_date"""
+        async with self.connection.execute("""
+            SELECT result FROM analysis_journal WHERE run_date = ? AND group_id = ?
+        """, (run_date, group_id)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+
+        try:
+            data = zlib.decompress(row[0])
+            header_size = struct.unpack_from('<I', data)[0]
+            result = json.loads(data[4:4 + header_size].decode('utf-8'))
+            members_end = 4 + header_size + result.pop('members') * 8
+            members = array('q')
+            members.frombytes(data[4 + header_size:members_end])
+        except Exception as e:
+            logger.warning(f"Unreadable journal entry for chat {group_id}, it will be analyzed again: {e}")
+            return None
+
+        result['all_members'] = members.tolist()
+        result['all_messages'] = MessageColumns.frombytes(data[members_end:])
+        result['members_count'] = len(result['all_members'])
+        result['messages_last_month'] = len(result['all_messages'])
+        result['total_messages'] = len(result['all_messages'])
+        return result
+
+    async def clear_journal(self, before_date: Optional[date] = None):
+        """Очищает журнал анализа (весь или записи старше before_date)"""
+        if before_date:
+            sql, params = "DELETE FROM analysis_journal WHERE run_date < ?", (before_date,)
+        else:
+            sql, params = "DELETE FROM analysis_journal", ()
+        async with self.connection.execute(sql, params):
+            pass
+        await self.connection.commit()
+
+    async def save_analysis_run(self, run_date: date, stats: Dict[str, Any], chats: Dict[str, Dict[str, Any]]) -> int:
+        """Сохраняет замеры анализа (RunMetrics.get_stats() и строки по чатам), возвращает id запуска"""
+        async with self.connection.execute("""
+            INSERT INTO analysis_runs (run_date, started_at, finished_at, duration, chats, failed_chats, vk_requests,
+                                       phases, counters, histograms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            run_date, stats['started_at'], stats['finished_at'], stats['duration'], len(chats),
+            sum(1 for chat in chats.values() if chat['status'] in FAILED_CHAT_STATUSES), stats['counters'].get('vk_requests', 0),
+            json.dumps(stats['phases']), json.dumps(stats['counters']), json.dumps(stats['histograms'])
+        )) as cursor:
+            run_id = cursor.lastrowid
+
+        async with self.connection.executemany("""
+            INSERT INTO analysis_run_chats (run_id, group_id, status, attempts, fetch_seconds, vk_requests,
+                                            members, messages, save_seconds, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            (run_id, group_id, chat['status'], chat['attempts'], round(chat['fetch_seconds'], 3), chat['vk_requests'],
+             chat['members'], chat['messages'], round(chat['save_seconds'], 3), chat['error'])
+            for group_id, chat in chats.items()
+        )):
+            pass
+        await self.connection.commit()
+        return run_id
+
+    async def update_analysis_run_phases(self, run_id: int, phases: Dict[str, float]):
+        """Обновляет время этапов запуска (этапы после анализа, например построение отчета)"""
+        async with self.connection.execute("""
+            UPDATE analysis_runs SET phases = ? WHERE id = ?
+        """, (json.dumps(phases), run_id)):
+            pass
+        await self.connection.commit()
+
+    async def save_chat_overlaps(self, stat_date: date, pairs: List[Tuple[str, str, int]]):
+        """Заменяет пересечения чатов за день (тройки group_id_a, group_id_b, shared_members)"""
+        async with self.connection.execute("""
+            DELETE FROM chat_overlaps WHERE stat_date = ?
+        """, (stat_date,)):
+            pass
+        async with self.connection.executemany("""
+            INSERT INTO chat_overlaps (stat_date, group_id_a, group_id_b, shared_members)
+            VALUES (?, ?, ?, ?)
+        """, ((stat_date, group_id_a, group_id_b, shared) for group_id_a, group_id_b, shared in pairs)):
+            pass
+
+    async def prune_chat_overlaps(self, before_date: date) -> int:
+        """Удаляет пересечения чатов за дни раньше before_date"""
+        async with self.connection.execute("""
+            DELETE FROM chat_overlaps WHERE stat_date < ?
+        """, (before_date,)) as cursor:
+            deleted = cursor.rowcount
+        await self.connection.commit()
+        return deleted
+
+    async def get_chat_overlaps(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Пересечения чатов за последний день анализа, по убыванию числа общих участников"""
+        async with self.connection.execute(f"""
+            SELECT o.stat_date, o.group_id_a, ca.title, o.group_id_b, cb.title, o.shared_members
+            FROM chat_overlaps o
+            LEFT JOIN chats ca ON ca.group_id = o.group_id_a
+            LEFT JOIN chats cb ON cb.group_id = o.group_id_b
+            WHERE o.stat_date = (SELECT MAX(stat_date) FROM chat_overlaps)
+            ORDER BY o.shared_members DESC, o.group_id_a, o.group_id_b
+            {"LIMIT ?" if limit is not None else ""}
+        """, (limit,) if limit is not None else ()) as cursor:
+            rows = await cursor.fetchall()
+
+        return [
+            {
+                'stat_date': row[0],
+                'group_id_a': row[1],
+                'title_a': row[2] or '',
+                'group_id_b': row[3],
+                'title_b': row[4] or '',
+                'shared_members': row[5]
+            }
+            for row in rows
+        ]
+
+    async def save_hll_sketches(self, sketches: List[Tuple[date, str, str, HyperLogLog]]):
+        """Сохраняет скетчи (stat_date, group_id, kind, sketch)"""
+        async with self.connection.executemany("""
+            INSERT OR REPLACE INTO hll_sketches (stat_date, group_id, kind, registers)
+            VALUES (?, ?, ?, ?)
+        """, ((stat_date, group_id, kind, sketch.tobytes()) for stat_date, group_id, kind, sketch in sketches)):
+            pass
+
+    async def prune_hll_sketches(self, before_date: date) -> int:
+        """Удаляет скетчи за дни раньше before_date (вне окна анализа)"""
+        async with self.connection.execute("""
+            DELETE FROM hll_sketches WHERE stat_date < ?
+        """, (before_date,)) as cursor:
+            deleted = cursor.rowcount
+        await self.connection.commit()
+        return deleted
+
+    async def get_hll_sketches(self, kind: str, stat_date: Any, group_ids: Optional[List[str]] = None) -> Dict[str, HyperLogLog]:
+        """Скетчи вида kind за день stat_date (group_id -> скетч), по всем чатам или только по group_ids"""
+        async with self.connection.execute("""
+            SELECT group_id, registers FROM hll_sketches WHERE kind = ? AND stat_date = ?
+        """, (kind, stat_date)) as cursor:
+            rows = await cursor.fetchall()
+
+        if group_ids is not None:
+            group_ids = set(group_ids)
+            rows = [row for row in rows if row[0] in group_ids]
+        return {group_id: HyperLogLog.frombytes(registers) for group_id, registers in rows}
+
+    async def get_latest_hll_date(self) -> Optional[str]:
+        """Дата последнего анализа, для которого сохранены скетчи"""
+        async with self.connection.execute("""
+            SELECT MAX(stat_date) FROM hll_sketches WHERE kind = 'members'
+        """) as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def get_unique_estimate(self, kind: str, group_ids: Optional[List[str]] = None) -> Optional[int]:
+        """Приближенное число уникальных по набору чатов (объединение скетчей последнего анализа)
+
+        Без group_ids используется готовый скетч по всем чатам. None, если скетчей еще нет.
+        """
+        latest = await self.get_latest_hll_date()
+        if latest is None:
+            return None
+        sketches = await self.get_hll_sketches(kind, latest, [HLL_ALL_CHATS] if group_ids is None else group_ids)
+
+        merged = HyperLogLog()
+        for sketch in sketches.values():
+            merged.merge(sketch)
+        return merged.count()
+
+    async def count_unique_members(self, group_ids: Iterable[str]) -> int:
+        """Точное число уникальных активных участников в наборе чатов"""
+        group_ids = set(group_ids)
+        async with self.connection.execute("""
+            SELECT c.group_id, cm.vk_id FROM chat_members cm
+            JOIN chats c ON c.id = cm.chat_id
+            WHERE cm.is_active = 1
+        """) as cursor:
+            rows = await cursor.fetchall()
+        return len({vk_id for group_id, vk_id in rows if group_id in group_ids})
+
+    async def get_today_activity(self, group_ids: Iterable[str], today: Optional[date] = None) -> Dict[str, int]:
+        """Сообщения и авторы за сегодня в наборе чатов
+
+        Сообщения суммируются по чатам (номера сообщений разных бесед пересекаются), авторы
+        объединяются. Значения оцениваются по скетчам чатов за день анализа, а пока скетчей
+        нет - считаются точно по таблице messages.
+        """
+        today = self._today(today)
+        group_ids = set(group_ids)
+        if await self.get_latest_hll_date() is not None:
+            messages = await self.get_hll_sketches('day_messages', today, list(group_ids))
+            authors = HyperLogLog()
+            for sketch in (await self.get_hll_sketches('day_authors', today, list(group_ids))).values():
+                authors.merge(sketch)
+            return {'messages': sum(sketch.count() for sketch in messages.values()), 'authors': authors.count()}
+
+        async with self.connection.execute("""
+            SELECT c.group_id, m.message_id, m.user_id FROM messages m
+            JOIN chats c ON c.id = m.chat_id
+            WHERE DATE(m.date) = ?
+        """, (today,)) as cursor:
+            rows = await cursor.fetchall()
+        rows = [row for row in rows if row[0] in group_ids]
+        return {
+            'messages': len({(group_id, message_id) for group_id, message_id, user_id in rows}),
+            'authors': len({user_id for group_id, message_id, user_id in rows})
+        }
+
     async def get_latest_stats(self, chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
         """Получает последнюю статистику по чату или по всем чатам"""
         if chat_id:
@@ -233,8 +946,13 @@ class Database:
 
         return [dict(zip([col[0] for col in cursor.description], row)) for row in rows]
 
-    async def get_stats(self) -> Dict[str, Any]:
-        """Получает общую статистику"""
+    async def get_stats(self, exact: bool = False, today: Optional[date] = None) -> Dict[str, Any]:
+        """Получает общую статистику
+        
+        Уникальные участники, сообщения и авторы по умолчанию оцениваются по скетчам
+        HyperLogLog последнего анализа (погрешность около 1.6%). exact=True считает их
+        точно через COUNT(DISTINCT) по таблицам.
+        """
         try:
             from datetime import datetime, date
             
@@ -242,6 +960,24 @@ class Database:
             async with self.connection.execute("SELECT COUNT(*) FROM chats") as cursor:
                 total_chats = (await cursor.fetchone())[0] or 0
 
+            latest = None if exact else await self.get_latest_hll_date()
+            if latest is not None:
+                today = self._today(today)
+                total_unique_members = await self._estimate_all_chats('members', latest)
+                total_unique_messages = await self._estimate_all_chats('messages', latest)
+                unique_authors = await self._estimate_all_chats('authors', latest)
+                today_unique_messages = await self._estimate_all_chats('day_messages', today)
+                today_unique_authors = await self._estimate_all_chats('day_authors', today)
+                return {
+                    'total_chats': total_chats,
+                    'total_unique_members': total_unique_members,
+                    'total_unique_messages': total_unique_messages,
+                    'unique_authors': unique_authors,
+                    'has_data': total_chats > 0 or total_unique_members > 0 or total_unique_messages > 0,
+                    'today_unique_messages': today_unique_messages,
+                    'today_unique_authors': today_unique_authors
+                }
+
             # Получаем количество УНИКАЛЬНЫХ участников (из chat_members)
             async with self.connection.execute("SELECT COUNT(DISTINCT vk_id) FROM chat_members WHERE is_active = 1") as cursor:
                 total_unique_members = (await cursor.fetchone())[0] or 0
@@ -255,7 +991,7 @@ class Database:
                 unique_authors = (await cursor.fetchone())[0] or 0
 
             # Получаем статистику за сегодня (только для информации)
-            today = date.today()
+            today = self._today(today)
             async with self.connection.execute("""
                 SELECT COUNT(DISTINCT message_id) FROM messages 
                 WHERE DATE(date) = ?
@@ -293,9 +1029,22 @@ class Database:
                 'today_unique_authors': 0
             }
     
-    async def get_chats_stats(self) -> List[Dict[str, Any]]:
-        """Получает статистику по каждому чату"""
+    async def _estimate_all_chats(self, kind: str, stat_date: Any) -> int:
+        """Оценка по скетчу, объединяющему все чаты (0, если скетча нет)"""
+        sketch = (await self.get_hll_sketches(kind, stat_date, [HLL_ALL_CHATS])).get(HLL_ALL_CHATS)
+        return sketch.count() if sketch else 0
+
+    async def get_chats_stats(self, exact: bool = False) -> List[Dict[str, Any]]:
+        """Получает статистику по каждому чату
+        
+        По умолчанию уникальные значения оцениваются по скетчам HyperLogLog последнего
+        анализа, exact=True считает их через COUNT(DISTINCT) по таблицам.
+        """
         try:
+            latest = None if exact else await self.get_latest_hll_date()
+            if latest is not None:
+                return await self._get_chats_stats_estimated(latest)
+            
             async with self.connection.execute("""
                 SELECT 
                     c.group_id,
@@ -335,6 +1084,33 @@ class Database:
             logger.error(f"Failed to get chats stats: {e}")
             return []
 
+    async def _get_chats_stats_estimated(self, stat_date: Any) -> List[Dict[str, Any]]:
+        """Статистика по чатам из скетчей HyperLogLog"""
+        async with self.connection.execute("""
+            SELECT group_id, title, members_count FROM chats ORDER BY id
+        """) as cursor:
+            chats = await cursor.fetchall()
+        
+        members = await self.get_hll_sketches('members', stat_date)
+        messages = await self.get_hll_sketches('messages', stat_date)
+        authors = await self.get_hll_sketches('authors', stat_date)
+        
+        results = []
+        for group_id, title, members_count in chats:
+            unique_members = members[group_id].count() if group_id in members else 0
+            # Если нет участников, то не должно быть сообщений
+            unique_messages = messages[group_id].count() if unique_members and group_id in messages else 0
+            unique_authors = authors[group_id].count() if unique_members and group_id in authors else 0
+            results.append({
+                'group_id': group_id,
+                'title': title,
+                'members_count': members_count,
+                'unique_members': unique_members,
+                'unique_messages': unique_messages,
+                'unique_authors': unique_authors
+            })
+        return results
+
     async def get_chat_id_by_group_id(self, group_id: str) -> Optional[int]:
         """Получает ID чата по group_id"""
         try:
@@ -345,10 +1121,10 @@ class Database:
             logger.error(f"Failed to get chat_id by group_id {group_id}: {e}")
             return None
 
-    async def get_today_stats_for_chat(self, chat_id: int) -> Dict[str, int]:
+    async def get_today_stats_for_chat(self, chat_id: int, today: Optional[date] = None) -> Dict[str, int]:
         """Получает статистику за сегодня для конкретного чата"""
         try:
-            today = date.today()
+            today = self._today(today)
             
             # Сообщения за сегодня
             async with self.connection.execute("""
@@ -0,0 +1,48 @@
+"""
+Поиск и исключение пользователей, состоящих в нескольких чатах
+"""
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Set
+
+from message_columns import MessageColumns
+
+class DuplicationEngine:
+    """Подсчет вхождений пользователей по чатам на хешированных множествах
+
+    Counter.update считает вхождения на C-уровне, а проверки при фильтрации идут
+    по set за O(1), поэтому вся фильтрация линейна по числу участников и сообщений.
+    """
+
+    def __init__(self):
+        self.occurrences: Counter = Counter()  # user_id -> в скольких списках участников встречается
+        self._duplicated: Set[int] = None
+
+    def add_members(self, members: Iterable[int]):
+        """Учитывает участников одного чата"""
+        self.occurrences.update(members)
+        self._duplicated = None
+
+    @property
+    def duplicated_users(self) -> Set[int]:
+        """Пользователи, встречающиеся больше одного раза"""
+        if self._duplicated is None:
+            self._duplicated = {user_id for user_id, count in self.occurrences.items() if count > 1}
+        return self._duplicated
+
+    def filter_members(self, members: Iterable[int]) -> List[int]:
+        """Участники чата без дублированных пользователей"""
+        duplicated = self.duplicated_users
+        return [user_id for user_id in members if user_id not in duplicated]
+
+    def filter_messages(self, messages: MessageColumns) -> MessageColumns:
+        """Сообщения чата без сообщений дублированных пользователей"""
+        return messages.without_authors(self.duplicated_users)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Итоги дедупликации"""
+        duplicated_count = len(self.duplicated_users)
+        return {
+            'total_users': len(self.occurrences),
+            'duplicated_count': duplicated_count,
+            'unique_count': len(self.occurrences) - duplicated_count
+        }
@@ -0,0 +1,284 @@
+"""
+Замеры анализа: время этапов, счетчики и гистограммы задержек
+
+Замер стоит одного вызова часов и нескольких операций со словарем, поэтому метрики
+собираются всегда, а не только при отладке. RunMetrics относится к одному анализу,
+ProcessMetrics (process_metrics) - ко всему процессу бота и отдается в формате Prometheus.
+"""
+import bisect
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from clock import Clock, clock as default_clock
+
+# Границы корзин гистограмм в секундах: от 1 мс до ~17 минут, каждая следующая вдвое больше
+HISTOGRAM_BOUNDS = [0.001 * 2 ** power for power in range(21)]
+
+# Этапы анализа в порядке выполнения и их названия для отчета в Telegram
+PHASES = {
+    "preflight": "проверка токенов",
+    "fetch": "загрузка из VK",
+    "dedup": "дедупликация",
+    "database": "запись в БД",
+    "overlaps": "пересечения",
+    "report": "отчет",
+}
+
+# Итог чата в анализе: ok, failed, quarantined или restored (взят из журнала прерванного анализа)
+FAILED_CHAT_STATUSES = ("failed", "quarantined")
+
+class Histogram:
+    """Гистограмма с фиксированными экспоненциальными корзинами"""
+
+    def __init__(self, bounds: List[float] = None):
+        self.bounds = bounds or HISTOGRAM_BOUNDS
+        self.buckets = [0] * (len(self.bounds) + 1)  # Последняя корзина - больше верхней границы
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля: верхняя граница корзины, в которую он попадает"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank and bucket:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "p50": round(self.quantile(0.5), 3),
+            "p95": round(self.quantile(0.95), 3),
+            "max": round(self.max, 3),
+        }
+
+class RunMetrics:
+    """Метрики одного анализа: этапы, счетчики, гистограммы и данные по чатам
+
+    Этапы (phase) - время анализа по шагам; то, что выполняется параллельно для разных чатов
+    (запросы VK, проверка статусов, загрузка чата), учитывается гистограммами по вызовам.
+    """
+
+    def __init__(self, clock: Clock = None):
+        self.clock = clock or default_clock
+        self.started_at = self.clock.now()
+        self._started = self.clock.monotonic()
+        self.finished_at = None
+        self.duration = 0.0
+        self.phases: Dict[str, float] = {}
+        self.counters: Counter = Counter()
+        self.histograms: Dict[str, Histogram] = {}
+        self.chats: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Добавляет время выполнения блока к этапу name"""
+        started = self.clock.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, self.clock.monotonic() - started)
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def chat(self, group_id: str) -> Dict[str, Any]:
+        """Строка детализации чата (создается при первом обращении)"""
+        chat = self.chats.get(group_id)
+        if chat is None:
+            chat = self.chats[group_id] = {
+                "status": "ok", "attempts": 0, "fetch_seconds": 0.0, "vk_requests": 0,
+                "members": 0, "messages": 0, "save_seconds": 0.0, "error": None,
+            }
+        return chat
+
+    def finish(self):
+        self.finished_at = self.clock.now()
+        self.duration = self.clock.monotonic() - self._started
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": round(self.duration, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "counters": dict(self.counters),
+            "histograms": {name: histogram.get_stats() for name, histogram in sorted(self.histograms.items())},
+        }
+
+    def count_failed(self) -> int:
+        """Количество чатов, которые не удалось проанализировать (в том числе из-за карантина токена)"""
+        return sum(1 for chat in self.chats.values() if chat["status"] in FAILED_CHAT_STATUSES)
+
+    def format_summary(self) -> str:
+        """Краткая сводка для сообщения о завершении анализа"""
+        chats = len(self.chats)
+        failed = self.count_failed()
+        lines = [f"⏱ Время анализа: {_format_seconds(self.duration)}"]
+        phases = [f"{title} {_format_seconds(self.phases[name])}" for name, title in PHASES.items() if name in self.phases]
+        if phases:
+            lines.append("   " + ", ".join(phases))
+        if chats and self.duration > 0:
+            lines.append(f"🚀 {chats / self.duration * 60:.0f} чатов/мин ({chats} чатов, ошибок {failed})")
+
+        requests = self.counters.get("vk_requests", 0)
+        if requests:
+            latency = self._vk_latency()
+            errors = ", ".join(
+                f"{name.rsplit('.', 1)[1]}: {value}" for name, value in sorted(self.counters.items())
+                if name.startswith("vk_errors.")
+            )
+            line = f"🌐 VK: {requests} запросов"
+            if latency:
+                line += f", p95 {latency.quantile(0.95):.2f} с"
+            if errors:
+                line += f", ошибки {errors}"
+            lines.append(line)
+        status_check = self.histograms.get("status_check")
+        if status_check:
+            lines.append(f"🔎 Проверка статусов: {status_check.count} вызовов, p95 {status_check.quantile(0.95):.2f} с")
+        wait = self.histograms.get("rate_limit_wait")
+        if wait and wait.sum >= 1:
+            lines.append(f"⏳ Ожидание лимита VK: {_format_seconds(wait.sum)} (макс. {wait.max:.1f} с)")
+        return "\n".join(lines)
+
+    def _vk_latency(self) -> Optional[Histogram]:
+        """Задержки ответов VK по всем методам"""
+        histograms = [histogram for name, histogram in self.histograms.items() if name.startswith("vk.")]
+        if not histograms:
+            return None
+        merged = Histogram()
+        for histogram in histograms:
+            merged.buckets = [a + b for a, b in zip(merged.buckets, histogram.buckets)]
+            merged.count += histogram.count
+            merged.sum += histogram.sum
+            merged.max = max(merged.max, histogram.max)
+        return merged
+
+def _format_seconds(seconds: float) -> str:
+    """12.3 с, 4:05 или 1:02:03"""
+    if seconds < 60:
+        return f"{seconds:.1f} с"
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes}:{seconds:02d}"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+# Описания метрик процесса для # HELP (имя -> тип и описание)
+PROCESS_METRICS = {
+    "vk_requests_total": ("counter", "HTTP requests to VK API by method"),
+    "vk_errors_total": ("counter", "VK API errors by method and error code (network - request failed)"),
+    "vk_request_duration_seconds": ("histogram", "VK API response time by method"),
+    "vk_rate_limit_wait_seconds": ("histogram", "Time spent waiting for the per-token rate limit"),
+    "sqlite_query_duration_seconds": ("histogram", "SQLite statement time by statement type"),
+    "telegram_handler_duration_seconds": ("histogram", "Telegram handler time by handler"),
+    "event_loop_lag_seconds": ("histogram", "Delay of the event loop in waking up a periodic timer"),
+    "analysis_chats_total": ("counter", "Analyzed chats by result"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class ProcessMetrics:
+    """Счетчики и гистограммы процесса с метками; значения состояния (gauge) собираются при запросе"""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]):
+        """Функция, возвращающая текущие значения (имя, описание, метки, значение) при каждом запросе
+
+        Повторная регистрация той же функции ничего не меняет.
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]):
+        """Убирает функцию, зарегистрированную add_collector"""
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        families: Dict[str, List[str]] = {}
+        types: Dict[str, Tuple[str, str]] = {}
+
+        for (name, labels), value in sorted(self.counters.items()):
+            types[name] = PROCESS_METRICS.get(name, ("counter", name))
+            families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            types[name] = PROCESS_METRICS.get(name, ("histogram", name))
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds, histogram.buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for collector in self._collectors:
+            for name, description, labels, value in collector():
+                types[name] = ("gauge", description)
+                families.setdefault(name, []).append(
+                    f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}"
+                )
+
+        output = []
+        for name, lines in families.items():
+            kind, description = types[name]
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+# Метрики процесса бота (отдаются на /metrics, если включен METRICS_ENABLED)
+process_metrics = ProcessMetrics()
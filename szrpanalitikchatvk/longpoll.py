@@ -0,0 +1,275 @@
+"""
+Получение новых сообщений и изменений состава чатов в реальном времени через VK Bots Long Poll
+"""
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+import aiohttp
+from loguru import logger
+
+from config import config
+from database_sqlite import Database, db
+from vk_client import VKClient, create_session
+from message_columns import MessageColumns
+from analyzer import sync_chat_history
+
+# Служебные действия, меняющие состав чата
+MEMBER_JOIN_ACTIONS = ("chat_invite_user", "chat_invite_user_by_link")
+MEMBER_LEAVE_ACTIONS = ("chat_kick_user",)
+
+class LongPollIngestor:
+    """Подписка на события сообществ через groups.getLongPollServer
+
+    Новые сообщения пакетами пишутся в message_history и messages, приглашения и
+    исключения - в chat_members и live_member_events. Запись идет через собственное
+    соединение с базой, чтобы не фиксировать чужую незавершенную транзакцию анализа. Отметка синхронизации чата сдвигается только по
+    непрерывному потоку событий: если VK сообщает о потере событий, пропуск
+    догружается через messages.getHistory, поэтому ежедневному анализу остается
+    только сверка.
+    """
+
+    def __init__(self, chats: List[Dict[str, Any]] = None, db_instance=None, base_url: str = None,
+                 session: aiohttp.ClientSession = None):
+        self.chats = chats
+        self.db = db_instance
+        self._owns_db = db_instance is None
+        self.base_url = base_url
+        self.session = session
+        self._owns_session = session is None
+        # Отдельный пул для a_check: каждый чат держит одно соединение до LONGPOLL_WAIT секунд,
+        # а все серверы Long Poll находятся на одном хосте, поэтому общий пул VK API (VK_CONNECTION_LIMIT_PER_HOST)
+        # пропускал бы лишь часть чатов, остальные ждали бы слот и теряли время ожидания
+        self.poll_session: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_wakeup = asyncio.Event()
+        self._running = False
+        # Накопленные события по group_id
+        self._messages: Dict[str, MessageColumns] = {}
+        # vk_id -> (True - вошел / False - вышел, дата события), побеждает последнее событие
+        self._members: Dict[str, Dict[int, Tuple[bool, int]]] = {}
+        self._newest: Dict[str, Dict[str, int]] = {}  # Самое новое полученное сообщение чата
+        self._dirty: Set[str] = set()  # Чаты с событиями, еще не записанными в базу
+        self._pending = 0
+        self.events_received = 0
+        self.catch_ups = 0
+
+    async def start(self):
+        """Подключается к Long Poll всех чатов"""
+        if self._running:
+            return
+        if self.chats is None:
+            self.chats = config.get_vk_chats()
+        if not self.chats:
+            logger.warning("Long poll ingestion: no chats configured")
+            return
+
+        if self.db is None:
+            self.db = Database()
+            self.db.db_path = db.db_path
+            await self.db.initialize()
+        if self.session is None:
+            self.session = create_session()
+            self._owns_session = True
+        pool_size = len(self.chats) + config.LONGPOLL_POOL_RESERVE
+        self.poll_session = create_session(limit=pool_size, limit_per_host=pool_size)
+
+        self._running = True
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self._tasks = [asyncio.create_task(self._poll_group(chat)) for chat in self.chats]
+        logger.info(f"Long poll ingestion started for {len(self.chats)} chats")
+
+    async def stop(self):
+        """Останавливает подписки и записывает накопленные события"""
+        if not self._running:
+            return
+        self._running = False
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        self._flush_wakeup.set()
+        if self._flush_task:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+        if self.poll_session:
+            await self.poll_session.close()
+            self.poll_session = None
+        if self.session and self._owns_session:
+            await self.session.close()
+            self.session = None
+        if self.db and self._owns_db:
+            await self.db.close()
+            self.db = None
+
+        logger.info(f"Long poll ingestion stopped: {self.events_received} events received, {self.catch_ups} catch-ups")
+
+    async def _poll_group(self, chat: Dict[str, Any]):
+        """Цикл Long Poll одного сообщества"""
+        group_id = str(chat["group_id"])
+        vk_client = VKClient(chat["token"], session=self.session, base_url=self.base_url)
+        server = None
+        retry_delay = 1.0
+
+        while self._running:
+            try:
+                if server is None:
+                    # Сначала подписываемся, затем догружаем пропущенное: события после ts придут через Long Poll.
+                    # Пока догрузка не удалась, чат считается неподписанным
+                    new_server = await self._get_server(vk_client, group_id)
+                    if new_server is None:
+                        await asyncio.sleep(config.LONGPOLL_RETRY_DELAY)
+                        continue
+                    await self._catch_up(vk_client, group_id)
+                    server = new_server
+
+                data = await self._check(server)
+                retry_delay = 1.0
+
+                failed = data.get("failed")
+                if failed == 2:
+                    # Истек ключ: получаем новый, ts остается прежним
+                    logger.info(f"Long poll key expired for group {group_id}")
+                    new_server = await self._get_server(vk_client, group_id)
+                    if new_server:
+                        server.update(key=new_server["key"], server=new_server["server"])
+                    else:
+                        server = None
+                    continue
+                if failed:
+                    # События утеряны (1) или информация утрачена (3): переподписываемся и догружаем пропуск из истории
+                    logger.warning(f"Long poll events lost for group {group_id} (failed={failed}), catching up")
+                    server = None
+                    continue
+
+                server["ts"] = data.get("ts", server["ts"])
+                for update in data.get("updates", []):
+                    self._handle_update(group_id, update)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Long poll request failed for group {group_id}: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, config.LONGPOLL_RETRY_DELAY)
+
+    async def _get_server(self, vk_client: VKClient, group_id: str) -> Optional[Dict[str, Any]]:
+        """Получает адрес, ключ и ts Long Poll сервера сообщества"""
+        response = await vk_client._make_request("groups.getLongPollServer", {"group_id": group_id})
+        server = response.get("response", {})
+        if not server.get("server") or not server.get("key"):
+            logger.error(f"Failed to get long poll server for group {group_id}")
+            return None
+        return {"server": server["server"], "key": server["key"], "ts": server["ts"]}
+
+    async def _check(self, server: Dict[str, Any]) -> Dict[str, Any]:
+        """Ожидает новые события (запрос держится сервером до LONGPOLL_WAIT секунд)"""
+        params = {"act": "a_check", "key": server["key"], "ts": server["ts"], "wait": config.LONGPOLL_WAIT}
+        # Без total: время ожидания свободного соединения в пуле не должно съедать время ответа
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=config.VK_CONNECT_TIMEOUT,
+                                        sock_read=config.LONGPOLL_WAIT + config.VK_CONNECT_TIMEOUT)
+        async with self.poll_session.get(server["server"], params=params, timeout=timeout) as response:
+            return await response.json(content_type=None)
+
+    async def _catch_up(self, vk_client: VKClient, group_id: str):
+        """Догружает сообщения новее отметки синхронизации через messages.getHistory"""
+        async with self._flush_lock:
+            # Сначала записываем уже полученные события, чтобы отметка не отстала от них
+            await self._flush_group(group_id)
+            await sync_chat_history(self.db, vk_client, group_id)
+            state = await self.db.get_sync_state(group_id)
+            if state:
+                self._newest[group_id] = {"id": state["last_message_id"], "date": state["last_message_date"]}
+        self.catch_ups += 1
+
+    def _handle_update(self, group_id: str, update: Dict[str, Any]):
+        """Разбирает одно событие Long Poll"""
+        if update.get("type") != "message_new":
+            return
+
+        obj = update.get("object", {})
+        message = obj.get("message", obj)  # До версии API 5.103 сообщение передавалось без обертки
+        if message.get("peer_id") != config.PEER_ID:
+            return
+
+        self.events_received += 1
+        self._dirty.add(group_id)
+        newest = self._newest.get(group_id)
+        if newest is None or message.get("id", 0) > newest["id"]:
+            self._newest[group_id] = {"id": message.get("id", 0), "date": message.get("date", 0)}
+
+        if message.get("from_id", 0) > 0:
+            self._messages.setdefault(group_id, MessageColumns()).append(
+                message.get("id", 0), message["from_id"], message.get("date", 0))
+            self._pending += 1
+
+        action = message.get("action") or {}
+        if action.get("type") in MEMBER_JOIN_ACTIONS + MEMBER_LEAVE_ACTIONS:
+            # Для входа по ссылке member_id не передается - вошел автор сообщения
+            member_id = action.get("member_id") or message.get("from_id", 0)
+            if member_id > 0:
+                self._members.setdefault(group_id, {})[member_id] = (action["type"] in MEMBER_JOIN_ACTIONS,
+                                                                     message.get("date", 0))
+                self._pending += 1
+
+        if self._pending >= config.LONGPOLL_FLUSH_SIZE:
+            self._flush_wakeup.set()
+
+    async def _flush_loop(self):
+        """Периодически записывает накопленные события в базу"""
+        while self._running:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), config.LONGPOLL_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to save long poll events: {e}")
+
+    async def flush(self):
+        """Записывает накопленные события всех чатов"""
+        async with self._flush_lock:
+            for group_id in list(self._dirty):
+                await self._flush_group(group_id)
+
+    async def _flush_group(self, group_id: str):
+        self._dirty.discard(group_id)
+        messages = self._messages.pop(group_id, None) or MessageColumns()
+        members = self._members.pop(group_id, {})
+        self._pending -= len(messages) + len(members)
+
+        try:
+            if messages:
+                await self.db.save_history_messages(group_id, messages)
+            if messages or members:
+                await self.db.save_live_events(group_id, messages, members)
+
+            newest = self._newest.get(group_id)
+            if newest:
+                state = await self.db.get_sync_state(group_id)
+                if state is None or newest["id"] > state["last_message_id"]:
+                    await self.db.save_sync_state(group_id, newest["id"], newest["date"])
+        except Exception:
+            # База занята или недоступна - события возвращаются в очередь до следующей записи
+            self._requeue(group_id, messages, members)
+            raise
+
+        if messages or members:
+            logger.debug(f"Long poll: saved {len(messages)} messages and {len(members)} member changes for group {group_id}")
+
+    def _requeue(self, group_id: str, messages: MessageColumns, members: Dict[int, Tuple[bool, int]]):
+        """Возвращает незаписанные события чата перед накопленными после них"""
+        self._dirty.add(group_id)
+        self._pending += len(messages) + len(members)
+        newer_messages = self._messages.pop(group_id, None)
+        if newer_messages:
+            messages.extend_columns(newer_messages)
+        if messages:
+            self._messages[group_id] = messages
+        self._members[group_id] = {**members, **self._members.get(group_id, {})}
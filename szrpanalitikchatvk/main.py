@@ -4,10 +4,13 @@
 import asyncio
 import signal
 from loguru import logger
-from config import Config
+from config import Config, config
 from database_sqlite import db
 from telegram_bot import TelegramBot
 from scheduler import Scheduler
+from analyzer import stop_running_analyzers
+from longpoll import LongPollIngestor
+from metrics_server import MetricsServer
 
 class VKSimpleBot:
     """Простой VK бот"""
@@ -15,6 +18,8 @@ class VKSimpleBot:
     def __init__(self):
         self.telegram_bot = TelegramBot()
         self.scheduler = Scheduler()
+        self.longpoll = LongPollIngestor() if config.LONGPOLL_ENABLED else None
+        self.metrics_server = MetricsServer() if config.METRICS_ENABLED else None
         self.running = False
     
     async def start(self):
@@ -25,12 +30,20 @@ class VKSimpleBot:
             # Инициализируем базу данных
             await db.initialize()
             
+            # Эндпоинт метрик для Prometheus (опционально)
+            if self.metrics_server:
+                await self.metrics_server.start()
+            
             # Передаем Telegram бота в планировщик
             self.scheduler.set_telegram_bot(self.telegram_bot)
             
             # Запускаем планировщик
             asyncio.create_task(self.scheduler.start())
             
+            # Получаем новые сообщения в реальном времени (опционально)
+            if self.longpoll:
+                await self.longpoll.start()
+            
             # Запускаем Telegram бота
             self.running = True
             await self.telegram_bot.start_polling()
@@ -47,6 +60,17 @@ class VKSimpleBot:
         # Останавливаем планировщик
         await self.scheduler.stop()
         
+        # Прерываем анализ, если он идет: обработанные чаты остаются в журнале
+        await stop_running_analyzers()
+        
+        # Останавливаем Long Poll и записываем накопленные события
+        if self.longpoll:
+            await self.longpoll.stop()
+        
+        # Останавливаем эндпоинт метрик
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        
         # Закрываем базу данных
         await db.close()
         
@@ -0,0 +1,119 @@
+"""
+Компактное хранение сообщений чата для анализа
+"""
+from array import array
+from itertools import compress
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+class MessageColumns:
+    """Сообщения одного чата в трех колонках int64: id, from_id и date
+
+    Анализу нужны только эти поля, поэтому текст, вложения и пересланные сообщения
+    из ответов VK не хранятся: 24 байта на сообщение вместо словаря на килобайты.
+    """
+
+    __slots__ = ("ids", "from_ids", "dates")
+
+    def __init__(self):
+        self.ids = array('q')
+        self.from_ids = array('q')
+        self.dates = array('q')
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Dict[str, Any]]) -> "MessageColumns":
+        """Создает колонки из сообщений VK"""
+        columns = cls()
+        columns.extend(messages)
+        return columns
+
+    @classmethod
+    def from_fields(cls, ids: Iterable[int], from_ids: Iterable[int], dates: Iterable[int]) -> "MessageColumns":
+        """Создает колонки из готовых списков полей (проекция истории в execute)"""
+        columns = cls()
+        columns.ids = array('q', ids)
+        columns.from_ids = array('q', from_ids)
+        columns.dates = array('q', dates)
+        return columns
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, int, int]]) -> "MessageColumns":
+        """Создает колонки из строк (id, from_id, date)"""
+        columns = cls()
+        for message_id, from_id, message_date in rows:
+            columns.append(message_id, from_id, message_date)
+        return columns
+
+    def append(self, message_id: int, from_id: int, message_date: int):
+        self.ids.append(message_id)
+        self.from_ids.append(from_id)
+        self.dates.append(message_date)
+
+    def extend(self, messages: Iterable[Dict[str, Any]]):
+        """Добавляет сообщения VK, отбрасывая все поля, кроме id, from_id и date"""
+        for msg in messages:
+            self.append(msg.get("id", 0), msg.get("from_id", 0), msg.get("date", 0))
+
+    def extend_columns(self, other: "MessageColumns"):
+        """Добавляет сообщения из других колонок"""
+        self.ids.extend(other.ids)
+        self.from_ids.extend(other.from_ids)
+        self.dates.extend(other.dates)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.ids, self.from_ids, self.dates)
+
+    @property
+    def nbytes(self) -> int:
+        """Объем данных колонок в байтах"""
+        return len(self.ids) * self.ids.itemsize * 3
+
+    def authors(self) -> Set[int]:
+        """Уникальные авторы-пользователи (положительные from_id)"""
+        return {from_id for from_id in set(self.from_ids) if from_id > 0}
+
+    def _select(self, mask: List[bool]) -> "MessageColumns":
+        columns = MessageColumns()
+        columns.ids = array('q', compress(self.ids, mask))
+        columns.from_ids = array('q', compress(self.from_ids, mask))
+        columns.dates = array('q', compress(self.dates, mask))
+        return columns
+
+    def only_authors(self, authors: Set[int]) -> "MessageColumns":
+        """Сообщения только от указанных авторов"""
+        return self._select([from_id in authors for from_id in self.from_ids])
+
+    def without_authors(self, authors: Set[int]) -> "MessageColumns":
+        """Сообщения без указанных авторов"""
+        return self._select([from_id not in authors for from_id in self.from_ids])
+
+    def between(self, start: int, end: int) -> "MessageColumns":
+        """Сообщения с датой в интервале [start, end] (unix time)"""
+        return self._select([start <= message_date <= end for message_date in self.dates])
+
+    def newer_than(self, message_id: int) -> "MessageColumns":
+        """Сообщения с id больше message_id"""
+        return self._select([current_id > message_id for current_id in self.ids])
+
+    def from_users(self, start: int = None, end: int = None) -> "MessageColumns":
+        """Сообщения от пользователей (положительные from_id), при необходимости за интервал дат"""
+        if start is None:
+            return self._select([from_id > 0 for from_id in self.from_ids])
+        return self._select([from_id > 0 and start <= message_date <= end
+                             for from_id, message_date in zip(self.from_ids, self.dates)])
+
+    def tobytes(self) -> bytes:
+        """Колонки подряд в машинном представлении (для хранения на диске)"""
+        return self.ids.tobytes() + self.from_ids.tobytes() + self.dates.tobytes()
+
+    @classmethod
+    def frombytes(cls, data: bytes) -> "MessageColumns":
+        """Восстанавливает колонки, сохраненные tobytes"""
+        columns = cls()
+        size = len(data) // 3
+        columns.ids.frombytes(data[:size])
+        columns.from_ids.frombytes(data[size:2 * size])
+        columns.dates.frombytes(data[2 * size:])
+        return columns
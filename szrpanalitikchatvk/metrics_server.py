@@ -0,0 +1,66 @@
+"""
+HTTP эндпоинт метрик процесса в текстовом формате Prometheus (GET /metrics)
+
+Включается METRICS_ENABLED=true и по умолчанию слушает только localhost.
+"""
+import asyncio
+import time
+from typing import Optional
+
+from aiohttp import web
+from loguru import logger
+
+from config import config
+from instrumentation import process_metrics
+
+# Тип ответа текстового формата Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsServer:
+    """Сервер /metrics и замер задержки цикла событий"""
+
+    def __init__(self, host: str = None, port: int = None, lag_interval: float = None):
+        self.host = host or config.METRICS_HOST
+        self.port = port or config.METRICS_PORT
+        self.lag_interval = lag_interval or config.EVENT_LOOP_LAG_INTERVAL
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self._handle_metrics)
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self.last_lag = 0.0
+        self._started_at = time.monotonic()
+
+    async def start(self):
+        """Запускает сервер и замер задержки цикла событий"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        process_metrics.add_collector(self._collect)
+        self._lag_task = asyncio.create_task(self._measure_lag())
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """Останавливает сервер"""
+        process_metrics.remove_collector(self._collect)
+        if self._lag_task:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _measure_lag(self):
+        """Засыпает на lag_interval и замеряет, насколько позже цикл событий разбудил задачу"""
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.last_lag = max(time.perf_counter() - started_at - self.lag_interval, 0.0)
+            process_metrics.observe("event_loop_lag_seconds", self.last_lag)
+
+    def _collect(self):
+        yield "event_loop_lag_last_seconds", "Event loop lag measured by the last timer", {}, self.last_lag
+        yield "process_uptime_seconds", "Seconds since the metrics endpoint started", {}, time.monotonic() - self._started_at
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=process_metrics.render().encode("utf-8"),
+                            headers={"Content-Type": CONTENT_TYPE})
@@ -0,0 +1,54 @@
+"""
+Матрица пересечений участников между чатами
+"""
+from array import array
+from collections import Counter
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+class OverlapMatrix:
+    """Число общих участников для каждой пары чатов
+
+    Пользователи, состоящие больше чем в одном чате, получают плотные номера 0..N-1,
+    и каждый чат хранится как отсортированный массив int32 этих номеров - строка
+    разреженной матрицы X (чаты × пользователи). Матрица пересечений X·Xᵀ считается
+    по инвертированному индексу пользователь -> чаты.
+    Участники только одного чата в пересечения не попадают и в матрице не хранятся.
+    """
+
+    def __init__(self, shared_users: Set[int]):
+        self.dense_ids: Dict[int, int] = {user_id: index for index, user_id in enumerate(sorted(shared_users))}
+        self.group_ids: List[str] = []
+        self._rows: List[array] = []
+
+    def add_chat(self, group_id: str, members: Iterable[int]):
+        """Добавляет строку чата"""
+        dense_ids = self.dense_ids
+        self.group_ids.append(group_id)
+        self._rows.append(array('i', sorted({dense_ids[user_id] for user_id in members if user_id in dense_ids})))
+
+    @property
+    def nbytes(self) -> int:
+        """Объем строк матрицы в байтах"""
+        return sum(len(row) * row.itemsize for row in self._rows)
+
+    def pairs(self) -> List[Tuple[str, str, int]]:
+        """Все пары чатов с общими участниками: (group_id_a, group_id_b, shared_members)"""
+        if not self._rows or not self.dense_ids:
+            return []
+        counts = self._pair_counts()
+        group_ids = self.group_ids
+        return [(group_ids[row], group_ids[col], int(shared)) for (row, col), shared in counts]
+
+    def _pair_counts(self):
+        """Инвертированный индекс пользователь -> чаты, пары считаются Counter на C-уровне"""
+        user_chats: List[List[int]] = [[] for _ in range(len(self.dense_ids))]
+        for chat_index, row in enumerate(self._rows):
+            for dense_id in row:
+                user_chats[dense_id].append(chat_index)
+
+        counts = Counter()
+        for chats in user_chats:
+            if len(chats) > 1:
+                counts.update(combinations(chats, 2))
+        return counts.items()
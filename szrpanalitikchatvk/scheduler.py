@@ -4,6 +4,7 @@
 import asyncio
 from datetime import datetime, time, timedelta
 from loguru import logger
+from clock import Clock, clock as default_clock
 from database_sqlite import db
 from analyzer import ChatAnalyzer
 from telegram_bot import TelegramBot
@@ -13,9 +14,12 @@ from aiogram import types
 class Scheduler:
     """Простой планировщик"""
     
-    def __init__(self):
+    DAILY_ANALYSIS_TIME = time(6, 27)  # Время ежедневного анализа
+    
+    def __init__(self, clock: Clock = None):
         self.running = False
         self.telegram_bot = None
+        self.clock = clock or default_clock  # Время и паузы (виртуальные в симуляции)
     
     def set_telegram_bot(self, telegram_bot: TelegramBot):
         """Устанавливает Telegram бота для отправки уведомлений"""
@@ -36,8 +40,8 @@ class Scheduler:
         """Ежедневный анализ"""
         while self.running:
             try:
-                now = datetime.now()
-                target_time = time(6, 27)  
+                now = self.clock.now()
+                target_time = self.DAILY_ANALYSIS_TIME
                 
                 # Вычисляем время до следующего запуска
                 next_run = datetime.combine(now.date(), target_time)
@@ -47,7 +51,7 @@ class Scheduler:
                 wait_seconds = (next_run - now).total_seconds()
                 logger.info(f"Next daily analysis scheduled for {next_run}")
                 
-                await asyncio.sleep(wait_seconds)
+                await self.clock.sleep(wait_seconds)
                 
                 if self.running:
                     logger.info("Starting daily analysis...")
@@ -55,13 +59,13 @@ class Scheduler:
                     
             except Exception as e:
                 logger.error(f"Error in daily analysis task: {e}")
-                await asyncio.sleep(3600)  # Ждем час при ошибке
+                await self.clock.sleep(3600)  # Ждем час при ошибке
     
     async def _run_daily_analysis(self):
         """Выполнение ежедневного анализа"""
         try:
             logger.info("Starting daily analysis...")
-            analyzer = ChatAnalyzer(db)
+            analyzer = ChatAnalyzer(db, clock=self.clock)
             results = await analyzer.analyze_all_chats()
             
             if not results:
@@ -70,13 +74,13 @@ class Scheduler:
                     await self._send_error_notification("Ежедневный анализ завершился с ошибкой: Нет результатов")
             else:
                 # Считаем общую статистику
-                total_members = sum(len(r.get('filtered_members', [])) for r in results)
-                total_messages = sum(len(r.get('filtered_messages', [])) for r in results)
+                total_members = sum(r.get('members_count', 0) for r in results)
+                total_messages = sum(r.get('messages_last_month', 0) for r in results)
                 logger.info(f"Daily analysis completed: {len(results)} chats, {total_members} members, {total_messages} messages")
                 
                 # Отправляем CSV таблицу
                 if self.telegram_bot:
-                    await self._send_daily_report(results)
+                    await self._send_daily_report(results, analyzer)
                 
         except Exception as e:
             logger.error(f"Failed to run daily analysis: {e}")
@@ -86,16 +90,21 @@ class Scheduler:
     async def _monitor(self):
         """Мониторинг планировщика"""
         while self.running:
-            await asyncio.sleep(60)  # Проверяем каждую минуту
+            await self.clock.sleep(60)  # Проверяем каждую минуту
     
-    async def _send_daily_report(self, results):
+    async def _send_daily_report(self, results, analyzer: ChatAnalyzer = None):
         """Отправляет ежедневный отчет с CSV всем пользователям"""
         try:
             # Создаем CSV с актуальными результатами анализа
+            started_at = self.clock.monotonic()
             csv_content = await self._create_daily_report_csv(results)
+            summary = ""
+            if analyzer and analyzer.metrics:
+                await analyzer.save_report_phase(self.clock.monotonic() - started_at)
+                summary = f"\n\n{analyzer.metrics.format_summary()}"
             
             # Создаем файл
-            filename = f"daily_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            filename = f"daily_report_{self.clock.now().strftime('%Y%m%d_%H%M%S')}.csv"
             
             # Получаем всех пользователей Telegram
             users = await db.get_all_telegram_users()
@@ -110,9 +119,9 @@ class Scheduler:
                             filename=filename
                         ),
                         caption=f"📊 **Ежедневный отчет VK чатов**\n\n"
-                               f"📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+                               f"📅 Дата: {self.clock.now().strftime('%d.%m.%Y %H:%M')}\n"
                                f"📁 Файл: {filename}\n\n"
-                               f"✅ Анализ завершен автоматически!"
+                               f"✅ Анализ завершен автоматически!{summary}"
                     )
                     logger.info(f"Daily report sent to user {user['user_id']}")
                 except Exception as e:
@@ -142,7 +151,7 @@ class Scheduler:
         
         # Общая статистика
         writer.writerow(["1. Общая статистика по всем чатам:"])
-        writer.writerow(["Дата:", datetime.now().strftime('%d.%m.%Y %H:%M')])
+        writer.writerow(["Дата:", self.clock.now().strftime('%d.%m.%Y %H:%M')])
         writer.writerow(["Чатов в CSV:", len(vk_chats)])
         
         # Получаем актуальную статистику только для чатов из CSV
@@ -156,7 +165,7 @@ class Scheduler:
             await db.initialize()
         
         # Считаем статистику только для чатов из CSV (по-чатная дедупликация)
-        chats_stats = await db.get_chats_stats()
+        chats_stats = await db.get_chats_stats(exact=True)
         all_unique_members = set()
         
         for chat in chats_stats:
@@ -193,7 +202,7 @@ class Scheduler:
         writer.writerow(["2. Статистика по каждому чату:"])
         
         # Получаем данные по чатам из базы данных только для чатов из CSV
-        chats_stats = await db.get_chats_stats()
+        chats_stats = await db.get_chats_stats(exact=True)
         csv_group_ids = {chat['group_id'] for chat in vk_chats}
         
         for chat in chats_stats:
@@ -248,6 +257,35 @@ class Scheduler:
                 f"Активен: {'Да' if chat.get('is_active', True) else 'Нет'}"
             ])
         
+        # Необязательные разделы нумеруются подряд, только если попали в отчет
+        section = 5
+        
+        # Чаты, откладывавшиеся из-за flood control
+        deferred = [result for result in results if result.get('deferrals')]
+        if deferred:
+            writer.writerow([])
+            writer.writerow([f"{section}. Отложено из-за flood control:", f"{len(deferred)} чатов",
+                             f"{sum(result['deferred_seconds'] for result in deferred)} сек суммарно"])
+            for result in deferred:
+                writer.writerow([
+                    f"id группы чата: {result['group_id']}",
+                    f"Откладываний: {result['deferrals']}",
+                    f"Ожидание: {result['deferred_seconds']} сек"
+                ])
+            section += 1
+        
+        # Чаты, пропущенные из-за недействительного токена
+        quarantined = [result for result in results if result.get('quarantine_reason')]
+        if quarantined:
+            writer.writerow([])
+            writer.writerow([f"{section}. Пропущенные чаты (токен в карантине):"])
+            for result in quarantined:
+                writer.writerow([
+                    f"id группы чата: {result['group_id']}",
+                    f"Название: {result['chat_name']}",
+                    f"Причина: {result['quarantine_reason']}"
+                ])
+        
         # Добавляем BOM для правильного отображения в Windows Excel
         csv_content = output.getvalue()
         return '\ufeff' + csv_content
@@ -276,7 +314,7 @@ class Scheduler:
         
         # Общая статистика
         writer.writerow(["1. Общая статистика по всем чатам:"])
-        writer.writerow(["Дата:", datetime.now().strftime('%d.%m.%Y %H:%M')])
+        writer.writerow(["Дата:", self.clock.now().strftime('%d.%m.%Y %H:%M')])
         writer.writerow(["Обработано чатов:", stats['total_chats']])
         writer.writerow([])
         writer.writerow(["Общая статистика:"])
@@ -288,7 +326,7 @@ class Scheduler:
         writer.writerow(["2. Статистика по каждому чату:"])
         
         # Получаем данные по чатам из базы данных
-        chats_stats = await db.get_chats_stats()
+        chats_stats = await db.get_chats_stats(exact=True)
         for chat in chats_stats:
             writer.writerow([
                 f"id группы чата: {chat['group_id']}",
@@ -0,0 +1,224 @@
+"""
+Симуляция ежедневного анализа в виртуальном времени
+
+Запуск: python simulate.py [--chats 1850] [--profile profile.json] [--errors 6=0.002 9=0.001] [--latency 0.15]
+
+Анализ выполняется тем же кодом, что и в боте, но в цикле VirtualTimeLoop: паузы ограничителя,
+повторы после ошибок 6/9 и откладывание чатов не занимают реального времени. Ответы VK
+моделирует VKStandIn (синтетические чаты, ошибки и задержки по профилю), база - SQLite в памяти.
+
+Профиль ошибок - JSON с долями ошибок и задержками, записанными в реальном запуске:
+{"error_rates": {"6": 0.002, "9": 0.0005, "27": 0.0001}, "latency": 0.15, "slow_rate": 0.01,
+ "slow_latency": 3.0, "members": 200, "messages": 1000}
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict
+
+from loguru import logger
+
+from analyzer import ChatAnalyzer
+from clock import Clock, VirtualTimeLoop, clock
+from database_sqlite import Database
+from scheduler import Scheduler
+from vk_client import VKClient, latency_tracker
+from vk_standin import VKStandIn, parse_error_rates, synthetic_chats
+
+DEFAULT_PROFILE = {
+    "error_rates": {},
+    "latency": 0.15,
+    "slow_rate": 0.0,
+    "slow_latency": 0.0,
+    "members": 200,
+    "messages": 1000,
+}
+
+class _SyncCursor:
+    """Курсор sqlite3 с асинхронными методами aiosqlite"""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def close(self):
+        self._cursor.close()
+
+class _SyncResult:
+    """Результат execute: поддерживает await и async with, как в aiosqlite"""
+
+    def __init__(self, run: Callable[[], sqlite3.Cursor]):
+        self._run = run
+        self._cursor = None
+
+    def __await__(self):
+        return self._open().__await__()
+
+    async def _open(self) -> _SyncCursor:
+        return _SyncCursor(self._run())
+
+    async def __aenter__(self) -> _SyncCursor:
+        self._cursor = await self._open()
+        return self._cursor
+
+    async def __aexit__(self, *exc_info):
+        await self._cursor.close()
+
+class SyncConnection:
+    """Соединение sqlite3 с интерфейсом aiosqlite, выполняющее запросы прямо в цикле событий
+
+    aiosqlite работает в отдельном потоке, а виртуальное время не может ждать другие потоки.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+
+    def execute(self, sql: str, parameters=()) -> _SyncResult:
+        return _SyncResult(lambda: self._connection.execute(sql, parameters))
+
+    def executemany(self, sql: str, parameters) -> _SyncResult:
+        return _SyncResult(lambda: self._connection.executemany(sql, parameters))
+
+    async def commit(self):
+        self._connection.commit()
+
+    async def rollback(self):
+        self._connection.rollback()
+
+    async def close(self):
+        self._connection.close()
+
+class SimulatedDatabase(Database):
+    """База анализа в памяти для симуляции"""
+
+    def __init__(self, clock: Clock = None):
+        super().__init__(clock=clock)
+        self.db_path = ":memory:"
+
+    async def _connect(self) -> SyncConnection:
+        return SyncConnection(self.db_path)
+
+class SimulatedVKClient(VKClient):
+    """Клиент VK, который вместо HTTP запроса получает ответ модели VK в виртуальном времени"""
+
+    server: VKStandIn = None
+
+    async def _send(self, method: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        delay = self.server.next_latency()
+        if delay:
+            await self.clock.sleep(delay)
+        return self.server.respond(method, params)
+
+def load_profile(args: argparse.Namespace) -> Dict[str, Any]:
+    """Профиль из файла с переопределениями из командной строки"""
+    profile = dict(DEFAULT_PROFILE)
+    if args.profile:
+        with open(args.profile, encoding="utf-8") as file:
+            profile.update(json.load(file))
+    profile["error_rates"] = {int(code): float(rate) for code, rate in profile["error_rates"].items()}
+    if args.errors:
+        profile["error_rates"].update(parse_error_rates(args.errors))
+    for key in ("latency", "slow_rate", "slow_latency", "members", "messages"):
+        value = getattr(args, key)
+        if value is not None:
+            profile[key] = value
+    return profile
+
+async def simulate(chats: int, profile: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    """Один ежедневный анализ chats синтетических чатов; возвращает время и счетчики"""
+    server = VKStandIn(error_rates=profile["error_rates"], latency=profile["latency"],
+                       slow_rate=profile["slow_rate"], slow_latency=profile["slow_latency"], seed=seed)
+    server.populate(synthetic_chats(chats), members=profile["members"], messages=profile["messages"], seed=seed)
+    SimulatedVKClient.server = server
+
+    database = SimulatedDatabase()
+    await database.initialize()
+    analyzer = ChatAnalyzer(database, clock=clock, client_class=SimulatedVKClient)
+    started_at = clock.now()
+    try:
+        results = await analyzer.analyze_all_chats(vk_chats=synthetic_chats(chats))
+    finally:
+        await database.close()
+
+    return {
+        "started_at": started_at,
+        "finished_at": clock.now(),
+        "results": results,
+        "failed": analyzer.metrics.count_failed(),
+        "server": dict(server.stats),
+        "deferrals": analyzer.get_deferral_stats(),
+        "concurrency": analyzer.concurrency.get_stats(),
+        "rate_limiter": analyzer.rate_limiter.get_totals(),
+        "summary": analyzer.metrics.format_summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция ежедневного анализа в виртуальном времени")
+    parser.add_argument("--chats", type=int, default=1850)
+    parser.add_argument("--profile", help="JSON профиль ошибок и задержек VK")
+    parser.add_argument("--errors", nargs="*", default=[], help="Доли ошибок VK, например 6=0.002 9=0.001")
+    parser.add_argument("--latency", type=float, default=None, help="Средняя задержка ответа, секунд")
+    parser.add_argument("--slow-rate", type=float, default=None, help="Доля медленных ответов")
+    parser.add_argument("--slow-latency", type=float, default=None, help="Задержка медленного ответа, секунд")
+    parser.add_argument("--members", type=int, default=None, help="Участников в чате")
+    parser.add_argument("--messages", type=int, default=None, help="Сообщений в чате (за 45 дней)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    profile = load_profile(args)
+
+    # Виртуальный день начинается со времени ежедневного анализа по расписанию
+    start = datetime.combine(datetime.now().date(), Scheduler.DAILY_ANALYSIS_TIME).timestamp()
+    loop = VirtualTimeLoop(start=start)
+    real_started = time.perf_counter()
+    try:
+        report = loop.run_until_complete(simulate(args.chats, profile, args.seed))
+    finally:
+        loop.close()
+    real_elapsed = time.perf_counter() - real_started
+
+    results = report["results"]
+    failed = report["failed"]
+    duration = (report["finished_at"] - report["started_at"]).total_seconds()
+    calls = {key: value for key, value in report["server"].items() if "." in key}
+    errors = {key: value for key, value in report["server"].items() if key.startswith("error_")}
+
+    print(f"Profile:      {profile}")
+    print(f"Chats:        {args.chats} ({len(results) - failed} ok, {failed} failed)")
+    print(f"Projected:    {report['started_at']:%H:%M:%S} -> {report['finished_at']:%H:%M:%S} "
+          f"({duration / 3600:.2f} h, {args.chats / max(duration, 1e-9) * 60:.1f} chats/min)")
+    print(f"Replayed in:  {real_elapsed:.1f} s")
+    print(f"HTTP requests: {report['server'].get('requests', 0)} ({report['server'].get('execute', 0)} execute), "
+          f"API calls: {sum(calls.values())}")
+    print(f"Injected errors: {errors or 'none'}")
+    print(f"Deferrals:    {report['deferrals']}")
+    print(f"Concurrency:  {report['concurrency']}")
+    print(f"Rate limiter: {report['rate_limiter']}")
+    print(f"Hedging:      hedged {latency_tracker.hedged}, won {latency_tracker.hedge_wins}")
+    print(report["summary"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Общий сервис проверки статусов пользователей VK
+"""
+import asyncio
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+from clock import Clock, clock as default_clock
+from config import config
+from database_sqlite import db
+
+class UserStatusResolver:
+    """Проверка статусов пользователей для всего анализа
+
+    Идентификаторы из всех чатов собираются в общие пакеты users.get по 1000 штук,
+    а результаты кэшируются с TTL в памяти и в SQLite для следующих запусков.
+    """
+
+    BATCH_SIZE = 1000  # Максимум пользователей в одном users.get
+
+    def __init__(self, db_instance=None, ttl: float = None, batch_window: float = None, clock: Clock = None):
+        self.db = db_instance or db
+        self.clock = clock or default_clock
+        self.ttl = ttl if ttl is not None else config.USER_STATUS_TTL_HOURS * 3600
+        self.batch_window = batch_window if batch_window is not None else config.USER_STATUS_BATCH_WINDOW
+        self._statuses: Dict[int, Tuple[str, float]] = {}  # user_id -> (статус, время проверки)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._queue: List[int] = []
+        self._flush_timer: Optional[asyncio.Task] = None
+        self._flush_tasks = set()
+        # Клиенты чатов, ожидающих статусы: пакет отправляется токеном одного из них
+        self._waiting_clients: Counter = Counter()
+        self.cache_hits = 0
+        self.requested = 0
+
+    async def resolve(self, user_ids: List[int], client) -> Dict[int, str]:
+        """Возвращает статусы пользователей, запрашивая у VK только отсутствующие в кэше"""
+        now = self.clock.time()
+        result = {}
+
+        await self._load_cached([user_id for user_id in user_ids if user_id not in self._statuses])
+
+        futures = {}
+        for user_id in dict.fromkeys(user_ids):
+            cached = self._statuses.get(user_id)
+            if cached and now - cached[1] < self.ttl:
+                result[user_id] = cached[0]
+                self.cache_hits += 1
+                continue
+
+            # Один и тот же пользователь из разных чатов запрашивается только один раз
+            future = self._pending.get(user_id)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[user_id] = future
+                self._queue.append(user_id)
+            futures[user_id] = future
+
+        if not futures:
+            return result
+
+        self._waiting_clients[client] += 1
+        try:
+            self._schedule_flush()
+            await asyncio.gather(*set(futures.values()))
+        finally:
+            self._waiting_clients[client] -= 1
+            if self._waiting_clients[client] <= 0:
+                del self._waiting_clients[client]
+
+        failed = []
+        for user_id, future in futures.items():
+            status = future.result()
+            if status is None:
+                failed.append(user_id)
+            else:
+                result[user_id] = status
+
+        if failed:
+            # Общий пакет не удался (например, из-за токена другого чата) - запрашиваем своим токеном
+            logger.warning(f"Shared status batch failed for {len(failed)} users, retrying with own token")
+            statuses = await client.fetch_users_status(failed)
+            await self._remember(statuses)
+            result.update(statuses)
+
+        return result
+
+    def _schedule_flush(self):
+        """Отправляет полные пакеты сразу, а остаток - после короткого окна ожидания"""
+        while len(self._queue) >= self.BATCH_SIZE:
+            batch = self._queue[:self.BATCH_SIZE]
+            del self._queue[:self.BATCH_SIZE]
+            self._start_flush(batch)
+
+        if self._queue and self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        """Ждет, пока другие чаты добавят пользователей в пакет, и отправляет его"""
+        try:
+            await self.clock.sleep(self.batch_window)
+        finally:
+            self._flush_timer = None
+
+        batch = self._queue
+        self._queue = []
+        if batch:
+            await self._flush(batch)
+
+    def _start_flush(self, batch: List[int]):
+        task = asyncio.create_task(self._flush(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    def _pick_client(self, exclude=None):
+        """Клиент ожидающего чата, который еще может отправлять запросы (последний добавленный)"""
+        for client in reversed(list(self._waiting_clients)):
+            if client is not exclude and not client.interrupted:
+                return client
+        return None
+
+    async def _flush(self, batch: List[int]):
+        """Запрашивает статусы пакета и передает их всем ожидающим чатам
+
+        Если пакет не удался (токен отправившего чата прерван посреди запроса), он один раз
+        повторяется через клиент другого чата.
+        """
+        self.requested += len(batch)
+        statuses = {}
+        client = self._pick_client()
+        for attempt in range(2):
+            if client is None:
+                break
+            try:
+                statuses = await client.fetch_users_status(batch)
+            except Exception as e:
+                logger.error(f"Failed to resolve status batch of {len(batch)} users: {e}")
+            if statuses or attempt:
+                break
+            client = self._pick_client(exclude=client)
+            if client is not None:
+                logger.info(f"Status batch of {len(batch)} users failed, retrying with another chat's token")
+
+        try:
+            await self._remember(statuses)
+        except Exception as e:
+            logger.error(f"Failed to save status batch of {len(batch)} users: {e}")
+
+        for user_id in batch:
+            future = self._pending.pop(user_id, None)
+            if future is None or future.done():
+                continue
+            if user_id in statuses:
+                future.set_result(statuses[user_id])
+            elif statuses:
+                # Пакет выполнен, но VK не вернул пользователя
+                future.set_result("unknown")
+            else:
+                future.set_result(None)
+
+    async def _load_cached(self, user_ids: List[int]):
+        """Подгружает из SQLite статусы, сохраненные предыдущими запусками"""
+        if not user_ids:
+            return
+
+        rows = await self.db.get_user_statuses(user_ids, self.clock.time() - self.ttl)
+        for user_id, (status, checked_at) in rows.items():
+            self._statuses[user_id] = (status, checked_at)
+
+    async def _remember(self, statuses: Dict[int, str]):
+        """Запоминает статусы в памяти и в SQLite"""
+        if not statuses:
+            return
+
+        checked_at = self.clock.time()
+        for user_id, status in statuses.items():
+            self._statuses[user_id] = (status, checked_at)
+        await self.db.save_user_statuses(statuses, checked_at)
+
+    async def close(self):
+        """Отправляет оставшиеся запросы и удаляет устаревшие записи кэша"""
+        if self._flush_timer:
+            await asyncio.gather(self._flush_timer, return_exceptions=True)
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+        deleted = await self.db.prune_user_statuses(self.clock.time() - self.ttl)
+        logger.info(f"User status resolver: {self.cache_hits} cache hits, {self.requested} users requested, {deleted} expired entries removed")
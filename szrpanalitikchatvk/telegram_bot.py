@@ -3,8 +3,9 @@
 """
 import asyncio
 import io
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Any, Dict, List
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -14,6 +15,7 @@ from database_sqlite import db
 from analyzer import ChatAnalyzer
 from csv_parser import CSVParser
 from export import DataExporter
+from instrumentation import process_metrics
 
 class TelegramBot:
     """Простой Telegram бот"""
@@ -32,6 +34,21 @@ class TelegramBot:
         self.dp.callback_query.register(self.handle_export_callback, lambda c: c.data == "export")
         self.dp.callback_query.register(self.handle_upload_csv_callback, lambda c: c.data == "upload_csv")
         self.dp.callback_query.register(self.handle_start_callback, lambda c: c.data == "start")
+        
+        # Время обработчиков для метрик процесса
+        self.dp.message.middleware(self._timing_middleware)
+        self.dp.callback_query.middleware(self._timing_middleware)
+    
+    @staticmethod
+    async def _timing_middleware(handler, event, data: Dict[str, Any]):
+        """Замеряет время обработчика (telegram_handler_duration_seconds)"""
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started_at = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            process_metrics.observe("telegram_handler_duration_seconds", time.perf_counter() - started_at, handler=name)
     
     async def start_command(self, message: types.Message):
         """Обработчик команды /start"""
@@ -83,71 +100,22 @@ class TelegramBot:
             csv_group_ids = {chat['group_id'] for chat in vk_chats}
             csv_chats_count = len(vk_chats)  # Всегда равно количеству чатов в CSV
             
-            # Считаем уникальных участников и сообщения (по-чатная дедупликация)
-            all_unique_members = set()
-            csv_total_messages = 0  # Суммируем по чатам, а не через set()
+            # Уникальные значения оцениваем по скетчам HyperLogLog последнего анализа
+            # вместо COUNT(DISTINCT) по таблицам для каждого чата
             chats_stats = await db.get_chats_stats()
+            csv_chats_stats = [chat for chat in chats_stats if chat['group_id'] in csv_group_ids]
             
-            for chat in chats_stats:
-                if chat['group_id'] in csv_group_ids:
-                    # Получаем участников чата из базы данных (уже отфильтрованных)
-                    chat_id = await db.get_chat_id_by_group_id(chat['group_id'])
-                    if chat_id:
-                        members = await db.get_chat_members(chat_id)
-                        all_unique_members.update(members)
-                        
-                        # Считаем сообщения только от отфильтрованных участников этого чата
-                        if members:
-                            placeholders = ','.join(['?' for _ in members])
-                            async with db.connection.execute(f"""
-                                SELECT COUNT(DISTINCT m.message_id) 
-                                FROM messages m 
-                                JOIN users u ON m.user_id = u.id 
-                                WHERE m.chat_id = ? AND u.vk_id IN ({placeholders})
-                            """, [chat_id] + [str(member) for member in members]) as cursor:
-                                chat_messages_count = (await cursor.fetchone())[0] or 0
-                                csv_total_messages += chat_messages_count  # Суммируем по чатам
-            
-            csv_total_members = len(all_unique_members)
-            csv_total_authors = len(all_unique_members)  # Авторы = участники
-            
-            # Получаем активность за сегодня из базы данных (по-чатная дедупликация)
-            all_today_authors = set()
-            csv_today_messages = 0  # Суммируем по чатам, а не через set()
-            
-            for chat in chats_stats:
-                if chat['group_id'] in csv_group_ids:
-                    # Получаем активность за сегодня для этого чата
-                    chat_id = await db.get_chat_id_by_group_id(chat['group_id'])
-                    if chat_id:
-                        # Получаем отфильтрованных участников чата
-                        members = await db.get_chat_members(chat_id)
-                        if members:
-                            from datetime import date
-                            today = date.today()
-                            placeholders = ','.join(['?' for _ in members])
-                            
-                            # Считаем сообщения за сегодня только от отфильтрованных участников этого чата
-                            async with db.connection.execute(f"""
-                                SELECT COUNT(DISTINCT m.message_id) 
-                                FROM messages m 
-                                JOIN users u ON m.user_id = u.id 
-                                WHERE m.chat_id = ? AND DATE(m.date) = ? AND u.vk_id IN ({placeholders})
-                            """, [chat_id, today] + [str(member) for member in members]) as cursor:
-                                chat_today_messages = (await cursor.fetchone())[0] or 0
-                                csv_today_messages += chat_today_messages  # Суммируем по чатам
-                            
-                            # Авторы за сегодня только отфильтрованные участники
-                            async with db.connection.execute(f"""
-                                SELECT DISTINCT u.vk_id 
-                                FROM messages m 
-                                JOIN users u ON m.user_id = u.id 
-                                WHERE m.chat_id = ? AND DATE(m.date) = ? AND u.vk_id IN ({placeholders})
-                            """, [chat_id, today] + [str(member) for member in members]) as cursor:
-                                authors = await cursor.fetchall()
-                                all_today_authors.update(author[0] for author in authors)
+            csv_total_members = await db.get_unique_estimate('members', list(csv_group_ids))
+            if csv_total_members is None:
+                # Скетчей еще нет - считаем точно по участникам чатов из CSV
+                csv_total_members = await db.count_unique_members(csv_group_ids)
+            csv_total_messages = sum(chat['unique_messages'] for chat in csv_chats_stats)  # Суммируем по чатам
+            csv_total_authors = csv_total_members  # Авторы = участники
             
-            csv_today_authors = len(all_today_authors)
+            # Активность за сегодня только по чатам из CSV
+            today_activity = await db.get_today_activity(csv_group_ids)
+            csv_today_messages = today_activity['messages']
+            csv_today_authors = today_activity['authors']
             
             # Проверяем, есть ли данные (проверяем наличие чатов в CSV)
             if len(vk_chats) == 0:
@@ -221,6 +189,7 @@ class TelegramBot:
             
             analyzer = ChatAnalyzer(db)
             results = await analyzer.analyze_all_chats()
+            report_started_at = analyzer.clock.monotonic()
             
             # Проверяем, есть ли ошибки
             errors = [r for r in results if "error" in r]
@@ -235,14 +204,11 @@ class TelegramBot:
             else:
                 # Суммируем статистику по всем чатам (используем отфильтрованные данные)
                 # Считаем уникальных участников (без дублирования между чатами)
-                all_unique_members = set()
-                for r in results:
-                    all_unique_members.update(r.get('filtered_members', []))
-                
-                total_members = sum(len(r.get('filtered_members', [])) for r in results)
-                total_messages = sum(len(r.get('filtered_messages', [])) for r in results)
-                total_unique_members = len(all_unique_members)
-                total_unique_messages = sum(len(r.get('filtered_messages', [])) for r in results)
+                # (после исключения дублированных каждый участник состоит ровно в одном чате)
+                total_members = sum(r.get('members_count', 0) for r in results)
+                total_messages = sum(r.get('messages_last_month', 0) for r in results)
+                total_unique_members = total_members
+                total_unique_messages = total_messages
                 
                 report = (
                     f"✅ **Анализ завершен!**\n\n"
@@ -256,8 +222,8 @@ class TelegramBot:
                 
                 # Добавляем статистику по каждому чату (используем отфильтрованные данные)
                 for result in results:
-                    members_count = len(result.get('filtered_members', []))
-                    messages_count = len(result.get('filtered_messages', []))
+                    members_count = result.get('members_count', 0)
+                    messages_count = result.get('messages_last_month', 0)
                     
                     report += f"• {result['chat_name']}: 👥 {members_count} участников, 💬 {messages_count} сообщений\n"
                 
@@ -294,6 +260,27 @@ class TelegramBot:
                     f"📅 Дата: {results[0]['analysis_date']}\n"
                 )
                 
+                # Чаты, откладывавшиеся из-за flood control
+                deferred = [result for result in results if result.get('deferrals')]
+                if deferred:
+                    deferred_seconds = [result['deferred_seconds'] for result in deferred]
+                    general_report += (
+                        f"⏸ Отложено из-за flood control: {len(deferred)} чатов, "
+                        f"{sum(deferred_seconds) // 60} мин суммарно (максимум {max(deferred_seconds) // 60} мин)\n"
+                    )
+                
+                # Чаты, пропущенные из-за недействительного токена
+                quarantined = [result for result in results if result.get('quarantine_reason')]
+                if quarantined:
+                    general_report += f"\n**Пропущены (токен в карантине):**\n"
+                    for result in quarantined:
+                        general_report += f"• ⚠️ {result['chat_name']}: {result['quarantine_reason']}\n"
+                
+                # Время этапов и запросы VK этого анализа
+                if analyzer.metrics:
+                    await analyzer.save_report_phase(analyzer.clock.monotonic() - report_started_at)
+                    general_report += f"\n{analyzer.metrics.format_summary()}\n"
+                
                 await callback.message.edit_text(
                     general_report,
                     reply_markup=keyboard,
@@ -359,6 +346,20 @@ class TelegramBot:
                        f"📁 Файл: {filename}"
             )
             
+            # Пересечения участников между чатами - отдельным файлом
+            overlaps = await db.get_chat_overlaps()
+            if overlaps:
+                overlaps_filename = f"vk_overlaps_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+                await callback.message.answer_document(
+                    types.BufferedInputFile(
+                        self._create_overlaps_csv(overlaps).encode('utf-8'),
+                        filename=overlaps_filename
+                    ),
+                    caption=f"🔗 **Пересечения чатов**\n\n"
+                           f"Пар с общими участниками: {len(overlaps)}\n"
+                           f"📁 Файл: {overlaps_filename}"
+                )
+            
         except Exception as e:
             logger.error(f"Error creating export: {e}")
             await callback.message.edit_text(
@@ -395,7 +396,7 @@ class TelegramBot:
         writer.writerow(["2. Статистика по каждому чату:"])
         
         # Получаем данные по чатам из базы данных
-        chats_stats = await db.get_chats_stats()
+        chats_stats = await db.get_chats_stats(exact=True)
         for chat in chats_stats:
             # Получаем отфильтрованную статистику для этого чата
             chat_id = await db.get_chat_id_by_group_id(chat['group_id'])
@@ -464,7 +465,7 @@ class TelegramBot:
         # Считаем уникальных участников и сообщения (по-чатная дедупликация)
         all_unique_members = set()
         total_messages = 0  # Суммируем по чатам, а не через set()
-        chats_stats = await db.get_chats_stats()
+        chats_stats = await db.get_chats_stats(exact=True)
         
         for chat in chats_stats:
             if chat['group_id'] in csv_group_ids:
@@ -500,7 +501,7 @@ class TelegramBot:
         writer.writerow(["2. Статистика по каждому чату:"])
         
         # Получаем данные по чатам из базы данных только для чатов из CSV
-        chats_stats = await db.get_chats_stats()
+        chats_stats = await db.get_chats_stats(exact=True)
         csv_group_ids = {chat['group_id'] for chat in vk_chats}
         
         for chat in chats_stats:
@@ -559,6 +560,27 @@ class TelegramBot:
         csv_content = output.getvalue()
         return '\ufeff' + csv_content
     
+    def _create_overlaps_csv(self, overlaps: List[Dict[str, Any]]) -> str:
+        """Создает CSV с парами чатов и числом общих участников"""
+        import csv
+        import io
+        
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["Дата", "ID чата 1", "Название чата 1", "ID чата 2", "Название чата 2", "Общих участников"])
+        for overlap in overlaps:
+            writer.writerow([
+                overlap['stat_date'],
+                overlap['group_id_a'],
+                overlap['title_a'],
+                overlap['group_id_b'],
+                overlap['title_b'],
+                overlap['shared_members']
+            ])
+        
+        # BOM для правильного отображения в Windows Excel
+        return '\ufeff' + output.getvalue()
+    
     async def handle_upload_csv_callback(self, callback: types.CallbackQuery):
         """Обработчик кнопки загрузки CSV"""
         await callback.answer("📊 Ожидаю CSV файл...")
@@ -0,0 +1,46 @@
+"""
+Модули бота импортируются по имени из каталога приложения (как при запуске main.py)
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from clock import VirtualTimeLoop
+from simulate import SimulatedVKClient
+from vk_client import RateLimiter
+from vk_standin import VKStandIn
+
+@pytest.fixture
+def standin() -> VKStandIn:
+    """Модель VK API без HTTP: чаты добавляются тестом через add_chat/populate"""
+    return VKStandIn(seed=1)
+
+@pytest.fixture
+def client_class(standin):
+    """Класс клиента VK, отправляющего запросы в standin.respond"""
+    class StandInClient(SimulatedVKClient):
+        server = standin
+    return StandInClient
+
+@pytest.fixture
+def make_client(client_class):
+    """Фабрика клиентов VK с собственным нестрогим ограничителем"""
+    def make(token: str, **kwargs) -> SimulatedVKClient:
+        kwargs.setdefault("limiter", RateLimiter(rate=1000, burst=1000))
+        return client_class(token, **kwargs)
+    return make
+
+@pytest.fixture
+def run_virtual():
+    """Выполняет корутину в VirtualTimeLoop (виртуальный день начинается с текущего времени)"""
+    def run(coroutine):
+        loop = VirtualTimeLoop(start=time.time())
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+    return run
@@ -0,0 +1,78 @@
+"""
+Тесты кассеты ответов VK: токены не попадают в файл, записанные ответы воспроизводятся
+"""
+import gzip
+from datetime import datetime
+
+import pytest
+
+from cassette import MISSING_RESPONSE, Cassette, cassette_key, latest_cassette
+
+TOKEN = "vk1.a.secret-token-value"
+
+def record(path, entries):
+    cassette = Cassette(str(path), "record")
+    cassette.open(datetime(2025, 1, 1, 6, 27))
+    for method, params, response in entries:
+        cassette.record(method, params, response, token=TOKEN)
+    cassette.close()
+    return cassette
+
+def replay(path):
+    cassette = Cassette(str(path), "replay")
+    cassette.open()
+    return cassette
+
+def test_token_is_scrubbed_from_file(tmp_path):
+    path = tmp_path / "vk_20250101_062700.jsonl.gz"
+    record(path, [
+        ("messages.getHistory", {"access_token": TOKEN, "peer_id": 2000000001, "count": 200}, {"response": {"items": []}}),
+        ("execute", {"access_token": TOKEN, "code": f'return "{TOKEN}";'}, {"response": [1]}),
+    ])
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        content = file.read()
+    assert TOKEN not in content
+
+def test_keys_differ_by_token_and_not_by_param_order():
+    first = cassette_key("users.get", {"access_token": "a", "user_ids": "1", "fields": "deactivated"})
+    assert first == cassette_key("users.get", {"fields": "deactivated", "user_ids": "1", "access_token": "a"})
+    assert first != cassette_key("users.get", {"access_token": "b", "user_ids": "1", "fields": "deactivated"})
+
+def test_replay_returns_recorded_responses_in_order(tmp_path):
+    path = tmp_path / "vk_20250101_062700.jsonl.gz"
+    params = {"access_token": TOKEN, "peer_id": 2000000001}
+    record(path, [
+        ("messages.getHistory", params, {"error": {"error_code": 6}}),
+        ("messages.getHistory", params, {"response": {"count": 1}}),
+    ])
+
+    cassette = replay(path)
+    assert cassette.recorded_at == datetime(2025, 1, 1, 6, 27)
+    assert cassette.play("messages.getHistory", params) == {"error": {"error_code": 6}}
+    assert cassette.play("messages.getHistory", params) == {"response": {"count": 1}}
+    # Лишние повторы получают последний ответ
+    assert cassette.play("messages.getHistory", params) == {"response": {"count": 1}}
+    assert cassette.play("messages.getHistory", {**params, "peer_id": 2000000002}) == MISSING_RESPONSE
+    assert (cassette.hits, cassette.misses) == (3, 1)
+
+def test_users_get_assembled_from_other_batches(tmp_path):
+    path = tmp_path / "vk_20250101_062700.jsonl.gz"
+    record(path, [
+        ("users.get", {"access_token": TOKEN, "user_ids": "1,2"}, {"response": [{"id": 1}, {"id": 2, "deactivated": "banned"}]}),
+        ("users.get", {"access_token": TOKEN, "user_ids": "3"}, {"response": [{"id": 3}]}),
+    ])
+
+    cassette = replay(path)
+    assert cassette.play("users.get", {"access_token": TOKEN, "user_ids": "3,2"}) == {
+        "response": [{"id": 3}, {"id": 2, "deactivated": "banned"}]
+    }
+    assert cassette.play("users.get", {"access_token": TOKEN, "user_ids": "4"}) == MISSING_RESPONSE
+
+def test_unknown_mode_and_latest_cassette(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "vk.jsonl.gz"), "rewind")
+
+    assert latest_cassette(str(tmp_path)) is None
+    record(tmp_path / "vk_20250101_062700.jsonl.gz", [])
+    record(tmp_path / "vk_20250102_062700.jsonl.gz", [])
+    assert latest_cassette(str(tmp_path)).endswith("vk_20250102_062700.jsonl.gz")
@@ -0,0 +1,69 @@
+"""
+Тесты AdaptiveConcurrencyLimiter: аддитивный рост, уменьшение вдвое и ожидание слота
+"""
+import asyncio
+
+from concurrency import AdaptiveConcurrencyLimiter
+
+def test_limit_grows_by_one_after_limit_successes():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, minimum=1, maximum=6)
+    for _ in range(3):
+        limiter.record_success()
+    assert limiter.limit == 4
+    limiter.record_success()
+    assert limiter.limit == 5
+    for _ in range(20):
+        limiter.record_success()
+    assert limiter.limit == 6
+    assert limiter.peak_limit == 6
+
+def test_throttle_halves_once_per_cooldown():
+    limiter = AdaptiveConcurrencyLimiter(initial=16, minimum=3, maximum=50)
+    limiter.record_throttle(6)
+    assert limiter.limit == 8
+    # Ошибки той же волны от других чатов лимит больше не уменьшают
+    limiter.record_throttle(9)
+    assert limiter.limit == 8
+    assert limiter.throttle_events == 2
+
+    limiter._last_decrease -= 3600
+    limiter.record_throttle(9)
+    limiter._last_decrease -= 3600
+    limiter.record_throttle(9)
+    assert limiter.limit == 3
+
+def test_initial_limit_is_clamped():
+    assert AdaptiveConcurrencyLimiter(initial=100, minimum=1, maximum=10).limit == 10
+    assert AdaptiveConcurrencyLimiter(initial=1, minimum=2, maximum=10).limit == 2
+
+def test_waiters_wake_when_limit_grows():
+    async def scenario():
+        limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=2)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done() and limiter.waiting == 1
+
+        limiter.record_success()
+        await asyncio.wait_for(waiter, timeout=1)
+        assert limiter.in_flight == 2 and limiter.waiting == 0
+
+        await limiter.release()
+        await limiter.release()
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+def test_slot_released_on_error():
+    async def scenario():
+        limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1)
+        try:
+            async with limiter.slot():
+                raise RuntimeError("chat failed")
+        except RuntimeError:
+            pass
+        assert limiter.in_flight == 0
+        async with limiter.slot():
+            assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+"""
+Тест окна "сегодня" в статистике базы: день берется у вызывающего или из часов базы
+"""
+import asyncio
+from datetime import date, datetime
+
+from clock import ShiftedClock
+from simulate import SimulatedDatabase
+
+def test_today_window_follows_database_clock():
+    async def main():
+        database = SimulatedDatabase(clock=ShiftedClock(datetime(2024, 3, 15, 12, 0)))
+        await database.initialize()
+        chat_id = await database.save_chat("1", "Чат", 3)
+        rows = [("1", chat_id, 10, datetime(2024, 3, 15, 9, 0)), ("2", chat_id, 11, datetime(2024, 3, 15, 10, 0)),
+                ("3", chat_id, 10, datetime(2024, 3, 14, 23, 0))]
+        await database.connection.executemany(
+            "INSERT INTO messages (message_id, chat_id, user_id, text, date) VALUES (?, ?, ?, '', ?)", rows)
+        await database.connection.commit()
+
+        # Без даты от вызывающего "сегодня" - день по часам базы, а не системная дата
+        assert await database.get_today_stats_for_chat(chat_id) == {"messages": 2, "authors": 2}
+        assert await database.get_today_activity(["1"]) == {"messages": 2, "authors": 2}
+        stats = await database.get_stats()
+        assert stats["today_unique_messages"] == 2 and stats["today_unique_authors"] == 2
+
+        # День, переданный вызывающим, важнее часов
+        assert await database.get_today_stats_for_chat(chat_id, today=date(2024, 3, 14)) == {"messages": 1, "authors": 1}
+        assert await database.get_today_activity(["1"], today=date(2024, 3, 16)) == {"messages": 0, "authors": 0}
+        await database.close()
+
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+"""
+Тесты DuplicationEngine: совпадение с прежним алгоритмом исключения дублированных пользователей
+"""
+import pytest
+
+from benchmark_dedup import engine_dedup, generate_results, legacy_dedup
+from dedup import DuplicationEngine
+from message_columns import MessageColumns
+
+@pytest.mark.parametrize("shared_ratio", [0.0, 0.2, 0.9])
+def test_engine_matches_legacy(shared_ratio):
+    results = generate_results(2000, shared_ratio, messages_per_member=2, seed=3)
+    assert engine_dedup(results) == legacy_dedup(results)
+
+def test_filters_users_from_several_chats():
+    engine = DuplicationEngine()
+    engine.add_members([1, 2, 3])
+    engine.add_members([3, 4])
+    engine.add_members([4, 5])
+
+    assert engine.duplicated_users == {3, 4}
+    assert engine.filter_members([1, 2, 3]) == [1, 2]
+    assert engine.get_stats() == {'total_users': 5, 'duplicated_count': 2, 'unique_count': 3}
+
+    messages = MessageColumns.from_rows([(1, 1, 100), (2, 3, 101), (3, -7, 102), (4, 2, 103)])
+    assert list(engine.filter_messages(messages)) == [(1, 1, 100), (3, -7, 102), (4, 2, 103)]
+
+def test_duplicated_users_recomputed_after_new_chat():
+    engine = DuplicationEngine()
+    engine.add_members([1, 2])
+    assert engine.duplicated_users == set()
+    engine.add_members([2])
+    assert engine.duplicated_users == {2}
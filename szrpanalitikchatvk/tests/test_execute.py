@@ -0,0 +1,85 @@
+"""
+Тесты VKClient.execute: разбиение вызовов на пакеты, ошибки отдельных вызовов и проекция @.
+"""
+import asyncio
+
+from config import config
+from vk_client import HISTORY_FIELDS, VKClient
+
+TOKEN = "token-a"
+
+def history_calls(count):
+    return [("messages.getHistory", {"peer_id": config.PEER_ID, "count": 1, "offset": offset}) for offset in range(count)]
+
+def test_calls_split_into_batches_of_25_in_order(standin, make_client):
+    chat = standin.add_chat("1", TOKEN, members=[1])
+    for message_id in range(1, 61):
+        chat.history.append(message_id, 1, 1700000000 + message_id)
+
+    results = asyncio.run(make_client(TOKEN).execute(history_calls(60)))
+
+    assert standin.stats["execute"] == 3
+    # Смещение offset от новых сообщений к старым: ответы идут в порядке вызовов
+    assert [result["items"][0]["id"] for result in results] == list(range(60, 0, -1))
+
+def test_calls_split_by_code_length(standin, make_client, monkeypatch):
+    standin.add_chat("1", TOKEN, members=[1])
+    client = make_client(TOKEN)
+    call_length = len(VKClient._build_execute_code(history_calls(1)))
+    monkeypatch.setattr(config, "VK_EXECUTE_MAX_CODE_LENGTH", call_length * 4)
+
+    chunks = client._split_execute_calls(history_calls(10))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert all(sum(len(VKClient._build_execute_code([call])) for call in chunk) <= call_length * 4 for chunk in chunks)
+
+    results = asyncio.run(client.execute(history_calls(10)))
+    assert len(results) == 10 and standin.stats["execute"] == 3
+
+def test_failed_call_maps_to_none_at_its_position(standin, make_client):
+    standin.add_chat("1", TOKEN, members=[1, 2])
+    client = make_client(TOKEN)
+
+    results = asyncio.run(client.execute([
+        ("messages.getConversationMembers", {"peer_id": config.PEER_ID}),
+        ("messages.unknownMethod", {}),
+        ("users.get", {"user_ids": "1"}),
+    ]))
+
+    assert results[0]["count"] == 3
+    assert results[1] is None
+    assert results[2][0]["id"] == 1
+    assert not client.interrupted
+
+def test_flood_control_inside_execute_interrupts_client(standin, make_client):
+    standin.add_chat("1", TOKEN, members=[1])
+    standin.error_rates = {9: 1.0}
+    client = make_client(TOKEN, defer_flood_control=True)
+
+    results = asyncio.run(client.execute(history_calls(3)))
+
+    assert results == [None, None, None]
+    assert client.flood_control["error_code"] == 9
+    assert client.interrupted
+
+def test_invalid_token_fails_whole_batch(standin, make_client):
+    standin.add_chat("1", TOKEN)
+    client = make_client("unknown-token")
+
+    assert asyncio.run(client.execute(history_calls(2))) == [None, None]
+    assert client.token_invalid
+
+def test_projection_returns_only_requested_fields(standin, make_client):
+    chat = standin.add_chat("1", TOKEN, members=[1])
+    for message_id in range(1, 6):
+        chat.history.append(message_id, 10 + message_id, 1700000000 + message_id)
+    client = make_client(TOKEN)
+    call = [("messages.getHistory", {"peer_id": config.PEER_ID, "count": 200})]
+
+    projected, = asyncio.run(client.execute(call, fields={"messages.getHistory": HISTORY_FIELDS}))
+    full, = asyncio.run(client.execute(call))
+
+    assert projected["count"] == 5
+    assert set(projected["items"]) == set(HISTORY_FIELDS)
+    assert "text" in full["items"][0]
+    assert list(VKClient._history_page(projected)) == list(VKClient._history_page(full))
+    assert list(VKClient._history_page(projected))[0] == (5, 15, 1700000005)
@@ -0,0 +1,60 @@
+"""
+Тест откладывания чата с flood control: слот не ждет паузу, а переходит к следующим чатам
+"""
+from analyzer import ChatAnalyzer
+from clock import clock
+from config import config
+from simulate import SimulatedDatabase
+from vk_standin import synthetic_chats
+
+CHATS = synthetic_chats(3)
+
+def test_flood_controlled_chat_is_deferred_without_holding_its_slot(standin, client_class, run_virtual, monkeypatch):
+    for setting in ("CHAT_CONCURRENCY_INITIAL", "CHAT_CONCURRENCY_MIN", "CHAT_CONCURRENCY_MAX"):
+        monkeypatch.setattr(config, setting, 1)
+    standin.populate(CHATS, members=20, messages=50)
+    flooded = CHATS[0]
+
+    # Первый запрос анализа первого чата (после проверки токена) получает flood control (ошибка 9)
+    respond = standin.respond
+    floods = []
+
+    def flood_once(method, params):
+        if params.get("access_token") == flooded["token"] and method != "groups.getById" and not floods:
+            floods.append(method)
+            return {"error": {"error_code": 9, "error_msg": "Flood control"}}
+        return respond(method, params)
+    monkeypatch.setattr(standin, "respond", flood_once)
+
+    database = SimulatedDatabase()
+    journal_order = []
+    save_journal_result = database.save_journal_result
+
+    async def record_order(run_date, result):
+        journal_order.append((result["group_id"], clock.monotonic()))
+        await save_journal_result(run_date, result)
+    database.save_journal_result = record_order
+
+    async def main():
+        await database.initialize()
+        analyzer = ChatAnalyzer(database, clock=clock, client_class=client_class)
+        started_at = clock.monotonic()
+        results = await analyzer.analyze_all_chats(vk_chats=CHATS)
+        await database.close()
+        return analyzer, results, started_at
+
+    analyzer, results, started_at = run_virtual(main())
+
+    assert floods
+    # Единственный слот сразу перешел к остальным чатам, отложенный чат обработан последним
+    assert [group_id for group_id, _ in journal_order] == [CHATS[1]["group_id"], CHATS[2]["group_id"], flooded["group_id"]]
+    assert all(finished_at - started_at < config.FLOOD_CONTROL_DELAY for _, finished_at in journal_order[:2])
+    assert journal_order[2][1] - started_at >= config.FLOOD_CONTROL_DELAY
+
+    flooded_metrics = analyzer.metrics.chats[flooded["group_id"]]
+    assert flooded_metrics["attempts"] == 2 and flooded_metrics["status"] == "ok"
+    # Пауза flood control прошла вне слота: время в слоте намного меньше отложенного
+    assert flooded_metrics["fetch_seconds"] < 1
+    assert analyzer.deferrals[flooded["group_id"]]["count"] == 1
+    assert analyzer.deferrals[flooded["group_id"]]["seconds"] >= config.FLOOD_CONTROL_DELAY
+    assert {result["group_id"] for result in results} == {chat["group_id"] for chat in CHATS}
@@ -0,0 +1,77 @@
+"""
+Тест hedged запросов: дубликат отправляется, только если запрос не ответил за перцентиль задержки метода
+"""
+import pytest
+
+import vk_client
+from clock import clock
+from config import config
+from vk_client import LatencyTracker
+
+TOKEN = "token-a"
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(config, "VK_HEDGE_ENABLED", True)
+    tracker = LatencyTracker(min_samples=20)
+    monkeypatch.setattr(vk_client, "latency_tracker", tracker)
+    return tracker
+
+def record_latencies(standin, monkeypatch):
+    """Задержки ответов замены VK в порядке отправки запросов"""
+    latencies = []
+    next_latency = standin.next_latency
+
+    def recording():
+        latency = next_latency()
+        latencies.append(latency)
+        return latency
+    monkeypatch.setattr(standin, "next_latency", recording)
+    return latencies
+
+def test_hedge_fires_only_past_latency_percentile(standin, make_client, run_virtual, tracker, monkeypatch):
+    standin.add_chat("1", TOKEN, members=[1])
+    standin.latency = 0.1
+    latencies = record_latencies(standin, monkeypatch)
+    client = make_client(TOKEN)
+
+    delays = []  # Момент дубликата для каждого запроса (перцентиль пересчитывается по мере ответов)
+
+    async def users_get(count):
+        for _ in range(count):
+            delays.append(tracker.hedge_delay("users.get"))
+            response = await client._make_request("users.get", {"user_ids": "1"})
+            assert response["response"][0]["id"] == 1
+
+    # Пока ответов меньше VK_HEDGE_MIN_SAMPLES, перцентиль неизвестен и дубликаты не отправляются
+    standin.slow_rate, standin.slow_latency = 0.3, 3.0
+    run_virtual(users_get(19))
+    assert tracker.hedged == 0 and len(latencies) == 19 and set(delays) == {None}
+
+    # Быстрые ответы (медленных теперь меньше 5%): p95 около 0.15 с, дубликат не раньше VK_HEDGE_MIN_DELAY
+    standin.slow_rate = 0.0
+    run_virtual(users_get(200))
+    assert tracker.hedge_delay("users.get") == config.VK_HEDGE_MIN_DELAY
+    assert tracker.hedged == 0
+
+    # Медленные ответы: дубликат отправлен ровно для запросов, не ответивших за текущий перцентиль
+    latencies.clear()
+    delays.clear()
+    standin.slow_rate = 0.3
+    run_virtual(users_get(40))
+    expected_hedges = expected_wins = 0
+    position = 0
+    for delay in delays:
+        primary = latencies[position]
+        position += 1
+        if primary > delay:
+            duplicate = latencies[position]
+            position += 1
+            expected_hedges += 1
+            expected_wins += delay + duplicate < primary
+    assert position == len(latencies)
+    assert expected_hedges > 0
+    assert tracker.hedged == expected_hedges
+    assert tracker.hedge_wins == expected_wins
+    # Из пары запросов до VK доходит только первый ответивший, второй отменяется
+    assert standin.stats["users.get"] == 19 + 200 + 40
@@ -0,0 +1,48 @@
+"""
+Тесты HyperLogLog: погрешность оценки, объединение и сериализация
+"""
+import pytest
+
+from hll import DEFAULT_PRECISION, HyperLogLog
+
+# Стандартная ошибка 1.04/sqrt(m); допускаем четыре стандартные ошибки
+TOLERANCE = 4 * 1.04 / (1 << DEFAULT_PRECISION) ** 0.5
+
+@pytest.mark.parametrize("size", [1000, 10000, 100000])
+def test_estimate_within_error_bound(size):
+    sketch = HyperLogLog()
+    sketch.update(range(1, size + 1))
+    assert abs(sketch.count() - size) / size < TOLERANCE
+
+def test_small_sets_use_linear_counting():
+    sketch = HyperLogLog()
+    sketch.update(range(100))
+    assert abs(sketch.count() - 100) <= 5
+    assert HyperLogLog().count() == 0
+
+def test_duplicates_do_not_change_estimate():
+    sketch = HyperLogLog()
+    sketch.update(range(5000))
+    estimate = sketch.count()
+    sketch.update(range(5000))
+    assert sketch.count() == estimate
+
+def test_merge_equals_sketch_of_union():
+    first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    first.update(range(0, 30000))
+    second.update(range(20000, 50000))
+    union.update(range(0, 50000))
+    first.merge(second)
+    assert first.registers == union.registers
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog().merge(HyperLogLog(precision=10))
+
+def test_bytes_roundtrip():
+    sketch = HyperLogLog(precision=10)
+    sketch.update(range(2000))
+    restored = HyperLogLog.frombytes(sketch.tobytes())
+    assert restored.precision == 10
+    assert restored.registers == sketch.registers
+    assert restored.count() == sketch.count()
@@ -0,0 +1,45 @@
+"""
+Тесты догрузки новых сообщений через start_message_id (VKClient.get_new_messages)
+"""
+import asyncio
+
+import pytest
+
+TOKEN = "token-a"
+
+def make_chat(standin, history=1000, new=450):
+    chat = standin.add_chat("1", TOKEN, members=[1, 2])
+    for message_id in range(1, history + 1):
+        chat.history.append(message_id, 1 + message_id % 2, 1700000000 + message_id)
+    for _ in range(new):
+        standin.post_message("1", 2)
+    return chat
+
+@pytest.mark.parametrize("includes_start", [False, True])
+def test_new_messages_over_several_pages(standin, make_client, includes_start):
+    standin.history_includes_start = includes_start
+    chat = make_chat(standin, new=450)
+
+    messages, newest = asyncio.run(make_client(TOKEN).get_new_messages(1000))
+
+    assert sorted(messages.ids) == list(range(1001, 1451))
+    assert newest["id"] == chat.last_id == 1450
+
+def test_boundary_page_does_not_stop_early(standin, make_client):
+    # Ровно две полные страницы новых сообщений: с граничным сообщением первая страница
+    # содержит только 199 новых, но загрузка продолжается до конца
+    standin.history_includes_start = True
+    make_chat(standin, new=400)
+
+    messages, newest = asyncio.run(make_client(TOKEN).get_new_messages(1000))
+
+    assert sorted(messages.ids) == list(range(1001, 1401))
+    assert newest["id"] == 1400
+
+def test_no_new_messages(standin, make_client):
+    standin.history_includes_start = True
+    make_chat(standin, new=0)
+
+    messages, newest = asyncio.run(make_client(TOKEN).get_new_messages(1000))
+
+    assert not messages and newest is None
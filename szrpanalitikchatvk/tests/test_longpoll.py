@@ -0,0 +1,193 @@
+"""
+Тесты LongPollIngestor против локальной замены VK (vk_standin) по HTTP
+"""
+import asyncio
+import socket
+import time
+
+import pytest
+
+from analyzer import ChatAnalyzer
+from clock import clock
+from config import config
+from database_sqlite import Database
+from longpoll import LongPollIngestor
+from message_columns import MessageColumns
+from simulate import SimulatedDatabase
+from vk_standin import VKStandIn, synthetic_chats
+
+GROUP_ID = "100"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until(predicate, timeout: float = 5.0):
+    """Ждет, пока predicate (функция или корутина) не вернет истину"""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if asyncio.iscoroutine(result):
+            result = await result
+        if result:
+            return
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.02)
+
+async def fetch(database, sql, params=()):
+    async with database.connection.execute(sql, params) as cursor:
+        return await cursor.fetchall()
+
+@pytest.fixture(autouse=True)
+def fast_longpoll(monkeypatch):
+    monkeypatch.setattr(config, "LONGPOLL_WAIT", 1)
+    monkeypatch.setattr(config, "LONGPOLL_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(config, "LONGPOLL_RETRY_DELAY", 0.2)
+
+def run_ingestor(tmp_path, scenario, token, members=(1, 2), own_connection=False):
+    """Поднимает замену VK и ингестор для чата GROUP_ID с сохраненными анализом участниками"""
+    async def main():
+        database = Database()
+        database.db_path = str(tmp_path / "bot.db")
+        await database.initialize()
+        user_id_map = await database.save_users([str(vk_id) for vk_id in members])
+        chat_id = await database.save_chat(GROUP_ID, "Chat", len(members))
+        await database.replace_chat_data(chat_id, [(user_id_map[str(vk_id)], str(vk_id)) for vk_id in members],
+                                         MessageColumns(), user_id_map)
+        await database.connection.commit()
+
+        standin = VKStandIn(port=free_port())
+        standin.add_chat(GROUP_ID, token, members=members)
+        await standin.start()
+        ingestor = LongPollIngestor([{"group_id": GROUP_ID, "token": token}],
+                                    db_instance=None if own_connection else database, base_url=standin.base_url)
+        try:
+            await ingestor.start()
+            await wait_until(lambda: ingestor.catch_ups >= 1)
+            await scenario(standin, ingestor, database, chat_id)
+        finally:
+            await ingestor.stop()
+            await standin.stop()
+            await database.close()
+
+    asyncio.run(main())
+
+def test_message_new_and_member_events(tmp_path):
+    async def scenario(standin, ingestor, database, chat_id):
+        messages = [standin.post_message(GROUP_ID, 2, "hello"), standin.invite_member(GROUP_ID, 7, 1),
+                    standin.post_message(GROUP_ID, 7, "joined"), standin.kick_member(GROUP_ID, 2, 1)]
+
+        async def kicked():
+            return await fetch(database, "SELECT is_active FROM chat_members WHERE vk_id = '2'") == [(0,)]
+        await wait_until(kicked)
+
+        # Сообщения автора, вышедшего в том же пакете, и вошедшего участника сохраняются
+        saved = await fetch(database, "SELECT message_id, chat_id FROM messages ORDER BY id")
+        assert saved == [(str(message["id"]), chat_id) for message in messages]
+        members = dict(await fetch(database, "SELECT vk_id, is_active FROM chat_members WHERE chat_id = ?", (chat_id,)))
+        assert members == {"1": 1, "2": 0, "7": 1}
+        events = dict(await fetch(database, "SELECT vk_id, is_member FROM live_member_events WHERE group_id = ?", (GROUP_ID,)))
+        assert events == {2: 0, 7: 1}
+        assert ingestor.events_received == 4
+
+    run_ingestor(tmp_path, scenario, "token-events")
+
+def test_recovers_lost_events_from_history(tmp_path):
+    # failed=1: события утеряны - ингестор переподписывается и догружает пропуск через messages.getHistory
+    async def scenario(standin, ingestor, database, chat_id):
+        lost = standin.post_message(GROUP_ID, 1, "lost")
+        standin.drop_events(GROUP_ID)
+
+        await wait_until(lambda: ingestor.catch_ups >= 2)
+        after = standin.post_message(GROUP_ID, 1, "after")
+
+        async def synced():
+            state = await database.get_sync_state(GROUP_ID)
+            return state is not None and state["last_message_id"] == after["id"]
+        await wait_until(synced)
+
+        history = [row[0] for row in await fetch(database, "SELECT message_id FROM message_history ORDER BY message_id")]
+        assert history == [lost["id"], after["id"]]
+
+    run_ingestor(tmp_path, scenario, "token-lost")
+
+def test_renews_expired_key_without_catch_up(tmp_path):
+    # failed=2: истек только ключ - ts сохраняется, повторная догрузка истории не нужна
+    async def scenario(standin, ingestor, database, chat_id):
+        standin.expire_key(GROUP_ID)
+        message = standin.post_message(GROUP_ID, 1, "after key")
+
+        await wait_until(lambda: ingestor.events_received == 1, timeout=5)
+        assert ingestor.catch_ups == 1
+        assert standin.stats["groups.getLongPollServer"] == 2
+
+        await ingestor.flush()
+        assert await fetch(database, "SELECT message_id FROM messages") == [(str(message["id"]),)]
+
+    run_ingestor(tmp_path, scenario, "token-key")
+
+def test_own_connection_waits_for_analysis_transaction(tmp_path, monkeypatch):
+    # Ингестор пишет через свое соединение: незавершенная транзакция анализа не фиксируется,
+    # а события, не записанные, пока база занята, записываются после ее завершения
+    monkeypatch.setattr(config, "SQLITE_BUSY_TIMEOUT", 0.1)
+    monkeypatch.setattr("database_sqlite.db.db_path", str(tmp_path / "bot.db"))
+
+    async def scenario(standin, ingestor, database, chat_id):
+        assert ingestor.db is not database
+        async with database.connection.execute("UPDATE chats SET title = 'uncommitted' WHERE id = ?", (chat_id,)):
+            pass
+        message = standin.post_message(GROUP_ID, 1, "while analysis saves")
+        await wait_until(lambda: ingestor.events_received == 1)
+        await asyncio.sleep(0.3)  # Несколько неудачных попыток записи
+
+        await database.connection.rollback()
+        await wait_until(lambda: fetch(database, "SELECT message_id FROM messages"))
+
+        assert await fetch(database, "SELECT title FROM chats") == [("Chat",)]
+        assert await fetch(database, "SELECT message_id FROM messages") == [(str(message["id"]),)]
+
+    run_ingestor(tmp_path, scenario, "token-own", own_connection=True)
+
+def test_analysis_keeps_live_rows(standin, client_class, run_virtual):
+    # Long Poll записал события после загрузки чатов анализом, но до сохранения: анализ не удаляет
+    # их, не пересоздает чаты, а вход участника другого чата исключает его из обоих, как дедупликация
+    chats = synthetic_chats(2)
+    first, second = chats[0]["group_id"], chats[1]["group_id"]
+    standin.add_chat(first, chats[0]["token"], members=[1, 2, 3])
+    standin.add_chat(second, chats[1]["token"], members=[4, 5])
+    for group_id, from_id in ((first, 1), (second, 4)):
+        standin.post_message(group_id, from_id)
+    database = SimulatedDatabase()
+
+    async def main():
+        await database.initialize()
+        await ChatAnalyzer(database, clock=clock, client_class=client_class).analyze_all_chats(vk_chats=chats)
+        chat_ids = dict(await fetch(database, "SELECT group_id, id FROM chats"))
+
+        analyzer = ChatAnalyzer(database, clock=clock, client_class=client_class)
+        save_filtered_results = analyzer._save_filtered_results
+
+        async def save_after_live_events(vk_chats):
+            now = int(clock.time())
+            live = MessageColumns()
+            live.append(standin.chats[first].last_id + 1, 2, now)
+            await database.save_history_messages(first, live)
+            await database.save_live_events(first, live, {6: (True, now), 4: (True, now)})
+            return await save_filtered_results(vk_chats)
+        analyzer._save_filtered_results = save_after_live_events
+        await analyzer.analyze_all_chats(vk_chats=chats)
+
+        assert dict(await fetch(database, "SELECT group_id, id FROM chats")) == chat_ids
+        messages = await fetch(database, "SELECT CAST(message_id AS INTEGER) FROM messages WHERE chat_id = ? ORDER BY 1",
+                               (chat_ids[first],))
+        assert messages == [(1,), (2,)]
+        members = dict(await fetch(database, "SELECT vk_id, chat_id FROM chat_members WHERE is_active = 1"))
+        assert members == {"1": chat_ids[first], "2": chat_ids[first], "3": chat_ids[first], "6": chat_ids[first],
+                           "5": chat_ids[second]}
+        assert await fetch(database, """
+            SELECT COUNT(*) FROM messages WHERE chat_id NOT IN (SELECT id FROM chats)
+        """) == [(0,)]
+        await database.close()
+
+    run_virtual(main())
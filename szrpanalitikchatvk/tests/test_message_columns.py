@@ -0,0 +1,39 @@
+"""
+Тесты MessageColumns: хранение трех полей сообщений и выборки
+"""
+from message_columns import MessageColumns
+
+ROWS = [(5, 10, 1000), (4, -3, 1100), (3, 11, 1200), (2, 10, 1300)]
+
+def test_from_messages_keeps_only_id_author_and_date():
+    columns = MessageColumns.from_messages([
+        {"id": 1, "from_id": 7, "date": 100, "text": "hello", "attachments": [{"type": "photo"}]},
+        {"id": 2},
+    ])
+    assert list(columns) == [(1, 7, 100), (2, 0, 0)]
+    assert len(columns) == 2
+    assert columns.nbytes == 2 * 8 * 3
+
+def test_constructors_agree():
+    rows = MessageColumns.from_rows(ROWS)
+    fields = MessageColumns.from_fields(*zip(*ROWS))
+    assert list(rows) == list(fields) == ROWS
+
+def test_authors_exclude_communities():
+    assert MessageColumns.from_rows(ROWS).authors() == {10, 11}
+
+def test_selections():
+    columns = MessageColumns.from_rows(ROWS)
+    assert list(columns.only_authors({10})) == [(5, 10, 1000), (2, 10, 1300)]
+    assert list(columns.without_authors({10})) == [(4, -3, 1100), (3, 11, 1200)]
+    assert list(columns.between(1100, 1200)) == [(4, -3, 1100), (3, 11, 1200)]
+    assert list(columns.newer_than(3)) == [(5, 10, 1000), (4, -3, 1100)]
+    assert list(columns.from_users()) == [(5, 10, 1000), (3, 11, 1200), (2, 10, 1300)]
+    assert list(columns.from_users(1100, 1300)) == [(3, 11, 1200), (2, 10, 1300)]
+
+def test_extend_columns_and_bytes_roundtrip():
+    columns = MessageColumns.from_rows(ROWS[:2])
+    columns.extend_columns(MessageColumns.from_rows(ROWS[2:]))
+    assert list(columns) == ROWS
+    assert list(MessageColumns.frombytes(columns.tobytes())) == ROWS
+    assert list(MessageColumns.frombytes(MessageColumns().tobytes())) == []
@@ -0,0 +1,39 @@
+"""
+Тесты OverlapMatrix: пары чатов против прямого пересечения множеств
+"""
+import random
+from itertools import combinations
+
+from overlap import OverlapMatrix
+
+def brute_force_pairs(chats):
+    return sorted(
+        (group_a, group_b, len(set(members_a) & set(members_b)))
+        for (group_a, members_a), (group_b, members_b) in combinations(chats, 2)
+        if set(members_a) & set(members_b)
+    )
+
+def build(chats):
+    seen, shared = set(), set()
+    for _, members in chats:
+        shared.update(seen & set(members))
+        seen.update(members)
+    matrix = OverlapMatrix(shared)
+    for group_id, members in chats:
+        matrix.add_chat(group_id, members)
+    return matrix
+
+def test_pairs_match_set_intersections():
+    rng = random.Random(7)
+    chats = [(str(index), rng.sample(range(2000), rng.randrange(1, 300))) for index in range(40)]
+    assert sorted(build(chats).pairs()) == brute_force_pairs(chats)
+
+def test_only_shared_users_are_stored():
+    matrix = build([("a", [1, 2, 3]), ("b", [3, 4]), ("c", [5])])
+    assert matrix.dense_ids == {3: 0}
+    assert matrix.nbytes == 2 * 4
+    assert matrix.pairs() == [("a", "b", 1)]
+
+def test_no_pairs_without_shared_users():
+    assert build([("a", [1]), ("b", [2])]).pairs() == []
+    assert OverlapMatrix(set()).pairs() == []
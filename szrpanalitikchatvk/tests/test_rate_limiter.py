@@ -0,0 +1,79 @@
+"""
+Тесты RateLimiter: token bucket на каждый токен и пауза после ошибок 6/9 на поддельных часах
+"""
+import asyncio
+
+import pytest
+
+from clock import Clock
+from vk_client import RateLimiter
+
+class FakeClock(Clock):
+    """Часы, которые идут только во время sleep"""
+
+    def __init__(self):
+        self.now_monotonic = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now_monotonic
+
+    async def sleep(self, delay: float):
+        self.now_monotonic += delay
+        await asyncio.sleep(0)
+
+def acquire_all(limiter, tokens):
+    async def scenario():
+        return [await limiter.acquire(token) for token in tokens]
+    return asyncio.run(scenario())
+
+def test_burst_then_one_request_per_interval():
+    limiter = RateLimiter(rate=2, burst=2, clock=FakeClock())
+    waits = acquire_all(limiter, ["a"] * 5)
+    assert waits == pytest.approx([0, 0, 0.5, 0.5, 0.5])
+    assert limiter.get_totals()["calls"] == 5
+
+def test_each_token_has_its_own_budget():
+    limiter = RateLimiter(rate=1, burst=1, clock=FakeClock())
+    waits = acquire_all(limiter, ["a", "a", "b", "a", "b"])
+    # Токен b не ждет, пока расходуется бюджет токена a
+    assert waits == pytest.approx([0, 1, 0, 1, 0])
+    assert limiter.get_totals()["tokens"] == 2
+
+def test_budget_refills_while_idle():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=1, burst=3, clock=clock)
+    acquire_all(limiter, ["a"] * 3)
+    clock.now_monotonic += 10
+    assert acquire_all(limiter, ["a"] * 3) == pytest.approx([0, 0, 0])
+
+def test_penalty_blocks_only_the_penalized_token():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=3, burst=3, clock=clock)
+    limiter.penalize("a", 5)
+    waits = acquire_all(limiter, ["b", "a", "a"])
+    assert waits[0] == 0
+    # За время паузы бюджет не накапливается: после нее запросы идут с обычным интервалом
+    assert waits[1] == pytest.approx(5 + 1 / 3)
+    assert waits[2] == pytest.approx(1 / 3)
+
+def test_penalty_lowers_request_rate():
+    def requests_in(seconds, penalty):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=2, clock=clock)
+        started = clock.monotonic()
+        count = 0
+
+        async def scenario():
+            nonlocal count
+            while True:
+                await limiter.acquire("a")
+                if clock.monotonic() - started > seconds:
+                    return
+                count += 1
+                if penalty and count % 5 == 0:
+                    limiter.penalize("a", penalty)
+
+        asyncio.run(scenario())
+        return count
+
+    assert requests_in(30, penalty=5) < requests_in(30, penalty=0) / 2
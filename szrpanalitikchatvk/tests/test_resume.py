@@ -0,0 +1,64 @@
+"""
+Тест продолжения прерванного анализа из журнала: результат совпадает с непрерывным запуском
+"""
+from analyzer import ChatAnalyzer
+from clock import clock
+from simulate import SimulatedDatabase
+from vk_standin import synthetic_chats
+
+CHATS = synthetic_chats(12)
+SUMMARY_FIELDS = ("group_id", "members_count", "messages_last_month", "excluded_members", "excluded_messages")
+
+async def saved_rows(database):
+    """Участники и сообщения каждого чата в базе после анализа"""
+    rows = {}
+    for table, column in (("chat_members", "vk_id"), ("messages", "message_id")):
+        async with database.connection.execute(f"""
+            SELECT chats.group_id, {table}.{column} FROM {table} JOIN chats ON chats.id = {table}.chat_id
+        """) as cursor:
+            for group_id, value in await cursor.fetchall():
+                rows.setdefault((table, group_id), set()).add(value)
+    return rows
+
+def summaries(results):
+    return sorted(tuple(result[field] for field in SUMMARY_FIELDS) for result in results)
+
+def test_resumed_run_matches_uninterrupted_run(standin, client_class, run_virtual):
+    standin.populate(CHATS, members=40, messages=150, shared=0.3)
+
+    async def uninterrupted():
+        database = SimulatedDatabase()
+        await database.initialize()
+        results = await ChatAnalyzer(database, clock=clock, client_class=client_class).analyze_all_chats(vk_chats=CHATS)
+        rows = await saved_rows(database)
+        await database.close()
+        return results, rows
+
+    async def interrupted_and_resumed():
+        database = SimulatedDatabase()
+        await database.initialize()
+        first = ChatAnalyzer(database, clock=clock, client_class=client_class)
+        save_journal_result = database.save_journal_result
+
+        async def stop_after_five(run_date, result):
+            await save_journal_result(run_date, result)
+            if len(await database.get_journal_group_ids(run_date)) == 5:
+                first.request_stop()
+        database.save_journal_result = stop_after_five
+        assert await first.analyze_all_chats(vk_chats=CHATS) == []
+        assert len(await database.get_journal_group_ids(first.run_date)) == 5
+        database.save_journal_result = save_journal_result
+
+        second = ChatAnalyzer(database, clock=clock, client_class=client_class)
+        results = await second.analyze_all_chats(vk_chats=CHATS)
+        statuses = [chat["status"] for chat in second.metrics.chats.values()]
+        assert statuses.count("restored") == 5 and len(statuses) == len(CHATS)
+        rows = await saved_rows(database)
+        await database.close()
+        return results, rows
+
+    expected_results, expected_rows = run_virtual(uninterrupted())
+    resumed_results, resumed_rows = run_virtual(interrupted_and_resumed())
+
+    assert summaries(resumed_results) == summaries(expected_results)
+    assert resumed_rows == expected_rows
@@ -0,0 +1,48 @@
+"""
+Тест замеров анализа: запуск записывает одну строку analysis_runs и итог каждого чата в analysis_run_chats
+"""
+from analyzer import ChatAnalyzer, _collect_analysis_metrics
+from clock import clock
+from instrumentation import process_metrics
+from simulate import SimulatedDatabase
+from vk_standin import synthetic_chats
+
+CHATS = synthetic_chats(3)
+
+def test_run_writes_one_run_row_and_chat_statuses(standin, client_class, run_virtual, monkeypatch):
+    standin.populate(CHATS[:2], members=20, messages=40)
+    failing, quarantined = CHATS[1], CHATS[2]  # Токен третьего чата VK не знает
+
+    # Второй чат получает flood control (ошибка 9) на каждом запросе и после всех откладываний не обработан
+    respond = standin.respond
+
+    def flood(method, params):
+        if params.get("access_token") == failing["token"] and method != "groups.getById":
+            return {"error": {"error_code": 9, "error_msg": "Flood control"}}
+        return respond(method, params)
+    monkeypatch.setattr(standin, "respond", flood)
+    monkeypatch.setattr(process_metrics, "_collectors", [])
+
+    async def main():
+        database = SimulatedDatabase()
+        await database.initialize()
+        analyzer = ChatAnalyzer(database, clock=clock, client_class=client_class)
+        # Состояние анализов регистрируется в /metrics при запуске анализа, а не при импорте
+        assert _collect_analysis_metrics not in process_metrics._collectors
+        await analyzer.analyze_all_chats(vk_chats=CHATS)
+        assert process_metrics._collectors == [_collect_analysis_metrics]
+        async with database.connection.execute("SELECT id, chats, failed_chats FROM analysis_runs") as cursor:
+            runs = await cursor.fetchall()
+        async with database.connection.execute("SELECT run_id, group_id, status FROM analysis_run_chats") as cursor:
+            chats = await cursor.fetchall()
+        await database.close()
+        return analyzer, runs, chats
+
+    analyzer, runs, chats = run_virtual(main())
+
+    assert runs == [(analyzer.run_id, 3, 2)]
+    assert sorted(chats) == sorted([
+        (analyzer.run_id, CHATS[0]["group_id"], "ok"),
+        (analyzer.run_id, failing["group_id"], "failed"),
+        (analyzer.run_id, quarantined["group_id"], "quarantined"),
+    ])
@@ -0,0 +1,95 @@
+"""
+Тесты UserStatusResolver: общие пакеты users.get, кэш с TTL и повтор пакета через другой чат
+"""
+import asyncio
+
+from clock import clock
+from simulate import SimulatedDatabase
+from status_resolver import UserStatusResolver
+
+def add_chats(standin, count):
+    return [standin.add_chat(str(index + 1), f"token-{index}", members=[1]) for index in range(count)]
+
+def record_batches(standin, monkeypatch):
+    """Размеры запросов users.get, дошедших до замены VK"""
+    batches = []
+    get_users = standin._get_users
+
+    def recording(params):
+        batches.append(len(str(params["user_ids"]).split(",")))
+        return get_users(params)
+    monkeypatch.setattr(standin, "_get_users", recording)
+    return batches
+
+def test_chats_share_batches_of_1000(standin, make_client, run_virtual, monkeypatch):
+    add_chats(standin, 3)
+    standin.deactivated[5] = "deleted"
+    batches = record_batches(standin, monkeypatch)
+    # Три чата по 700 пользователей, из них 100 общих у соседних чатов: 1900 уникальных
+    chat_users = [list(range(index * 600 + 1, index * 600 + 701)) for index in range(3)]
+
+    async def main():
+        database = SimulatedDatabase()
+        await database.initialize()
+        resolver = UserStatusResolver(database, batch_window=0.2)
+        clients = [make_client(f"token-{index}", status_resolver=resolver) for index in range(3)]
+        results = await asyncio.gather(*(resolver.resolve(users, client) for users, client in zip(chat_users, clients)))
+        await resolver.close()
+        await database.close()
+        return results, resolver
+
+    results, resolver = run_virtual(main())
+
+    assert sorted(batches) == [900, 1000]
+    assert standin.stats["users.get"] == 2
+    assert resolver.requested == 1900
+    assert [len(result) for result in results] == [700, 700, 700]
+    assert results[0][5] == "deleted" and results[2][1401] == "active"
+
+def test_cached_statuses_skip_the_network_until_ttl(standin, make_client, run_virtual):
+    add_chats(standin, 1)
+    users = list(range(1, 301))
+
+    async def main():
+        database = SimulatedDatabase()
+        await database.initialize()
+        resolver = UserStatusResolver(database, ttl=3600, batch_window=0)
+        client = make_client("token-0", status_resolver=resolver)
+
+        await resolver.resolve(users, client)
+        await resolver.resolve(users, client)
+        assert standin.stats["users.get"] == 1 and resolver.cache_hits == 300
+
+        # Статусы сохранены в SQLite: новый запуск тоже обходится без users.get
+        next_run = UserStatusResolver(database, ttl=3600, batch_window=0)
+        assert len(await next_run.resolve(users, client)) == 300
+        assert standin.stats["users.get"] == 1 and next_run.cache_hits == 300
+
+        await clock.sleep(3601)
+        await next_run.resolve(users, client)
+        assert standin.stats["users.get"] == 2
+        await database.close()
+
+    run_virtual(main())
+
+def test_failed_batch_is_retried_with_another_chat_token(standin, make_client, run_virtual):
+    add_chats(standin, 1)
+    users = list(range(1, 51))
+
+    async def main():
+        database = SimulatedDatabase()
+        await database.initialize()
+        resolver = UserStatusResolver(database, batch_window=0.2)
+        healthy = make_client("token-0", status_resolver=resolver)
+        # Пакет отправляет последний присоединившийся чат - его токен отозван
+        revoked = make_client("revoked-token", status_resolver=resolver)
+        results = await asyncio.gather(resolver.resolve(users, healthy), resolver.resolve(users, revoked))
+        await database.close()
+        return results, revoked
+
+    (healthy_result, revoked_result), revoked = run_virtual(main())
+
+    assert revoked.token_invalid
+    assert healthy_result == revoked_result == {user_id: "active" for user_id in users}
+    # Отозванный токен получил ошибку 5 до вызова метода, пакет выполнен одним users.get
+    assert standin.stats["users.get"] == 1 and standin.stats["requests"] == 2
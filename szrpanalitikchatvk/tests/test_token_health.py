@@ -0,0 +1,94 @@
+"""
+Тесты TokenHealthRegistry: ограничение параллельных проверок, карантин и перепроверка с удвоением интервала
+"""
+from clock import clock
+from concurrency import AdaptiveConcurrencyLimiter
+from config import config
+from simulate import SimulatedDatabase
+from token_health import TokenHealthRegistry, token_hash
+from vk_client import RateLimiter
+
+HOUR = 3600
+
+def make_registry(database, client_class, **kwargs):
+    return TokenHealthRegistry(database, client_class=client_class, limiter=RateLimiter(rate=1000, burst=1000), **kwargs)
+
+def test_preflight_is_bounded_by_concurrency_limit(standin, client_class, run_virtual):
+    chats = [{"group_id": str(index + 1), "token": f"token-{index}"} for index in range(30)]
+    for chat in chats:
+        standin.add_chat(chat["group_id"], chat["token"], members=[1])
+    standin.latency = 0.1
+    in_flight = {"now": 0, "peak": 0}
+
+    class CountingClient(client_class):
+        async def _send(self, method, url, params):
+            in_flight["now"] += 1
+            in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+            try:
+                return await super()._send(method, url, params)
+            finally:
+                in_flight["now"] -= 1
+
+    async def main():
+        database = SimulatedDatabase()
+        await database.initialize()
+        limiter = AdaptiveConcurrencyLimiter(initial=3, minimum=1, maximum=3)
+        reasons = await make_registry(database, CountingClient, concurrency=limiter).preflight(chats)
+        await database.close()
+        return reasons
+
+    assert run_virtual(main()) == {}
+    assert standin.stats["groups.getById"] == 30
+    assert in_flight["peak"] == 3
+
+def test_quarantine_and_reprobe_backoff(standin, client_class, run_virtual, monkeypatch):
+    monkeypatch.setattr(config, "TOKEN_REPROBE_DELAY_HOURS", 6)
+    monkeypatch.setattr(config, "TOKEN_REPROBE_MAX_DELAY_HOURS", 20)
+    standin.add_chat("1", "good-token", members=[1])
+    # Токен второго чата VK не знает: groups.getById отвечает ошибкой 5
+    chats = [{"group_id": "1", "token": "good-token"}, {"group_id": "2", "token": "revoked-token"}]
+
+    async def main():
+        database = SimulatedDatabase()
+        await database.initialize()
+        registry = make_registry(database, client_class)
+
+        async def state():
+            return (await database.get_token_health([token_hash("revoked-token")]))[token_hash("revoked-token")]
+
+        async def preflight_after(hours):
+            await clock.sleep(hours * HOUR)
+            requests_before = standin.stats["requests"]
+            reasons = await registry.preflight(chats)
+            return reasons, standin.stats["requests"] - requests_before
+
+        reasons, requests = await preflight_after(0)
+        assert list(reasons) == ["revoked-token"] and reasons["revoked-token"].startswith("VK error 5")
+        assert requests == 2
+        first = await state()
+        assert first["status"] == "quarantined" and first["failures"] == 1
+        assert first["next_probe_at"] - first["checked_at"] == 6 * HOUR
+
+        # До следующей проверки токен в карантине не запрашивается
+        reasons, requests = await preflight_after(5)
+        assert list(reasons) == ["revoked-token"] and requests == 1
+
+        # Перепроверка не удалась: интервал удваивается, затем ограничивается максимумом
+        _, requests = await preflight_after(1.5)
+        second = await state()
+        assert requests == 2 and second["failures"] == 2
+        assert second["next_probe_at"] - second["checked_at"] == 12 * HOUR
+
+        await preflight_after(12.5)
+        third = await state()
+        assert third["failures"] == 3 and third["next_probe_at"] - third["checked_at"] == 20 * HOUR
+
+        # Токен снова действителен: после перепроверки карантин снимается
+        standin.add_chat("2", "revoked-token", members=[1])
+        reasons, requests = await preflight_after(20.5)
+        assert reasons == {} and requests == 2
+        healthy = await state()
+        assert healthy["status"] == "healthy" and healthy["failures"] == 0
+        await database.close()
+
+    run_virtual(main())
@@ -0,0 +1,38 @@
+"""
+Тест разбора ответов VK: orjson и стандартный json дают одинаковый результат
+"""
+import json
+
+import pytest
+
+import vk_json
+from config import config
+
+# Ответ VK с кириллицей, экранированием, вложенными объектами и проекцией execute
+RESPONSE = json.dumps({
+    "response": [
+        {"count": 3, "items": [
+            {"id": 120, "from_id": 17, "date": 1718000000, "text": "Привет, \"мир\"\n\t😀", "attachments": []},
+            {"id": 121, "from_id": -5, "date": 1718000060, "text": "", "fwd_messages": [{"text": "\\u0041"}]},
+        ]},
+        {"count": 2, "items": {"id": [120, 121], "from_id": [17, None]}},
+        False,
+        {"rate": 0.25, "big": 2 ** 53, "flag": True},
+    ],
+    "execute_errors": [{"method": "users.get", "error_code": 9, "error_msg": "Flood control"}],
+}, ensure_ascii=False).encode()
+
+def test_orjson_and_stdlib_decode_identically():
+    pytest.importorskip("orjson")
+    stdlib = vk_json.get_decoder("json")(RESPONSE)
+    assert vk_json.get_decoder("orjson")(RESPONSE) == stdlib
+    assert stdlib["response"][0]["items"][0]["text"] == "Привет, \"мир\"\n\t😀"
+
+def test_decoder_follows_config(monkeypatch):
+    monkeypatch.setattr(config, "VK_JSON_DECODER", "json")
+    assert vk_json.get_decoder() is vk_json.DECODERS["json"]
+    monkeypatch.setattr(config, "VK_JSON_DECODER", "auto")
+    expected = "orjson" if vk_json.orjson is not None else "json"
+    assert vk_json.get_decoder() is vk_json.DECODERS[expected]
+    with pytest.raises(ValueError):
+        vk_json.get_decoder("simdjson")
@@ -0,0 +1,104 @@
+"""
+Проверка токенов сообществ перед анализом и карантин недействительных токенов
+"""
+import asyncio
+import hashlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from clock import Clock, clock as default_clock
+from concurrency import AdaptiveConcurrencyLimiter
+from config import config
+from database_sqlite import db
+from vk_client import INVALID_TOKEN_ERRORS, VKClient
+
+def token_hash(token: str) -> str:
+    """SHA-256 токена: сами токены в базе не хранятся"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenHealthRegistry:
+    """Реестр состояния токенов
+
+    Перед анализом каждый токен проверяется одним дешевым вызовом groups.getById. Проверки идут
+    параллельно в пределах адаптивного лимита анализа, чтобы тысячи токенов не открывали соединения
+    разом, а ошибки 6/9 при проверке уменьшали лимит так же, как при анализе. Токен с ошибкой авторизации попадает в карантин: его чаты пропускаются,
+    а перепроверка откладывается на TOKEN_REPROBE_DELAY_HOURS с удвоением после каждой неудачи.
+    """
+
+    def __init__(self, db_instance=None, session=None, client_class=None, cassette=None, clock: Clock = None,
+                 limiter=None, concurrency: AdaptiveConcurrencyLimiter = None):
+        self.db = db_instance or db
+        self.session = session
+        self.client_class = client_class or VKClient
+        self.clock = clock or default_clock
+        self.limiter = limiter  # RateLimiter анализа (по умолчанию общий для процесса)
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter(clock=self.clock)
+        self.cassette = cassette  # Кассета анализа: проверки токенов записываются и воспроизводятся вместе с ним
+        self.base_delay = config.TOKEN_REPROBE_DELAY_HOURS * 3600
+        self.max_delay = config.TOKEN_REPROBE_MAX_DELAY_HOURS * 3600
+
+    async def preflight(self, chats: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Проверяет токены чатов и возвращает токены в карантине (токен -> причина)"""
+        chats_by_token: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for chat in chats:
+            chats_by_token[chat["token"]].append(chat)
+        if not chats_by_token:
+            return {}
+
+        now = self.clock.time()
+        health = await self.db.get_token_health([token_hash(token) for token in chats_by_token])
+
+        reasons: Dict[str, str] = {}  # token -> причина карантина
+        to_probe = []
+        for token in chats_by_token:
+            state = health.get(token_hash(token))
+            if state and state['status'] == 'quarantined' and (state['next_probe_at'] or 0) > now:
+                reasons[token] = state['reason']
+            else:
+                to_probe.append(token)
+
+        errors = await asyncio.gather(*(self._probe(token, chats_by_token[token][0]["group_id"]) for token in to_probe))
+        for token, error in zip(to_probe, errors):
+            if error:
+                reasons[token] = await self.quarantine(token, error, health.get(token_hash(token)))
+            elif health.get(token_hash(token), {}).get('status') != 'healthy':
+                await self.mark_healthy(token)
+        await self.db.connection.commit()
+
+        logger.info(f"Token preflight: {len(chats_by_token)} tokens, {len(to_probe)} probed, {len(reasons)} quarantined")
+        return reasons
+
+    async def _probe(self, token: str, group_id: str) -> Optional[Dict[str, Any]]:
+        """Один вызов groups.getById; возвращает ошибку авторизации или None
+
+        Сетевые сбои и прочие ошибки не считаются признаком плохого токена.
+        """
+        client = self.client_class(token, limiter=self.limiter, session=self.session, cassette=self.cassette,
+                                   clock=self.clock, concurrency=self.concurrency)
+        async with self.concurrency.slot():
+            try:
+                await client.initialize()
+                await client._make_request("groups.getById", {"group_id": group_id}, max_retries=1)
+            finally:
+                await client.close()
+        return client.last_error if client.token_invalid else None
+
+    async def quarantine(self, token: str, error: Dict[str, Any], state: Optional[Dict[str, Any]] = None) -> str:
+        """Помещает токен в карантин и назначает следующую проверку; возвращает причину"""
+        if state is None:
+            state = (await self.db.get_token_health([token_hash(token)])).get(token_hash(token))
+        failures = (state['failures'] if state and state['status'] == 'quarantined' else 0) + 1
+        delay = min(self.base_delay * 2 ** (failures - 1), self.max_delay)
+
+        error_code = error.get('error_code')
+        reason = f"VK error {error_code}: {INVALID_TOKEN_ERRORS.get(error_code, error.get('error_msg', 'Unknown error'))}"
+        now = self.clock.time()
+        await self.db.save_token_health(token_hash(token), 'quarantined', reason, failures, now, now + delay)
+        await self.db.connection.commit()
+        logger.warning(f"Token quarantined ({reason}), failure {failures}, next probe in {delay / 3600:.1f} h")
+        return reason
+
+    async def mark_healthy(self, token: str):
+        """Снимает токен с карантина"""
+        await self.db.save_token_health(token_hash(token), 'healthy', None, 0, self.clock.time(), None)
@@ -3,37 +3,344 @@
 """
 import asyncio
 import aiohttp
+import json
 import ssl
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from collections import Counter, deque
+from datetime import timedelta
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from loguru import logger
+from clock import Clock, clock as default_clock
 from config import config
+from instrumentation import process_metrics
+from message_columns import MessageColumns
+import vk_json
+
+# Ошибки VK API, означающие, что недействителен сам токен: повторять запросы с ним бессмысленно
+INVALID_TOKEN_ERRORS = {
+    5: "User authorization failed",
+    27: "Group authorization failed",
+    28: "Application authorization failed",
+}
+
+# Методы только на чтение: их можно отправить повторно (hedged запрос) без побочных эффектов
+IDEMPOTENT_METHODS = {"messages.getHistory", "messages.getConversationMembers", "users.get", "groups.getById"}
+
+# Поля элементов, которые анализатор берет из ответов (остальные отбрасываются еще на стороне VK)
+HISTORY_FIELDS = ("id", "from_id", "date")
+MEMBER_FIELDS = ("member_id",)
+
+def mask_token(token: str) -> str:
+    """Маскирует токен для логов и статистики"""
+    if not token or len(token) <= 12:
+        return "***"
+    return f"{token[:8]}...{token[-4:]}"
+
+class _TokenBucket:
+    """Состояние ограничителя для одного токена"""
+    
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = now
+        self.blocked_until = 0.0  # Пауза после ошибок 6/9 для всех запросов с этим токеном
+        self.lock: Optional[asyncio.Lock] = None
+        self.queued = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def refill(self, now: float):
+        """Пополняет бюджет запросов по прошедшему времени (пауза после ошибок 6/9 не считается)"""
+        started = max(self.updated_at, self.blocked_until)
+        if now > started:
+            self.tokens = min(self.capacity, self.tokens + (now - started) * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+class RateLimiter:
+    """Ограничитель частоты запросов к VK API (token bucket на каждый токен)"""
+    
+    def __init__(self, rate: float = None, burst: int = None, clock: Clock = None):
+        self.rate = rate or config.VK_REQUESTS_PER_SECOND
+        self.burst = burst or config.VK_RATE_LIMIT_BURST
+        self.clock = clock or default_clock
+        self._buckets: Dict[str, _TokenBucket] = {}
+    
+    def _get_bucket(self, token: str) -> _TokenBucket:
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            bucket = _TokenBucket(self.rate, self.burst, self.clock.monotonic())
+            self._buckets[token] = bucket
+        return bucket
+    
+    async def acquire(self, token: str) -> float:
+        """Ожидает свободный бюджет для токена, возвращает время ожидания в секундах"""
+        bucket = self._get_bucket(token)
+        if bucket.lock is None:
+            bucket.lock = asyncio.Lock()
+        
+        started_at = self.clock.monotonic()
+        bucket.queued += 1
+        try:
+            # Lock выдает бюджет строго в порядке очереди
+            async with bucket.lock:
+                while True:
+                    now = self.clock.monotonic()
+                    bucket.refill(now)
+                    
+                    if now < bucket.blocked_until:
+                        await self.clock.sleep(bucket.blocked_until - now)
+                        continue
+                    
+                    # Допуск на погрешность float: иначе пауза может оказаться короче шага часов
+                    if bucket.tokens >= 1 - 1e-9:
+                        bucket.tokens = max(bucket.tokens - 1, 0.0)
+                        break
+                    
+                    await self.clock.sleep((1 - bucket.tokens) / bucket.rate)
+        finally:
+            bucket.queued -= 1
+        
+        waited = self.clock.monotonic() - started_at
+        bucket.calls += 1
+        bucket.total_wait += waited
+        bucket.max_wait = max(bucket.max_wait, waited)
+        return waited
+    
+    def penalize(self, token: str, delay: float):
+        """Приостанавливает все запросы с токеном на delay секунд (после ошибок 6/9)"""
+        bucket = self._get_bucket(token)
+        bucket.blocked_until = max(bucket.blocked_until, self.clock.monotonic() + delay)
+        bucket.tokens = 0.0
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Статистика ожидания по каждому токену"""
+        return {
+            mask_token(token): {
+                "calls": bucket.calls,
+                "queued": bucket.queued,
+                "total_wait": round(bucket.total_wait, 3),
+                "avg_wait": round(bucket.total_wait / bucket.calls, 3) if bucket.calls else 0.0,
+                "max_wait": round(bucket.max_wait, 3)
+            }
+            for token, bucket in self._buckets.items()
+        }
+    
+    def get_totals(self) -> Dict[str, Any]:
+        """Суммарная статистика по всем токенам"""
+        calls = sum(bucket.calls for bucket in self._buckets.values())
+        total_wait = sum(bucket.total_wait for bucket in self._buckets.values())
+        return {
+            "tokens": len(self._buckets),
+            "calls": calls,
+            "queued": sum(bucket.queued for bucket in self._buckets.values()),
+            "total_wait": round(total_wait, 3),
+            "avg_wait": round(total_wait / calls, 3) if calls else 0.0,
+            "max_wait": round(max((bucket.max_wait for bucket in self._buckets.values()), default=0.0), 3)
+        }
+
+class LatencyTracker:
+    """Задержки ответов VK по методам (скользящее окно) для выбора момента hedged запроса"""
+    
+    def __init__(self, window: int = None, min_samples: int = None):
+        self.window = window or config.VK_HEDGE_WINDOW
+        self.min_samples = min_samples or config.VK_HEDGE_MIN_SAMPLES
+        self._samples: Dict[str, deque] = {}
+        self.hedged = 0  # Отправлено дубликатов
+        self.hedge_wins = 0  # Дубликат ответил раньше исходного запроса
+    
+    def record(self, method: str, latency: float):
+        samples = self._samples.get(method)
+        if samples is None:
+            samples = self._samples[method] = deque(maxlen=self.window)
+        samples.append(latency)
+    
+    def percentile(self, method: str, percent: float) -> Optional[float]:
+        """Перцентиль задержки метода или None, пока ответов слишком мало"""
+        samples = self._samples.get(method)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+    
+    def hedge_delay(self, method: str) -> Optional[float]:
+        """Через сколько секунд отправлять дубликат запроса (None - не отправлять)"""
+        if not config.VK_HEDGE_ENABLED:
+            return None
+        delay = self.percentile(method, config.VK_HEDGE_PERCENTILE)
+        return None if delay is None else max(delay, config.VK_HEDGE_MIN_DELAY)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p50": {method: round(self.percentile(method, 50) or 0.0, 3) for method in self._samples},
+            "p95": {method: round(self.percentile(method, 95) or 0.0, 3) for method in self._samples}
+        }
+
+def request_timeout(method: str) -> aiohttp.ClientTimeout:
+    """Таймауты соединения и чтения для запроса к методу VK"""
+    return aiohttp.ClientTimeout(
+        total=config.VK_REQUEST_TIMEOUT,
+        sock_connect=config.VK_METHOD_CONNECT_TIMEOUTS.get(method, config.VK_CONNECT_TIMEOUT),
+        sock_read=config.VK_METHOD_READ_TIMEOUTS.get(method, config.VK_READ_TIMEOUT)
+    )
+
+def create_session(limit: int = None, limit_per_host: int = None) -> aiohttp.ClientSession:
+    """Создает HTTP сессию с пулом keep-alive соединений к VK API
+
+    limit и limit_per_host переопределяют размер пула (по умолчанию VK_CONNECTION_LIMIT*).
+    """
+    # Создаем SSL контекст для обхода проблем с сертификатами
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=config.VK_CONNECTION_LIMIT if limit is None else limit,
+        limit_per_host=config.VK_CONNECTION_LIMIT_PER_HOST if limit_per_host is None else limit_per_host,
+        keepalive_timeout=config.VK_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=config.VK_DNS_CACHE_TTL
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.VK_REQUEST_TIMEOUT,
+        connect=config.VK_CONNECT_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+class ChatFetchCache:
+    """Данные одного чата, уже загруженные в рамках текущего анализа"""
+    
+    def __init__(self):
+        self.chat_messages: Dict[int, MessageColumns] = {}  # окно в днях -> сообщения активных авторов
+        self.total_messages_count: Optional[int] = None
+        self.user_statuses: Dict[int, str] = {}
 
 class VKClient:
     """Простой VK API клиент"""
     
-    def __init__(self, token: str = None):
-        self.session: aiohttp.ClientSession = None
-        self.base_url = "https://api.vk.com/method"
+    def __init__(self, token: str = None, limiter: RateLimiter = None, session: aiohttp.ClientSession = None,
+                 cache: ChatFetchCache = None, status_resolver=None, concurrency=None, base_url: str = None,
+                 defer_flood_control: bool = False, clock: Clock = None, cassette=None, metrics=None):
+        # Сессия может быть общей для всех клиентов анализа - тогда клиент ее не закрывает
+        self.session: aiohttp.ClientSession = session
+        self._owns_session = session is None
+        self.base_url = (base_url or config.VK_API_BASE_URL).rstrip("/")
         self.token = token or config.VK_CHATS[0]["token"]  # Используем первый токен по умолчанию
+        self.rate_limiter = limiter or rate_limiter
+        self.clock = clock or default_clock  # Время и паузы (виртуальные в симуляции)
+        self.cassette = cassette  # Cassette анализа: запись ответов VK или их воспроизведение без сети
+        self.metrics = metrics  # RunMetrics анализа: задержки, ошибки и ожидание лимита по методам VK
+        self.requests_sent = 0  # HTTP запросов к VK, отправленных этим клиентом
+        # Кэш чата на время анализа: история, количество сообщений и статусы загружаются один раз
+        self.cache = cache or ChatFetchCache()
+        self.status_resolver = status_resolver  # UserStatusResolver, общий для всех чатов анализа
+        self.concurrency = concurrency  # AdaptiveConcurrencyLimiter анализа, получает сигналы об ошибках 6/9
+        self.last_error: Optional[Dict[str, Any]] = None  # Последняя ошибка VK API (error_code, error_msg, method)
+        self.token_invalid = False  # После ошибки авторизации запросы с токеном больше не отправляются
+        # При flood control клиент не ждет сам, а прекращает запросы: анализатор откладывает чат
+        # и освобождает его слот для других чатов
+        self.defer_flood_control = defer_flood_control
+        self.flood_control: Optional[Dict[str, Any]] = None
     
     async def initialize(self):
         """Инициализация HTTP сессии"""
-        # Создаем SSL контекст для обхода проблем с сертификатами
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        self.session = aiohttp.ClientSession(connector=connector)
+        if self.session is None:
+            self.session = create_session()
+            self._owns_session = True
     
     async def close(self):
-        """Закрытие HTTP сессии"""
-        if self.session:
+        """Закрытие HTTP сессии (только собственной)"""
+        if self.session and self._owns_session:
             await self.session.close()
+            self.session = None
+    
+    @property
+    def interrupted(self) -> bool:
+        """Запросы прекращены (недействительный токен или отложенный flood control): данные неполные"""
+        return self.token_invalid or self.flood_control is not None
+    
+    async def _send(self, method: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Один HTTP запрос к VK API с таймаутами метода"""
+        if self.cassette and self.cassette.replaying:
+            return self.cassette.play(method, params)
+        
+        # Код execute может быть длинным, поэтому он отправляется в теле POST запроса
+        if method == "execute":
+            request = self.session.post(url, data=params, timeout=request_timeout(method))
+        else:
+            request = self.session.get(url, params=params, timeout=request_timeout(method))
+        
+        async with request as response:
+            data = vk_json.loads(await response.read())
+        if self.cassette:
+            self.cassette.record(method, params, data, token=self.token)
+        return data
+    
+    async def _timed_send(self, method: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Запрос с записью задержки ответа"""
+        started_at = self.clock.monotonic()
+        data = await self._send(method, url, params)
+        latency = self.clock.monotonic() - started_at
+        latency_tracker.record(method, latency)
+        self.requests_sent += 1
+        process_metrics.inc("vk_requests_total", method=method)
+        process_metrics.observe("vk_request_duration_seconds", latency, method=method)
+        if self.metrics:
+            self.metrics.count("vk_requests")
+            self.metrics.observe(f"vk.{method}", latency)
+        return data
+    
+    async def _hedge(self, method: str, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Дубликат медленного запроса: тратит бюджет токена так же, как обычный запрос"""
+        await self.rate_limiter.acquire(self.token)
+        latency_tracker.hedged += 1
+        return await self._timed_send(method, url, params)
+    
+    async def _send_hedged(self, method: str, url: str, params: Dict[str, Any], hedge: bool) -> Dict[str, Any]:
+        """Отправляет запрос; если он не ответил за перцентиль задержки метода, отправляет дубликат
+        
+        Используется первый успешный ответ, второй запрос отменяется.
+        """
+        delay = latency_tracker.hedge_delay(method) if hedge else None
+        if delay is None:
+            return await self._timed_send(method, url, params)
+        
+        primary = asyncio.ensure_future(self._timed_send(method, url, params))
+        duplicate = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            
+            duplicate = asyncio.ensure_future(self._hedge(method, url, params))
+            pending = {primary, duplicate}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is duplicate:
+                            latency_tracker.hedge_wins += 1
+                        return task.result()
+            # Оба запроса завершились ошибкой - retry логика обработает ошибку исходного
+            return primary.result()
+        finally:
+            for task in (primary, duplicate):
+                if task is not None and not task.done():
+                    task.cancel()
     
-    async def _make_request(self, method: str, params: Dict[str, Any], max_retries: int = 5) -> Dict[str, Any]:
-        """Выполнение запроса к VK API с retry логикой"""
+    async def _make_request(self, method: str, params: Dict[str, Any], max_retries: int = 5,
+                            hedge: bool = None) -> Dict[str, Any]:
+        """Выполнение запроса к VK API с retry логикой
+        
+        hedge разрешает дубликат медленного запроса (по умолчанию - для методов только на чтение).
+        """
+        if hedge is None:
+            hedge = method in IDEMPOTENT_METHODS
+        if self.interrupted:
+            return {"response": {"items": []}}
+        
         url = f"{self.base_url}/{method}"
         request_params = {
             "access_token": self.token,
@@ -43,52 +350,75 @@ class VKClient:
         
         for attempt in range(max_retries):
             try:
-                async with self.session.get(url, params=request_params) as response:
-                    data = await response.json()
+                # Ждем свободный бюджет запросов для токена (ответы из кассеты лимит VK не расходуют)
+                if not (self.cassette and self.cassette.replaying):
+                    waited = await self.rate_limiter.acquire(self.token)
+                    process_metrics.observe("vk_rate_limit_wait_seconds", waited)
+                    if self.metrics:
+                        self.metrics.observe("rate_limit_wait", waited)
+                
+                data = await self._send_hedged(method, url, request_params, hedge)
+                if "error" in data:
+                    error = data["error"]
+                    error_code = error.get("error_code", 0)
+                    error_msg = error.get("error_msg", "Unknown error")
+                    self.last_error = {"error_code": error_code, "error_msg": error_msg, "method": method}
+                    process_metrics.inc("vk_errors_total", method=method, code=str(error_code))
+                    if self.metrics:
+                        self.metrics.count(f"vk_errors.{error_code}")
                     
-                    if "error" in data:
-                        error = data["error"]
-                        error_code = error.get("error_code", 0)
-                        error_msg = error.get("error_msg", "Unknown error")
-                        
-                        if error_code == 15:  # Access denied
-                            logger.warning(f"Access denied for {method}: {error_msg}")
+                    if error_code == 15:  # Access denied
+                        logger.warning(f"Access denied for {method}: {error_msg}")
+                        return {"response": {"items": []}}
+                    elif error_code == 6:  # Too many requests
+                        logger.warning(f"Rate limit for {method}: {error_msg} (attempt {attempt + 1}/{max_retries})")
+                        if self.concurrency:
+                            self.concurrency.record_throttle(error_code)
+                        if attempt < max_retries - 1:
+                            # Увеличиваем задержку для Rate limit: 5, 10, 20, 40 секунд
+                            # Пауза действует на все запросы с этим токеном
+                            delay = 5 * (2 ** attempt)
+                            logger.info(f"Waiting {delay} seconds before retry...")
+                            self.rate_limiter.penalize(self.token, delay)
+                            continue
+                        else:
+                            logger.error(f"Rate limit exceeded after {max_retries} attempts for {method}")
                             return {"response": {"items": []}}
-                        elif error_code == 6:  # Too many requests
-                            logger.warning(f"Rate limit for {method}: {error_msg} (attempt {attempt + 1}/{max_retries})")
-                            if attempt < max_retries - 1:
-                                # Увеличиваем задержку для Rate limit: 5, 10, 20, 40 секунд
-                                delay = 5 * (2 ** attempt)
-                                logger.info(f"Waiting {delay} seconds before retry...")
-                                await asyncio.sleep(delay)
-                                continue
-                            else:
-                                logger.error(f"Rate limit exceeded after {max_retries} attempts for {method}")
-                                return {"response": {"items": []}}
-                        elif error_code == 9:  # Flood control
-                            logger.warning(f"Flood control for {method}: {error_msg} (attempt {attempt + 1}/{max_retries})")
-                            if attempt < max_retries - 1:
-                                # Увеличиваем задержку для Flood control: 30, 60, 120, 240 секунд
-                                delay = 30 * (2 ** attempt)
-                                logger.info(f"Flood control detected, waiting {delay} seconds before retry...")
-                                await asyncio.sleep(delay)
-                                continue
-                            else:
-                                logger.error(f"Flood control exceeded after {max_retries} attempts for {method}")
-                                return {"response": {"items": []}}
-                        elif error_code == 27:  # Invalid access key
-                            logger.error(f"VK API error 27 (Invalid access key) for {method}: {error_msg}")
+                    elif error_code == 9:  # Flood control
+                        logger.warning(f"Flood control for {method}: {error_msg} (attempt {attempt + 1}/{max_retries})")
+                        if self.concurrency:
+                            self.concurrency.record_throttle(error_code)
+                        if self.defer_flood_control:
+                            self.flood_control = self.last_error
                             return {"response": {"items": []}}
+                        if attempt < max_retries - 1:
+                            # Увеличиваем задержку для Flood control: 30, 60, 120, 240 секунд
+                            delay = 30 * (2 ** attempt)
+                            logger.info(f"Flood control detected, waiting {delay} seconds before retry...")
+                            self.rate_limiter.penalize(self.token, delay)
+                            continue
                         else:
-                            logger.error(f"VK API error {error_code}: {error_msg}")
+                            logger.error(f"Flood control exceeded after {max_retries} attempts for {method}")
                             return {"response": {"items": []}}
-                    
-                    return data
-                    
+                    elif error_code in INVALID_TOKEN_ERRORS:  # Недействительный токен
+                        logger.error(f"VK API error {error_code} ({INVALID_TOKEN_ERRORS[error_code]}) for {method}: {error_msg}")
+                        self.token_invalid = True
+                        return {"response": {"items": []}}
+                    else:
+                        logger.error(f"VK API error {error_code}: {error_msg}")
+                        return {"response": {"items": []}}
+                
+                if self.concurrency:
+                    self.concurrency.record_success()
+                return data
+                
             except Exception as e:
                 logger.error(f"Request failed for {method} (attempt {attempt + 1}/{max_retries}): {e}")
+                process_metrics.inc("vk_errors_total", method=method, code="network")
+                if self.metrics:
+                    self.metrics.count("vk_errors.network")
                 if attempt < max_retries - 1:
-                    await asyncio.sleep(2 ** attempt)
+                    await self.clock.sleep(2 ** attempt)
                     continue
                 else:
                     logger.error(f"Request failed after {max_retries} attempts for {method}")
@@ -96,16 +426,121 @@ class VKClient:
         
         return {"response": {"items": []}}
     
+    @staticmethod
+    def _build_execute_code(calls: List[Tuple[str, Dict[str, Any]]], fields: Dict[str, Tuple[str, ...]] = None) -> str:
+        """Формирует VKScript код, возвращающий массив результатов вызовов
+        
+        Для методов из fields вместо полного ответа возвращается count и списки указанных полей
+        элементов items (оператор @. VKScript): тексты, вложения и профили не передаются и не разбираются.
+        """
+        fields = fields or {}
+        if not any(method in fields for method, _ in calls):
+            api_calls = [
+                f"API.{method}({json.dumps(params, ensure_ascii=False)})"
+                for method, params in calls
+            ]
+            return "return [" + ",".join(api_calls) + "];"
+        
+        code = []
+        for index, (method, params) in enumerate(calls):
+            code.append(f"var r{index}=API.{method}({json.dumps(params, ensure_ascii=False)});")
+            if method in fields:
+                projection = ",".join(f'"{field}":r{index}.items@.{field}' for field in fields[method])
+                code.append(f'if(r{index}){{r{index}={{"count":r{index}.count,"items":{{{projection}}}}};}}')
+        return "".join(code) + "return [" + ",".join(f"r{index}" for index in range(len(calls))) + "];"
+    
+    @staticmethod
+    def _item_fields(response: Optional[Dict[str, Any]], fields: Tuple[str, ...]) -> List[List[Any]]:
+        """Значения полей элементов items: из проекции execute или из полного ответа"""
+        items = (response or {}).get("items") or []
+        if isinstance(items, dict):
+            return [items.get(field) or [] for field in fields]
+        return [[item.get(field, 0) for item in items] for field in fields]
+    
+    @classmethod
+    def _history_page(cls, response: Optional[Dict[str, Any]]) -> MessageColumns:
+        """Страница messages.getHistory в колонках id, from_id, date"""
+        return MessageColumns.from_fields(*cls._item_fields(response, HISTORY_FIELDS))
+    
+    def _split_execute_calls(self, calls: List[Tuple[str, Dict[str, Any]]],
+                             fields: Dict[str, Tuple[str, ...]] = None) -> List[List[Tuple[str, Dict[str, Any]]]]:
+        """Разбивает вызовы на группы, которые помещаются в один execute"""
+        chunks = []
+        current = []
+        current_length = 0
+        
+        for call in calls:
+            call_length = len(self._build_execute_code([call], fields))
+            if current and (len(current) >= config.VK_EXECUTE_BATCH_SIZE
+                            or current_length + call_length > config.VK_EXECUTE_MAX_CODE_LENGTH):
+                chunks.append(current)
+                current = []
+                current_length = 0
+            current.append(call)
+            current_length += call_length
+        
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    async def execute(self, calls: List[Tuple[str, Dict[str, Any]]], fields: Dict[str, Tuple[str, ...]] = None) -> List[Any]:
+        """Выполнение нескольких вызовов API через execute (до 25 за один запрос)
+        
+        fields задает проекцию ответов по методам (метод -> поля элементов items).
+        Возвращает список ответов в порядке вызовов; для неудачного вызова - None.
+        """
+        results = []
+        
+        if self.metrics:
+            for method, _ in calls:
+                self.metrics.count(f"vk_calls.{method}")
+        
+        for chunk in self._split_execute_calls(calls, fields):
+            # execute из одних чтений можно дублировать так же, как отдельные чтения
+            response = await self._make_request("execute", {
+                "code": self._build_execute_code(chunk, fields)
+            }, hedge=all(method in IDEMPOTENT_METHODS for method, _ in chunk))
+            
+            for error in response.get("execute_errors", []):
+                logger.warning(f"execute: {error.get('method')} failed with error {error.get('error_code')}: {error.get('error_msg')}")
+                # Ошибки токена и flood control внутри execute прерывают загрузку так же, как у обычных запросов
+                error_code = error.get("error_code", 0)
+                process_metrics.inc("vk_errors_total", method=str(error.get("method")), code=str(error_code))
+                if self.metrics:
+                    self.metrics.count(f"vk_errors.{error_code}")
+                if error_code in INVALID_TOKEN_ERRORS or (error_code == 9 and self.defer_flood_control):
+                    self.last_error = {"error_code": error_code, "error_msg": error.get("error_msg", "Unknown error"),
+                                       "method": error.get("method")}
+                    if error_code == 9:
+                        self.flood_control = self.last_error
+                    else:
+                        self.token_invalid = True
+            
+            items = response.get("response")
+            if not isinstance(items, list) or len(items) != len(chunk):
+                # Весь execute завершился ошибкой - считаем неудачными все вызовы пакета
+                results.extend([None] * len(chunk))
+                continue
+            
+            results.extend(None if item is False else item for item in items)
+        
+        return results
+    
     async def get_chat_members(self) -> List[Dict[str, Any]]:
         """Получение участников чата с проверкой удаленных страниц"""
         try:
-            response = await self._make_request("messages.getConversationMembers", {
-                "peer_id": config.PEER_ID
-            })
+            # Участники и общее количество сообщений запрашиваются одним execute
+            members_response, history_response = await self.execute([
+                ("messages.getConversationMembers", {"peer_id": config.PEER_ID}),
+                ("messages.getHistory", {"peer_id": config.PEER_ID, "count": 0})
+            ], fields={"messages.getConversationMembers": MEMBER_FIELDS})
+            
+            if history_response:
+                self.cache.total_messages_count = history_response.get("count", 0)
             
-            members = response.get("response", {}).get("items", [])
+            member_ids, = self._item_fields(members_response, MEMBER_FIELDS)
             # Сначала получаем всех пользователей с положительными ID
-            candidate_users = [member["member_id"] for member in members if member.get("member_id", 0) > 0]
+            candidate_users = [member_id for member_id in member_ids if member_id > 0]
             
             if not candidate_users:
                 logger.info("No candidate users found")
@@ -135,86 +570,175 @@ class VKClient:
             logger.error(f"Failed to get chat members: {e}")
             return []
     
-    async def get_chat_messages(self, max_messages: int = None) -> List[Dict[str, Any]]:
-        """Получение сообщений чата"""
-        try:
-            if max_messages is None:
-                max_messages = config.MAX_MESSAGES
-            
-            all_messages = []
-            offset = 0
-            batch_size = 200
-            
-            while len(all_messages) < max_messages:
-                response = await self._make_request("messages.getHistory", {
+    @staticmethod
+    def _newest_message(messages: MessageColumns, newest: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+        """Обновляет отметку самого нового сообщения по странице истории"""
+        if messages:
+            index = max(range(len(messages)), key=messages.ids.__getitem__)
+            if newest is None or messages.ids[index] > newest["id"]:
+                newest = {"id": messages.ids[index], "date": messages.dates[index]}
+        return newest
+    
+    async def iter_history(self, days: int = None, max_messages: int = None) -> AsyncIterator[MessageColumns]:
+        """Постранично отдает историю чата (от новых к старым) только за последние days дней
+        
+        getHistory возвращает сначала новые сообщения, поэтому загрузка прекращается,
+        как только страница выходит за начало окна анализа. Из сообщений VK передает
+        только id, from_id и date.
+        """
+        if days is None:
+            days = config.ANALYSIS_WINDOW_DAYS
+        if max_messages is None:
+            max_messages = config.MAX_MESSAGES
+        
+        window_start = int((self.clock.now() - timedelta(days=days)).timestamp())
+        batch_size = config.HISTORY_PAGE_SIZE
+        max_pages = (max_messages + batch_size - 1) // batch_size
+        offset = 0
+        pages_count = 1  # Для большинства чатов окно умещается в одну страницу
+        
+        while offset // batch_size < max_pages:
+            pages_count = min(pages_count, config.VK_EXECUTE_BATCH_SIZE, max_pages - offset // batch_size)
+            pages = await self.execute([
+                ("messages.getHistory", {
                     "peer_id": config.PEER_ID,
                     "count": batch_size,
-                    "offset": offset
+                    "offset": offset + page * batch_size
                 })
-                
-                messages = response.get("response", {}).get("items", [])
+                for page in range(pages_count)
+            ], fields={"messages.getHistory": HISTORY_FIELDS})
+            
+            for page in pages:
+                messages = self._history_page(page)
                 if not messages:
-                    break
-                
-                # Фильтруем сообщения за последние 30 дней
-                month_ago = int((datetime.now() - timedelta(days=30)).timestamp())
-                current_time = int(datetime.now().timestamp())
+                    return
                 
-                month_messages = [
-                    msg for msg in messages 
-                    if month_ago <= msg.get("date", 0) <= current_time
-                ]
-                
-                # Фильтруем сообщения от пользователей с положительными ID
-                candidate_messages = [
-                    msg for msg in month_messages 
-                    if msg.get("from_id", 0) > 0
-                ]
+                yield messages
+                offset += batch_size
                 
-                all_messages.extend(candidate_messages)
+                oldest_date = messages.dates[-1]
+                if len(messages) < batch_size or oldest_date < window_start:
+                    return
+            
+            # Оцениваем, сколько еще страниц осталось до начала окна, по плотности уже полученных
+            newest_date = messages.dates[0]
+            page_span = max(newest_date - oldest_date, 1)
+            pages_count = max(1, -(-(oldest_date - window_start) // page_span))
+    
+    async def fetch_window_messages(self, days: int = None, max_messages: int = None) -> Tuple[MessageColumns, Optional[Dict[str, int]]]:
+        """Загружает сообщения за последние days дней без проверки статуса авторов
+        
+        Возвращает сообщения от пользователей и отметку самого нового сообщения чата.
+        """
+        if days is None:
+            days = config.ANALYSIS_WINDOW_DAYS
+        if max_messages is None:
+            max_messages = config.MAX_MESSAGES
+        
+        all_messages = MessageColumns()
+        newest = None
+        
+        window_start = int((self.clock.now() - timedelta(days=days)).timestamp())
+        current_time = int(self.clock.time())
+        
+        async for messages in self.iter_history(days, max_messages):
+            newest = self._newest_message(messages, newest)
+            
+            # Фильтруем сообщения за окно анализа от пользователей с положительными ID
+            all_messages.extend_columns(messages.from_users(window_start, current_time))
+            
+            if len(all_messages) >= max_messages:
+                break
+        
+        return all_messages, newest
+    
+    async def get_new_messages(self, since_message_id: int, max_messages: int = None) -> Tuple[MessageColumns, Optional[Dict[str, int]]]:
+        """Загружает только сообщения новее since_message_id (через start_message_id)
+        
+        Возвращает сообщения от пользователей и отметку самого нового сообщения чата.
+        """
+        if max_messages is None:
+            max_messages = config.MAX_MESSAGES
+        
+        all_messages = MessageColumns()
+        newest = None
+        start_message_id = since_message_id
+        batch_size = config.HISTORY_PAGE_SIZE
+        
+        while len(all_messages) < max_messages:
+            # Отрицательный offset относительно start_message_id возвращает более новые сообщения
+            response = await self._make_request("messages.getHistory", {
+                "peer_id": config.PEER_ID,
+                "start_message_id": start_message_id,
+                "offset": -batch_size,
+                "count": batch_size
+            })
+            
+            page = self._history_page(response.get("response"))
+            # Страница может начинаться с самого сообщения start_message_id - отбрасываем его явно
+            new_messages = page.newer_than(start_message_id)
+            if not new_messages:
+                break
+            
+            newest = self._newest_message(new_messages, newest)
+            
+            all_messages.extend_columns(new_messages.from_users())
+            
+            # Страница заполнена не полностью - новее сообщений нет. Считаем по всей странице,
+            # иначе граничное сообщение сократит ее на одно и загрузка закончится раньше времени
+            if len(page) < batch_size:
+                break
+            
+            start_message_id = newest["id"]
+        
+        logger.info(f"Fetched {len(all_messages)} new messages after message {since_message_id}")
+        return all_messages, newest
+    
+    async def filter_active_messages(self, all_messages: MessageColumns) -> MessageColumns:
+        """Оставляет только сообщения от активных (не удаленных и не заблокированных) авторов"""
+        if all_messages:
+            # Получаем уникальных авторов сообщений
+            unique_authors = list(all_messages.authors())
+            
+            if unique_authors:
+                # Проверяем статус авторов
+                author_statuses = await self.check_users_status(unique_authors)
                 
-                if len(messages) < batch_size:
-                    break
+                # Фильтруем только сообщения от активных пользователей
+                active_authors = {user_id for user_id in unique_authors if author_statuses.get(user_id) == "active"}
+                filtered_messages = all_messages.only_authors(active_authors)
                 
-                offset += batch_size
+                status_counts = Counter(author_statuses.get(from_id, "unknown") for from_id in all_messages.from_ids if from_id > 0)
+                deleted_messages = status_counts["deleted"]
+                banned_messages = status_counts["banned"]
                 
-                # Rate limiting
-                await asyncio.sleep(config.RATE_LIMIT_DELAY)
+                logger.info(f"Found {len(filtered_messages)} messages from active users, {deleted_messages} from deleted, {banned_messages} from banned")
+                return filtered_messages
+        
+        logger.info(f"Found {len(all_messages)} messages")
+        return all_messages
+    
+    async def get_chat_messages(self, max_messages: int = None, days: int = None) -> MessageColumns:
+        """Получение сообщений чата за последние days дней"""
+        try:
+            if days is None:
+                days = config.ANALYSIS_WINDOW_DAYS
             
-            # Фильтруем сообщения от удаленных пользователей
-            if all_messages:
-                # Получаем уникальных авторов сообщений
-                unique_authors = list(set(msg.get("from_id", 0) for msg in all_messages if msg.get("from_id", 0) > 0))
-                
-                if unique_authors:
-                    # Проверяем статус авторов
-                    author_statuses = await self.check_users_status(unique_authors)
-                    
-                    # Фильтруем только сообщения от активных пользователей
-                    filtered_messages = []
-                    deleted_messages = 0
-                    banned_messages = 0
-                    
-                    for msg in all_messages:
-                        from_id = msg.get("from_id", 0)
-                        if from_id > 0:
-                            status = author_statuses.get(from_id, "unknown")
-                            if status == "active":
-                                filtered_messages.append(msg)
-                            elif status == "deleted":
-                                deleted_messages += 1
-                            elif status == "banned":
-                                banned_messages += 1
-                    
-                    logger.info(f"Found {len(filtered_messages)} messages from active users, {deleted_messages} from deleted, {banned_messages} from banned")
-                    return filtered_messages
+            if max_messages is None and days in self.cache.chat_messages:
+                # История уже загружена в этом анализе (например, для fallback участников)
+                return self.cache.chat_messages[days]
+            
+            all_messages, _ = await self.fetch_window_messages(days, max_messages)
             
-            logger.info(f"Found {len(all_messages)} messages")
-            return all_messages
+            # Фильтруем сообщения от удаленных пользователей
+            messages = await self.filter_active_messages(all_messages)
+            if max_messages is None:
+                self.cache.chat_messages[days] = messages
+            return messages
             
         except Exception as e:
             logger.error(f"Failed to get chat messages: {e}")
-            return []
+            return MessageColumns()
     
     async def get_chat_members_from_messages(self) -> List[int]:
         """Получение участников из авторов сообщений (fallback метод)"""
@@ -224,7 +748,7 @@ class VKClient:
                 return []
             
             # Получаем уникальных авторов сообщений
-            unique_authors = list(set(msg.get("from_id", 0) for msg in messages if msg.get("from_id", 0) > 0))
+            unique_authors = list(messages.authors())
             
             if not unique_authors:
                 return []
@@ -266,12 +790,19 @@ class VKClient:
     async def get_total_messages_count(self) -> int:
         """Получение общего количества сообщений"""
         try:
+            if self.cache.total_messages_count is not None:
+                # Уже получено вместе с участниками чата
+                total_count = self.cache.total_messages_count
+                logger.info(f"Total messages in chat: {total_count}")
+                return total_count
+            
             response = await self._make_request("messages.getHistory", {
                 "peer_id": config.PEER_ID,
                 "count": 0
             })
             
             total_count = response.get("response", {}).get("count", 0)
+            self.cache.total_messages_count = total_count
             logger.info(f"Total messages in chat: {total_count}")
             return total_count
             
@@ -285,33 +816,69 @@ class VKClient:
             if not user_ids:
                 return {}
             
-            # VK API позволяет запрашивать до 1000 пользователей за раз
-            batch_size = 1000
-            all_statuses = {}
+            # Статусы, уже полученные для этого чата, повторно не запрашиваем
+            cached_statuses = {
+                user_id: self.cache.user_statuses[user_id]
+                for user_id in user_ids if user_id in self.cache.user_statuses
+            }
+            user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in cached_statuses]
+            if not user_ids:
+                return cached_statuses
             
-            for i in range(0, len(user_ids), batch_size):
-                batch_ids = user_ids[i:i + batch_size]
-                
-                response = await self._make_request("users.get", {
-                    "user_ids": ",".join(map(str, batch_ids)),
-                    "fields": "deactivated"
-                })
-                
-                users = response.get("response", [])
-                
-                for user in users:
-                    user_id = user.get("id")
-                    deactivated = user.get("deactivated")
-                    # "active" если поле deactivated отсутствует, иначе статус из API
-                    status = "active" if not deactivated else deactivated
-                    all_statuses[user_id] = status
-                
-                # Увеличенная задержка между запросами для стабильности
-                await asyncio.sleep(0.5)
+            started_at = self.clock.monotonic()
+            if self.status_resolver:
+                # Общий для всех чатов сервис: объединяет запросы в пакеты и кэширует статусы
+                all_statuses = await self.status_resolver.resolve(user_ids, self)
+            else:
+                all_statuses = await self.fetch_users_status(user_ids)
+            if self.metrics:
+                self.metrics.observe("status_check", self.clock.monotonic() - started_at)
             
             logger.info(f"Checked status for {len(user_ids)} users, found {len(all_statuses)} responses")
+            self.cache.user_statuses.update(all_statuses)
+            all_statuses.update(cached_statuses)
             return all_statuses
             
         except Exception as e:
             logger.error(f"Failed to check users status: {e}")
             return {}
+    
+    async def fetch_users_status(self, user_ids: List[int]) -> Dict[int, str]:
+        """Запрашивает статусы пользователей через users.get без кэширования"""
+        # VK API позволяет запрашивать до 1000 пользователей за раз
+        batch_size = 1000
+        all_statuses = {}
+        
+        calls = [
+            ("users.get", {
+                "user_ids": ",".join(map(str, user_ids[i:i + batch_size])),
+                "fields": "deactivated"
+            })
+            for i in range(0, len(user_ids), batch_size)
+        ]
+        
+        if len(calls) == 1:
+            response = await self._make_request(*calls[0])
+            batches = [response.get("response", [])]
+        else:
+            # Несколько пакетов по 1000 пользователей отправляем одним execute
+            batches = await self.execute(calls)
+        
+        for users in batches:
+            if not isinstance(users, list):
+                continue
+            
+            for user in users:
+                user_id = user.get("id")
+                deactivated = user.get("deactivated")
+                # "active" если поле deactivated отсутствует, иначе статус из API
+                status = "active" if not deactivated else deactivated
+                all_statuses[user_id] = status
+        
+        return all_statuses
+
+# Общий ограничитель частоты запросов для всех VK клиентов
+rate_limiter = RateLimiter()
+
+# Общая статистика задержек ответов VK для hedged запросов
+latency_tracker = LatencyTracker()
@@ -0,0 +1,31 @@
+"""
+Разбор JSON ответов VK API: orjson, если установлен, иначе стандартный json
+"""
+import json
+from typing import Any, Callable, Dict
+
+from config import config
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+def _stdlib_loads(data: bytes) -> Any:
+    return json.loads(data)
+
+DECODERS: Dict[str, Callable[[bytes], Any]] = {"json": _stdlib_loads}
+if orjson is not None:
+    DECODERS["orjson"] = orjson.loads
+
+def get_decoder(name: str = None) -> Callable[[bytes], Any]:
+    """Функция разбора JSON по имени ("auto" - самая быстрая из установленных)"""
+    name = name or config.VK_JSON_DECODER
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name not in DECODERS:
+        raise ValueError(f"JSON decoder {name!r} is not available (installed: {', '.join(DECODERS)})")
+    return DECODERS[name]
+
+# Разбор ответов VK, выбранный при запуске
+loads = get_decoder()
@@ -0,0 +1,464 @@
+"""
+Локальная замена VK API для проверки Long Poll и анализа без обращения к api.vk.com
+
+Запуск: python vk_standin.py --port 8081, затем VK_API_BASE_URL=http://127.0.0.1:8081/method
+Синтетические чаты с ошибками и задержками: python vk_standin.py --chats 100 --errors 6=0.01 9=0.005 --latency 0.05
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from loguru import logger
+
+from config import config
+from message_columns import MessageColumns
+
+# Ошибки, которые сервер может подмешивать в ответы
+INJECTED_ERRORS = {
+    6: "Too many requests per second",
+    9: "Flood control",
+    27: "Group authorization failed: method is unavailable with group auth",
+}
+
+_WORDS = ("привет", "как дела", "спасибо", "завтра", "встреча", "в 18:00", "ок", "договорились", "фото", "ссылка")
+
+def synthetic_chats(count: int) -> List[Dict[str, Any]]:
+    """Конфигурация синтетических чатов (как из CSV): id групп и токены детерминированы"""
+    return [
+        {"group_id": str(100000 + index), "token": f"standin-token-{index}", "chat_name": f"Synthetic chat {index}"}
+        for index in range(count)
+    ]
+
+class StandInChat:
+    """Состояние одного чата сообщества на локальном сервере"""
+
+    def __init__(self, group_id: str, token: str):
+        self.group_id = group_id
+        self.token = token
+        self.history = MessageColumns()  # Синтетическая история (только id, from_id, date), старше messages
+        self.messages: List[Dict[str, Any]] = []  # От старых к новым
+        self.members: set = set()
+        self.events: List[Dict[str, Any]] = []
+        self.first_ts = 1  # ts первого события, которое еще хранится
+        self.key = uuid.uuid4().hex
+        self.changed = asyncio.Event()
+
+    @property
+    def next_ts(self) -> int:
+        return self.first_ts + len(self.events)
+
+    @property
+    def message_count(self) -> int:
+        return len(self.history) + len(self.messages)
+
+    @property
+    def last_id(self) -> int:
+        if self.messages:
+            return self.messages[-1]["id"]
+        return self.history.ids[-1] if self.history else 0
+
+    def newer_count(self, message_id: int) -> int:
+        """Сколько сообщений новее message_id (позиция message_id в порядке от новых к старым)"""
+        newer = len(self.messages) - bisect.bisect_right([msg["id"] for msg in self.messages], message_id)
+        if newer < len(self.messages):
+            return newer
+        return newer + len(self.history) - bisect.bisect_right(self.history.ids, message_id)
+
+    def newest_first(self, start: int, count: int) -> List[Dict[str, Any]]:
+        """Сообщения от новых к старым начиная с позиции start"""
+        items = []
+        for position in range(max(start, 0), min(start + count, self.message_count)):
+            if position < len(self.messages):
+                items.append(self.messages[-1 - position])
+            else:
+                items.append(self._history_message(len(self.history) - 1 - (position - len(self.messages))))
+        return items
+
+    def _history_message(self, index: int) -> Dict[str, Any]:
+        """Сообщение синтетической истории в формате VK"""
+        message_id = self.history.ids[index]
+        return {
+            "id": message_id,
+            "date": self.history.dates[index],
+            "peer_id": config.PEER_ID,
+            "from_id": self.history.from_ids[index],
+            "text": " ".join(_WORDS[(message_id * 7 + word) % len(_WORDS)] for word in range(1 + message_id % 20)),
+            "conversation_message_id": message_id,
+            "attachments": [],
+            "fwd_messages": [],
+            "important": False,
+            "is_hidden": False,
+            "out": 0,
+        }
+
+class VKStandIn:
+    """Сервер с методами, которые использует бот, и Long Poll сервером
+
+    error_rates задает долю ответов с ошибкой по коду (6, 9 или 27): ошибки 6 и 27 возвращаются
+    на весь запрос, ошибка 9 - на отдельный вызов (внутри execute - в execute_errors).
+    Каждый запрос задерживается на latency секунд (±50%), доля slow_rate - на slow_latency.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, error_rates: Dict[int, float] = None,
+                 latency: float = 0.0, slow_rate: float = 0.0, slow_latency: float = 0.0, seed: int = None):
+        self.host = host
+        self.port = port
+        self.chats: Dict[str, StandInChat] = {}
+        self._chats_by_token: Dict[str, StandInChat] = {}
+        self.deactivated: Dict[int, str] = {}  # id пользователя -> deleted/banned
+        self.error_rates = error_rates or {}
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.history_includes_start = False  # Отдавать ли start_message_id в странице более новых сообщений
+        self.rng = random.Random(seed)
+        self.stats: Counter = Counter()  # Запросы, вызовы по методам, ошибки и байты
+        self.app = web.Application()
+        self.app.router.add_route("*", "/method/{method}", self._handle_method)
+        self.app.router.add_get("/lp/{group_id}", self._handle_long_poll)
+        self.app.router.add_get("/stats", self._handle_stats)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/method"
+
+    async def start(self):
+        """Запускает сервер"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"VK stand-in listening on {self.base_url}")
+
+    async def stop(self):
+        """Останавливает сервер"""
+        for chat in self.chats.values():
+            chat.changed.set()  # Отпускаем ожидающие Long Poll запросы
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def add_chat(self, group_id: str, token: str, members: List[int] = ()) -> StandInChat:
+        """Регистрирует чат сообщества"""
+        chat = StandInChat(str(group_id), token)
+        chat.members.update(members)
+        self.chats[chat.group_id] = chat
+        self._chats_by_token[token] = chat
+        return chat
+
+    def populate(self, chats: List[Dict[str, Any]], members: int = 200, messages: int = 1000, days: int = 45,
+                 shared: float = 0.2, deactivated: float = 0.03, seed: int = 1):
+        """Создает синтетические чаты: участники (доля shared состоит еще в одном чате),
+        удаленные/заблокированные пользователи и история за days дней"""
+        rng = random.Random(seed)
+        now = int(time.time())
+        users_count = max(len(chats) * members, 1)
+        for index, chat_config in enumerate(chats):
+            own = range(index * members + 1, (index + 1) * members + 1)
+            chat_members = [user_id if rng.random() >= shared else rng.randint(1, users_count) for user_id in own]
+            chat = self.add_chat(chat_config["group_id"], chat_config["token"], members=chat_members)
+            authors = list(chat.members)
+            for message_id in range(1, messages + 1):
+                # Немного сообщений от имени сообщества (отрицательный from_id)
+                from_id = rng.choice(authors) if rng.random() > 0.02 else -int(chat.group_id)
+                chat.history.append(message_id, from_id, now - (messages - message_id) * days * 86400 // messages)
+        for user_id in range(1, users_count + 1):
+            if rng.random() < deactivated:
+                self.deactivated[user_id] = rng.choice(("deleted", "banned"))
+        logger.info(f"VK stand-in populated {len(chats)} chats, {users_count} users")
+
+    # Генерация событий
+
+    def post_message(self, group_id: str, from_id: int, text: str = "", action: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Добавляет сообщение в историю чата и событие message_new"""
+        chat = self.chats[str(group_id)]
+        message = {
+            "id": chat.last_id + 1,
+            "date": int(time.time()),
+            "peer_id": config.PEER_ID,
+            "from_id": from_id,
+            "text": text,
+            "conversation_message_id": chat.message_count + 1,
+        }
+        if action:
+            message["action"] = action
+        chat.messages.append(message)
+        self._push_event(chat, {
+            "type": "message_new",
+            "object": {"message": message, "client_info": {}},
+            "group_id": int(chat.group_id),
+            "event_id": uuid.uuid4().hex,
+        })
+        return message
+
+    def invite_member(self, group_id: str, member_id: int, inviter_id: int = None) -> Dict[str, Any]:
+        """Приглашение пользователя в чат (служебное сообщение chat_invite_user)"""
+        self.chats[str(group_id)].members.add(member_id)
+        return self.post_message(group_id, inviter_id or member_id, action={"type": "chat_invite_user", "member_id": member_id})
+
+    def kick_member(self, group_id: str, member_id: int, admin_id: int = None) -> Dict[str, Any]:
+        """Исключение пользователя из чата (служебное сообщение chat_kick_user)"""
+        self.chats[str(group_id)].members.discard(member_id)
+        return self.post_message(group_id, admin_id or member_id, action={"type": "chat_kick_user", "member_id": member_id})
+
+    def expire_key(self, group_id: str):
+        """Делает ключ Long Poll недействительным (клиент получит failed=2)"""
+        chat = self.chats[str(group_id)]
+        chat.key = uuid.uuid4().hex
+        chat.changed.set()
+
+    def drop_events(self, group_id: str):
+        """Забывает накопленные события (клиент получит failed=1)"""
+        chat = self.chats[str(group_id)]
+        chat.first_ts += len(chat.events)
+        chat.events = []
+        chat.changed.set()
+
+    def _push_event(self, chat: StandInChat, event: Dict[str, Any]):
+        chat.events.append(event)
+        chat.changed.set()
+
+    # HTTP обработчики
+
+    def _respond(self, data: Dict[str, Any]) -> web.Response:
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.stats["bytes_out"] += len(body)
+        return web.Response(body=body, content_type="application/json")
+
+    def _injected_error(self, code: int) -> Optional[Dict[str, Any]]:
+        """Ошибка VK с кодом code с заданной вероятностью"""
+        rate = self.error_rates.get(code)
+        if rate and self.rng.random() < rate:
+            self.stats[f"error_{code}"] += 1
+            return {"error_code": code, "error_msg": INJECTED_ERRORS[code]}
+        return None
+
+    def next_latency(self) -> float:
+        """Задержка очередного ответа, секунд"""
+        if self.slow_rate and self.rng.random() < self.slow_rate:
+            return self.slow_latency
+        return self.latency * self.rng.uniform(0.5, 1.5) if self.latency else 0.0
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        self.stats["bytes_in"] += len(request.path_qs) + (request.content_length or 0)
+
+        delay = self.next_latency()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._respond(self.respond(request.match_info["method"], params))
+
+    def respond(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Ответ VK API на вызов метода (без HTTP и задержки)"""
+        self.stats["requests"] += 1
+        chat = self._chats_by_token.get(params.get("access_token"))
+        if chat is None:
+            return {"error": {"error_code": 5, "error_msg": "User authorization failed: invalid access_token"}}
+
+        error = self._injected_error(6) or self._injected_error(27)
+        if error:
+            return {"error": error}
+
+        if method == "execute":
+            self.stats["execute"] += 1
+            code = params.get("code", "")
+            projections = self._parse_projections(code)
+            responses = []
+            execute_errors = []
+            for index, (call_method, call_params) in enumerate(self._parse_execute(code)):
+                result = self._call(chat, call_method, call_params)
+                if "error" in result:
+                    execute_errors.append({"method": call_method, **result["error"]})
+                response = result.get("response", False)
+                if response and index in projections:
+                    response = {"count": response.get("count"), "items": {
+                        field: [item.get(field) for item in response["items"]] for field in projections[index]
+                    }}
+                responses.append(response)
+            data = {"response": responses}
+            if execute_errors:
+                data["execute_errors"] = execute_errors
+            return data
+        return self._call(chat, method, params)
+
+    def _call(self, chat: StandInChat, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        self.stats[method] += 1
+        error = self._injected_error(9)
+        if error:
+            return {"error": error}
+
+        if method == "groups.getLongPollServer":
+            return {"response": {
+                "server": f"http://{self.host}:{self.port}/lp/{chat.group_id}",
+                "key": chat.key,
+                "ts": str(chat.next_ts),
+            }}
+        if method == "messages.getHistory":
+            return {"response": self._get_history(chat, params)}
+        if method == "messages.getConversationMembers":
+            return {"response": self._get_conversation_members(chat)}
+        if method == "users.get":
+            return {"response": self._get_users(params)}
+        if method == "groups.getById":
+            return {"response": [{"id": int(chat.group_id), "name": f"Group {chat.group_id}",
+                                  "screen_name": f"club{chat.group_id}", "is_closed": 0, "type": "group"}]}
+
+        return {"error": {"error_code": 3, "error_msg": "Unknown method passed"}}
+
+    @staticmethod
+    def _parse_execute(code: str) -> List[Any]:
+        """Разбирает вызовы API.method({...}) из кода, формируемого VKClient.execute"""
+        decoder = json.JSONDecoder()
+        calls = []
+        for match in re.finditer(r"API\.([\w.]+)\(", code):
+            params, _ = decoder.raw_decode(code, match.end())
+            calls.append((match.group(1), params))
+        return calls
+
+    @staticmethod
+    def _parse_projections(code: str) -> Dict[int, List[str]]:
+        """Поля проекции r<номер>.items@.<поле> по номерам вызовов execute"""
+        projections: Dict[int, List[str]] = {}
+        for match in re.finditer(r"r(\d+)\.items@\.(\w+)", code):
+            projections.setdefault(int(match.group(1)), []).append(match.group(2))
+        return projections
+
+    def _get_history(self, chat: StandInChat, params: Dict[str, Any]) -> Dict[str, Any]:
+        """messages.getHistory: сообщения от новых к старым, с поддержкой start_message_id"""
+        count = min(int(params.get("count", 20)), 200)
+        offset = int(params.get("offset", 0))
+        if "start_message_id" in params:
+            if offset < 0 and self.history_includes_start:
+                # Страница более новых сообщений включает и само сообщение start_message_id
+                offset += 1
+            offset += chat.newer_count(int(params["start_message_id"]))
+        return {"count": chat.message_count, "items": chat.newest_first(offset, count)}
+
+    @staticmethod
+    def _get_conversation_members(chat: StandInChat) -> Dict[str, Any]:
+        """messages.getConversationMembers: участники, профили и сообщество-владелец"""
+        members = sorted(chat.members)
+        items = [{"member_id": user_id, "invited_by": members[0], "join_date": 1700000000, "is_admin": False}
+                 for user_id in members]
+        items.append({"member_id": -int(chat.group_id), "invited_by": members[0] if members else 0,
+                      "join_date": 1700000000, "is_admin": True})
+        profiles = [{"id": user_id, "first_name": "Имя", "last_name": f"Фамилия {user_id}",
+                     "can_access_closed": True, "is_closed": False, "sex": 0, "screen_name": f"id{user_id}",
+                     "photo_50": "https://vk.com/images/camera_50.png", "online": 0}
+                    for user_id in members]
+        return {"count": len(items), "items": items, "profiles": profiles, "groups": []}
+
+    def _get_users(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """users.get: поле deactivated для удаленных и заблокированных пользователей"""
+        users = []
+        for user_id in str(params.get("user_ids", "")).split(","):
+            if not user_id.strip():
+                continue
+            user = {"id": int(user_id), "first_name": "Имя", "last_name": f"Фамилия {user_id}"}
+            deactivated = self.deactivated.get(int(user_id))
+            if deactivated:
+                user["deactivated"] = deactivated
+            else:
+                user.update({"can_access_closed": True, "is_closed": False})
+            users.append(user)
+        return users
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        """Счетчики запросов, вызовов по методам, подмешанных ошибок и переданных байт"""
+        return web.json_response(dict(self.stats))
+
+    async def _handle_long_poll(self, request: web.Request) -> web.Response:
+        chat = self.chats.get(request.match_info["group_id"])
+        if chat is None or request.query.get("key") != chat.key:
+            return web.json_response({"failed": 2})
+
+        ts = int(request.query.get("ts", 0))
+        if ts < chat.first_ts or ts > chat.next_ts:
+            return web.json_response({"failed": 1, "ts": str(chat.next_ts)})
+
+        wait = min(int(request.query.get("wait", 25)), 90)
+        deadline = time.monotonic() + wait
+        while ts == chat.next_ts:
+            chat.changed.clear()
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(chat.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if request.query.get("key") != chat.key:
+                return web.json_response({"failed": 2})
+            if ts < chat.first_ts:
+                return web.json_response({"failed": 1, "ts": str(chat.next_ts)})
+
+        updates = chat.events[ts - chat.first_ts:]
+        return web.json_response({"ts": str(chat.next_ts), "updates": updates})
+
+def parse_error_rates(values: List[str]) -> Dict[int, float]:
+    """Разбирает доли ошибок вида 6=0.01"""
+    rates = {}
+    for value in values:
+        code, rate = value.split("=", 1)
+        if int(code) not in INJECTED_ERRORS:
+            raise ValueError(f"Error {code} cannot be injected (supported: {', '.join(map(str, INJECTED_ERRORS))})")
+        rates[int(code)] = float(rate)
+    return rates
+
+async def run_demo(port: int, rate: float):
+    """Запускает сервер с чатами из конфигурации и случайными сообщениями"""
+    standin = VKStandIn(port=port)
+    for chat in config.get_vk_chats() or config.VK_CHATS:
+        standin.add_chat(chat["group_id"], chat["token"], members=range(1, 51))
+    await standin.start()
+
+    try:
+        while True:
+            await asyncio.sleep(1 / rate)
+            group_id = random.choice(list(standin.chats))
+            standin.post_message(group_id, random.randint(1, 50), "demo")
+    finally:
+        await standin.stop()
+
+async def run_synthetic(port: int, chats: int, options: Dict[str, Any], populate: Dict[str, Any]):
+    """Запускает сервер с синтетическими чатами synthetic_chats(chats) до остановки процесса"""
+    standin = VKStandIn(port=port, **options)
+    standin.populate(synthetic_chats(chats), **populate)
+    await standin.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+def serve_synthetic(port: int, chats: int, options: Dict[str, Any], populate: Dict[str, Any]):
+    """Точка входа для отдельного процесса (бенчмарк анализа)"""
+    asyncio.run(run_synthetic(port, chats, options, populate))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена VK API с Long Poll")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=float, default=1.0, help="Сообщений в секунду по всем чатам")
+    parser.add_argument("--chats", type=int, default=0, help="Синтетических чатов (0 - чаты из конфигурации)")
+    parser.add_argument("--members", type=int, default=200, help="Участников в синтетическом чате")
+    parser.add_argument("--messages", type=int, default=1000, help="Сообщений в синтетическом чате")
+    parser.add_argument("--errors", nargs="*", default=[], help="Доли ошибок VK, например 6=0.01 9=0.005 27=0.001")
+    parser.add_argument("--latency", type=float, default=0.0, help="Средняя задержка ответа, секунд")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Доля медленных ответов")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Задержка медленного ответа, секунд")
+    args = parser.parse_args()
+    if args.chats:
+        serve_synthetic(args.port, args.chats, {
+            "error_rates": parse_error_rates(args.errors), "latency": args.latency,
+            "slow_rate": args.slow_rate, "slow_latency": args.slow_latency,
+        }, {"members": args.members, "messages": args.messages})
+    else:
+        asyncio.run(run_demo(args.port, args.rate))